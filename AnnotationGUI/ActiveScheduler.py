@@ -0,0 +1,220 @@
+import bisect
+import heapq
+import argparse
+import numpy as np
+from AnnotationGUI import Interpolation
+
+
+def cumulative_motion(profiles):
+    """
+    Computes a "motion time" of the frames of a video from their row profiles (see SceneSegmentation): the motion time
+    advances with the change of the row profile from each frame to the next, and is normalized to advance by one per
+    frame on average. Static stretches of the video take little motion time, stretches where the horizon moves take a
+    lot of it.
+    :param profiles: an array of shape (frames_nbr, profile_rows) of row profiles (np.nan for undecoded frames)
+    :return: a float64 array of shape (frames_nbr,), increasing, starting at 0
+    """
+    change = np.abs(np.diff(profiles.astype(np.float64), axis=0)).mean(axis=1)
+    change[~np.isfinite(change)] = np.nanmax(change) if np.isfinite(change).any() else 1
+    change += 1e-3 * change.mean() + 1e-12  # static frames still take some time: gaps never get an error of 0
+    motion = np.concatenate(([0], np.cumsum(change)))
+    return motion * (len(motion) - 1) / max(motion[-1], 1e-12)
+
+
+NO_KEYFRAME = -1  # a or b of the gaps (a, b) before the first keyframe and after the last one
+
+
+class ActiveScheduler:
+    """
+    Proposes the next most useful frame to annotate: the frame where the error of interpolating the validated frames
+    (keyframes) is expected to be the highest.
+
+    Errors are estimated in motion time m (the frame index, or the cumulative image change if signatures are
+    available, see cumulative_motion), so that static stretches of a video count as short ones:
+        * the first and last frames come first (frames outside the keyframes can't be interpolated at all),
+        * between two keyframes a and b, the error of linear interpolation of a horizon with curvature c is at most
+          c * (m[b] - m[a]) ** 2 / 8, at the frame halfway through the gap in motion time. c is estimated at each
+          keyframe from its deviation from the interpolation of its two neighbouring keyframes (the largest deviation of
+          the end points' ordinates), and the larger estimate of a and b is used,
+        * a Brownian term sqrt(prior_sigma2 * (m[b] - m[a]) / 4) accounts for what can't be seen from the keyframes: a
+          long gap is split even if its keyframes agree.
+
+    Gaps are kept in a priority queue (a heap with lazy deletion), updated incrementally when a keyframe is added or
+    removed: only the gaps whose estimate depends on it are recomputed.
+    """
+    def __init__(self, frames_nbr, motion=None, prior_sigma2=0.01):
+        """
+        :param frames_nbr: number of frames of the video
+        :param motion: motion time of each frame (see cumulative_motion), or None to use frame indexes
+        :param prior_sigma2: variance (in squared pixels per frame of motion time) of the Brownian term
+        """
+        self.frames_nbr = frames_nbr
+        self.motion = np.arange(frames_nbr, dtype=np.float64) if motion is None else np.asarray(motion, np.float64)
+        self.prior_sigma2 = prior_sigma2
+        self.keyframes = []  # sorted indexes of validated frames
+        self.ends = {}  # keys are keyframes, values are their end point ordinates (ys, ye)
+        self._gaps = {}  # keys are gaps (a, b), values are tuples (expected error, proposed frame)
+        self._heap = []  # entries (-expected error, a, b); an entry is stale if it doesn't match self._gaps
+        self._update_gap(NO_KEYFRAME, NO_KEYFRAME)
+
+    def set_keyframes(self, indexes, xy_ends):
+        """
+        Rebuilds the queue from scratch.
+        :param indexes: indexes of the validated frames
+        :param xy_ends: array of shape (frames_nbr, 4) of end points (xs, ys, xe, ye) of the annotations
+        """
+        self.keyframes = sorted(int(i) for i in indexes)
+        self.ends = {i: (float(xy_ends[i, 1]), float(xy_ends[i, 3])) for i in self.keyframes}
+        self._gaps, self._heap = {}, []
+        bounds = [NO_KEYFRAME] + self.keyframes + [NO_KEYFRAME]
+        for a, b in zip(bounds[:-1], bounds[1:]):
+            self._update_gap(a, b)
+
+    def add_keyframe(self, index, ys, ye):
+        """
+        Records the validation of the frame 'index', whose annotation has end point ordinates ys and ye.
+        """
+        index = int(index)
+        if index not in self.ends:
+            k = bisect.bisect_left(self.keyframes, index)
+            self._gaps.pop(self._gap_at(k), None)  # the gap split by the new keyframe
+            self.keyframes.insert(k, index)
+        self.ends[index] = (float(ys), float(ye))
+        self._update_around(index)
+
+    def remove_keyframe(self, index):
+        """
+        Records the deletion of the annotation of the frame 'index'.
+        """
+        index = int(index)
+        if index not in self.ends:
+            return
+        k = bisect.bisect_left(self.keyframes, index)
+        self._gaps.pop(self._gap_at(k), None)
+        self._gaps.pop(self._gap_at(k + 1), None)
+        del self.keyframes[k]
+        del self.ends[index]
+        self._update_around(index)
+
+    def next_frame(self, exclude=()):
+        """
+        :param exclude: indexes of frames not to propose (e.g., the current frame)
+        :return: a tuple (index, expected error in pixels) of the most useful frame to annotate, or None if all frames
+        are validated
+        """
+        held, best = [], None
+        while self._heap:
+            negative_error, a, b = self._heap[0]
+            current = self._gaps.get((a, b))
+            if current is None or current[0] != -negative_error:
+                heapq.heappop(self._heap)  # stale entry
+            elif current[1] in exclude:
+                held.append(heapq.heappop(self._heap))
+            else:
+                best = (current[1], current[0])
+                break
+        for entry in held:
+            heapq.heappush(self._heap, entry)
+        return best
+
+    def _gap_at(self, k):
+        # the gap between self.keyframes[k - 1] and self.keyframes[k]
+        a = self.keyframes[k - 1] if k > 0 else NO_KEYFRAME
+        b = self.keyframes[k] if k < len(self.keyframes) else NO_KEYFRAME
+        return a, b
+
+    def _update_around(self, index):
+        # recomputes the gaps near the frame 'index': the curvature estimates of the keyframes around it change
+        k = bisect.bisect_left(self.keyframes, index)
+        for j in range(max(k - 2, 0), min(k + 3, len(self.keyframes) + 1)):
+            self._update_gap(*self._gap_at(j))
+
+    def _curvature(self, k):
+        """
+        :return: the curvature estimated at the keyframe self.keyframes[k] (in pixels per squared frame of motion time),
+        or 0 if it doesn't have a keyframe on both sides
+        """
+        if not 0 < k < len(self.keyframes) - 1:
+            return 0.0
+        i, j, l = self.keyframes[k - 1], self.keyframes[k], self.keyframes[k + 1]
+        mi, mj, ml = self.motion[i], self.motion[j], self.motion[l]
+        t = (mj - mi) / (ml - mi)
+        deviation = max(abs(self.ends[j][c] - ((1 - t) * self.ends[i][c] + t * self.ends[l][c])) for c in (0, 1))
+        return 2 * deviation / ((mj - mi) * (ml - mj))
+
+    def _update_gap(self, a, b):
+        motion, last = self.motion, self.frames_nbr - 1
+        if a == NO_KEYFRAME:  # frames before the first keyframe (or no keyframe at all): start with the first frame
+            error, frame = (np.inf, 0) if b != 0 else (0, None)
+        elif b == NO_KEYFRAME:
+            error, frame = (np.inf, last) if a != last else (0, None)
+        elif b - a >= 2:
+            halfway = (motion[a] + motion[b]) / 2
+            frame = int(np.clip(a + np.searchsorted(motion[a:b + 1], halfway), a + 1, b - 1))
+            k = bisect.bisect_left(self.keyframes, a)
+            curvature = max(self._curvature(k), self._curvature(k + 1))
+            duration = motion[b] - motion[a]
+            error = curvature * duration ** 2 / 8 + np.sqrt(self.prior_sigma2 * duration / 4)
+        else:
+            error, frame = 0, None
+        if frame is None or frame in self.ends or not error > 0:
+            self._gaps.pop((a, b), None)
+            return
+        self._gaps[(a, b)] = (float(error), frame)
+        heapq.heappush(self._heap, (-float(error), a, b))
+
+
+def _max_interpolation_error(gt, flags, org_w):
+    """
+    :return: the largest distance (in pixels, on the end points' ordinates) between the linear interpolation of the
+    keyframes of gt and gt itself, np.inf if some frames can't be interpolated
+    """
+    keyframes = Interpolation.is_keyframe(flags)
+    Y_alpha = np.where(keyframes[:, None], gt[:, 0:2], np.nan)
+    indexes, _, xy_ends = Interpolation.interpolate_gaps(Y_alpha, flags, org_w)
+    if np.count_nonzero(keyframes) + indexes.size < len(gt):
+        return np.inf
+    return float(np.max(np.abs(xy_ends[:, [1, 3]] - gt[indexes][:, [3, 5]]), initial=0))
+
+
+def simulate(gt, org_w, target_error, motion=None):
+    """
+    Simulates the annotation of a fully annotated video: frames proposed by ActiveScheduler are validated (with their
+    annotation in gt) until the largest error of linear interpolation is lower than target_error. For comparison,
+    finds the largest fixed browsing offset reaching the same target.
+    :param gt: array of shape (N, 6) of gt rows of all frames
+    :param org_w: width of the frames
+    :param target_error: target maximum interpolation error, in pixels
+    :param motion: motion time of the frames (see cumulative_motion), or None
+    :return: a dictionary {"active": annotations needed, "fixed_offset": largest offset reaching the target,
+    "fixed": annotations needed with that offset}
+    """
+    frames_nbr = len(gt)
+    scheduler = ActiveScheduler(frames_nbr, motion=motion)
+    flags = np.zeros(frames_nbr, dtype=np.uint8)
+    while True:
+        proposal = scheduler.next_frame()
+        if proposal is None:
+            break
+        flags[proposal[0]] = Interpolation.VALIDATED
+        scheduler.add_keyframe(proposal[0], gt[proposal[0], 3], gt[proposal[0], 5])
+        if _max_interpolation_error(gt, flags, org_w) < target_error:
+            break
+    best_offset = 1
+    for offset in np.unique(np.geomspace(1, max(frames_nbr // 2, 1), 60).astype(int)):
+        fixed_flags = np.zeros(frames_nbr, dtype=np.uint8)
+        fixed_flags[::offset] = fixed_flags[-1] = Interpolation.VALIDATED
+        if _max_interpolation_error(gt, fixed_flags, org_w) < target_error:
+            best_offset = int(offset)
+    return {"active": int(np.count_nonzero(flags)), "fixed_offset": best_offset,
+            "fixed": len(range(0, frames_nbr, best_offset)) + ((frames_nbr - 1) % best_offset != 0)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Simulates active annotation of fully annotated gt files.")
+    parser.add_argument("gt_files", nargs="+", help="gt files (<video name>_LineGT.npy) with all frames annotated")
+    parser.add_argument("--width", type=int, required=True, help="frame width")
+    parser.add_argument("--target", type=float, default=2.0, help="target maximum interpolation error, in pixels")
+    args = parser.parse_args()
+    for gt_file in args.gt_files:
+        print(gt_file, simulate(np.load(gt_file), args.width, args.target))
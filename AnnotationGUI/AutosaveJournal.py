@@ -0,0 +1,161 @@
+import os
+import numpy as np
+from AnnotationGUI import Interpolation
+
+# A journal file starts with a header (magic bytes and number of frames), followed by fixed-size records. Each record
+# holds the new state of one frame: its index, its annotation flag (see Interpolation) and its gt row
+# (Y, alpha, xs, ys, xe, ye).
+JOURNAL_MAGIC = b"HLJ1"
+HEADER_DTYPE = np.dtype([("magic", "S4"), ("frames_nbr", "<i8")])
+RECORD_DTYPE = np.dtype([("index", "<i8"), ("flag", "u1"), ("gt", "<f4", (6,))])
+
+
+class AnnotationJournal:
+    """
+    A crash-safe autosave of annotations. Every change of a frame's annotation is appended to a journal file next to
+    the video (<video name>_LineGT.journal) as a small fixed-size record, so that saving a change costs the same
+    whatever the length of the video. Records are flushed to the operating system as soon as they're written, which
+    makes them survive a crash of the program.
+
+    Compaction merges the journal into an autosaved gt file next to the video (<video name>_LineGT.npy, the same format
+    as files saved with "Save annotated file", with its _LineGT_flags.npy), then empties the journal. Reopening the video
+    loads the autosaved gt file and replays the journal on top of it.
+    """
+    def __init__(self, video_file_path, frames_nbr):
+        """
+        :param video_file_path: path of the annotated video file
+        :param frames_nbr: number of frames of the video
+        """
+        self.video_file_path = video_file_path
+        self.journal_path, self.gt_path, self.flags_path = self.paths(video_file_path)
+        self.frames_nbr = frames_nbr
+        self.records_nbr = 0  # number of records in the journal
+        self._valid = False  # True if the journal file read by self.read_records has a valid header
+        self._file = None
+
+    @staticmethod
+    def paths(video_file_path):
+        """
+        :return: a tuple (journal path, autosaved gt file path, autosaved flags file path) of the video file
+        """
+        base = os.path.splitext(video_file_path)[0]
+        return base + "_LineGT.journal", base + "_LineGT.npy", base + "_LineGT_flags.npy"
+
+    @classmethod
+    def read_files(cls, video_file_path):
+        """
+        Reads the autosave files of a video file: the I/O part of self.restore, which doesn't need the number of frames
+        and can run in a background thread (e.g., while the video is being indexed).
+        :return: a tuple (gt, flags, journal_data): the autosaved gt array, flags array and the raw bytes of the journal
+        (None for missing files)
+        """
+        journal_path, gt_path, flags_path = cls.paths(video_file_path)
+        gt = np.load(gt_path) if os.path.exists(gt_path) else None
+        flags = np.load(flags_path) if os.path.exists(flags_path) else None
+        journal_data = None
+        if os.path.exists(journal_path):
+            with open(journal_path, "rb") as journal:
+                journal_data = journal.read()
+        return gt, flags, journal_data
+
+    def _open(self, truncate):
+        if self._file is not None:
+            self._file.close()
+        self._file = open(self.journal_path, "wb" if truncate else "ab")
+        if self._file.tell() == 0:
+            header = np.array([(JOURNAL_MAGIC, self.frames_nbr)], dtype=HEADER_DTYPE)
+            self._file.write(header.tobytes())
+            self._file.flush()
+
+    def restore(self, gt_Y_alpha, gt_xy_ends, gt_flags, files=None):
+        """
+        Restores autosaved annotations into the given arrays (modified in place): loads the autosaved gt file if any,
+        then replays the journal. Then opens the journal for appending.
+        :param files: the autosave files already read by self.read_files, or None to read them now
+        :return: True if any annotation was restored, False otherwise
+        """
+        gt, flags, journal_data = self.read_files(self.video_file_path) if files is None else files
+        restored = False
+        if gt is not None and len(gt) == self.frames_nbr:
+            gt_Y_alpha[:] = gt[:, 0:2]
+            gt_xy_ends[:] = np.round(gt[:, 2:]) if gt_xy_ends.dtype.kind == 'i' else gt[:, 2:]
+            gt_flags[:] = Interpolation.flags_for_gt(gt, flags)
+            restored = True
+        records = self.read_records(journal_data)
+        if records.size:
+            # when a frame has several records, the last one wins
+            _, last = np.unique(records["index"][::-1], return_index=True)
+            records = records[::-1][last]
+            gt_Y_alpha[records["index"]] = records["gt"][:, 0:2]
+            xy_ends = records["gt"][:, 2:]
+            gt_xy_ends[records["index"]] = np.round(xy_ends) if gt_xy_ends.dtype.kind == 'i' else xy_ends
+            gt_flags[records["index"]] = records["flag"]
+            restored = True
+        # drop what follows the last complete record (if the journal is invalid, it's started again)
+        valid_bytes = HEADER_DTYPE.itemsize + self.records_nbr * RECORD_DTYPE.itemsize if self._valid else 0
+        if os.path.exists(self.journal_path) and valid_bytes:
+            os.truncate(self.journal_path, valid_bytes)
+        self._open(truncate=valid_bytes == 0)
+        return restored
+
+    def read_records(self, data=None):
+        """
+        :param data: the raw bytes of the journal file (see self.read_files), or None to read the file now
+        :return: the records of the journal file (a structured array of RECORD_DTYPE). A record truncated by a crash is
+        ignored, as well as a journal written for a different number of frames.
+        """
+        self._valid = False
+        self.records_nbr = 0
+        if data is None:
+            if not os.path.exists(self.journal_path):
+                return np.zeros(0, dtype=RECORD_DTYPE)
+            with open(self.journal_path, "rb") as journal:
+                data = journal.read()
+        if len(data) < HEADER_DTYPE.itemsize:
+            return np.zeros(0, dtype=RECORD_DTYPE)
+        header = np.frombuffer(data, dtype=HEADER_DTYPE, count=1)[0]
+        if header["magic"] != JOURNAL_MAGIC or header["frames_nbr"] != self.frames_nbr:
+            return np.zeros(0, dtype=RECORD_DTYPE)
+        self._valid = True
+        records_nbr = (len(data) - HEADER_DTYPE.itemsize) // RECORD_DTYPE.itemsize
+        records = np.frombuffer(data, dtype=RECORD_DTYPE, count=records_nbr, offset=HEADER_DTYPE.itemsize)
+        self.records_nbr = records_nbr
+        return records[(records["index"] >= 0) & (records["index"] < self.frames_nbr)]
+
+    def append(self, indexes, gt_Y_alpha, gt_xy_ends, gt_flags):
+        """
+        Appends the current annotations of the frames 'indexes' to the journal, with a single write.
+        :param indexes: an index or an array of indexes of changed frames
+        """
+        indexes = np.atleast_1d(indexes)
+        records = np.zeros(indexes.size, dtype=RECORD_DTYPE)
+        records["index"] = indexes
+        records["flag"] = gt_flags[indexes]
+        records["gt"][:, 0:2] = gt_Y_alpha[indexes]
+        records["gt"][:, 2:] = gt_xy_ends[indexes]
+        self._file.write(records.tobytes())
+        self._file.flush()
+        self.records_nbr += indexes.size
+
+    def compact(self, gt_Y_alpha, gt_xy_ends, gt_flags):
+        """
+        Writes the autosaved gt file from the given arrays, then empties the journal. The gt file is replaced
+        atomically, so that a crash during compaction leaves either the old gt file with the full journal, or the new
+        gt file.
+        """
+        gt_Y_alpha_xy_ends = np.zeros(shape=(self.frames_nbr, 6), dtype=np.float32)
+        gt_Y_alpha_xy_ends[:, 0:2] = gt_Y_alpha
+        gt_Y_alpha_xy_ends[:, 2::] = gt_xy_ends
+        for path, array in ((self.flags_path, gt_flags), (self.gt_path, gt_Y_alpha_xy_ends)):
+            with open(path + ".tmp", "wb") as tmp_file:
+                np.save(tmp_file, array)
+                tmp_file.flush()
+                os.fsync(tmp_file.fileno())
+            os.replace(path + ".tmp", path)
+        self._open(truncate=True)
+        self.records_nbr = 0
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,263 @@
+"""
+Headless command-line processing of whole dataset directories (no display needed).
+
+Usage examples:
+    python -m AnnotationGUI.BatchCLI coverage "D:/Datasets/Onshore"
+    python -m AnnotationGUI.BatchCLI interpolate "D:/Datasets/Onshore" --out "D:/Datasets/Filled" --method spline
+    python -m AnnotationGUI.BatchCLI rescale "D:/Datasets/Onshore" --out "D:/Datasets/720p" --size 1280x720
+    python -m AnnotationGUI.BatchCLI export "D:/Datasets/Onshore" --out "D:/Datasets/CSV" --format csv
+    python -m AnnotationGUI.BatchCLI export "D:/Datasets/Onshore" --out "D:/Datasets/Masks" --masks npz --mask-size 640x360
+    python -m AnnotationGUI.BatchCLI refine "D:/Datasets/Onshore" --out "D:/Datasets/Refined" --band 8
+
+Each gt file (<video name>_LineGT.npy) found under the given directory is a job. Jobs run in a pool of processes,
+and a line is printed for each finished job, followed by a timing report.
+"""
+import os
+import sys
+import time
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from AnnotationGUI import Interpolation
+from AnnotationGUI.Geometry import rescale_gt
+
+VIDEO_EXTENSIONS = (".avi", ".mp4", ".mov", ".mkv")
+GT_SUFFIX = "_LineGT.npy"
+
+
+def find_dataset_files(root):
+    """
+    Walks the directory root.
+    :return: a tuple (gt_paths, videos_without_gt), where gt_paths is the sorted list of gt files and videos_without_gt
+    the sorted list of video files with no gt file next to them
+    """
+    gt_paths, video_paths = [], []
+    for dir_path, _, file_names in os.walk(root):
+        for file_name in file_names:
+            if file_name.endswith(GT_SUFFIX):
+                gt_paths.append(os.path.join(dir_path, file_name))
+            elif file_name.lower().endswith(VIDEO_EXTENSIONS):
+                video_paths.append(os.path.join(dir_path, file_name))
+    gt_bases = {path[:-len(GT_SUFFIX)] for path in gt_paths}
+    videos_without_gt = [path for path in video_paths if os.path.splitext(path)[0] not in gt_bases]
+    return sorted(gt_paths), sorted(videos_without_gt)
+
+
+def video_key(gt_path, root):
+    """
+    :return: the name of the video of the gt file gt_path in the dataset root: its path relative to root, without the
+    gt suffix and with '/' separators (e.g., 'Onshore/MVI_1478_VIS'), so that videos with the same file name in
+    different directories are told apart
+    """
+    return os.path.relpath(gt_path, root)[:-len(GT_SUFFIX)].replace(os.sep, "/")
+
+
+def find_video(gt_path):
+    """
+    :return: path of the video file the gt file gt_path belongs to (in the same directory), or None
+    """
+    base = gt_path[:-len(GT_SUFFIX)]
+    for extension in VIDEO_EXTENSIONS + tuple(e.upper() for e in VIDEO_EXTENSIONS):
+        if os.path.exists(base + extension):
+            return base + extension
+    return None
+
+
+def video_size(video_path):
+    """
+    :return: the frame size (width, height) of the video file video_path
+    """
+    import cv2 as cv  # only jobs needing the size of a video import OpenCV
+    reader = cv.VideoCapture(video_path)
+    size = int(reader.get(cv.CAP_PROP_FRAME_WIDTH)), int(reader.get(cv.CAP_PROP_FRAME_HEIGHT))
+    reader.release()
+    return size
+
+
+def load_gt_and_flags(gt_path):
+    """
+    :return: a tuple (gt, flags): the gt array of shape (N, 6) and its per-frame flags (from the _LineGT_flags.npy
+    file next to it, or VALIDATED for annotated frames if there is none or if it doesn't match gt)
+    """
+    gt = np.load(gt_path)
+    flags_path = os.path.splitext(gt_path)[0] + "_flags.npy"
+    return gt, Interpolation.flags_for_gt(gt, np.load(flags_path) if os.path.exists(flags_path) else None)
+
+
+def output_path(gt_path, root, out_dir, extension=None):
+    """
+    :return: path of the output file of gt_path, mirroring its location under root into out_dir
+    """
+    path = os.path.join(out_dir, os.path.relpath(gt_path, root))
+    if extension is not None:
+        path = os.path.splitext(path)[0] + extension
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def nan_runs(mask):
+    """
+    :return: an array of the lengths of the runs of True values in the boolean array mask
+    """
+    padded = np.concatenate(([False], mask, [False])).astype(np.int8)
+    changes = np.flatnonzero(np.diff(padded))
+    return changes[1::2] - changes[0::2]
+
+
+def job_coverage(gt_path, args):
+    gt, flags = load_gt_and_flags(gt_path)
+    nan = np.isnan(gt[:, 0])
+    runs = nan_runs(nan)
+    return {"frames": len(gt), "nan_frames": int(np.count_nonzero(nan)),
+            "validated": int(np.count_nonzero(flags == Interpolation.VALIDATED)),
+            "interpolated": int(np.count_nonzero(flags == Interpolation.INTERPOLATED)),
+            "tracked": int(np.count_nonzero(flags == Interpolation.TRACKED)),
+            "propagated": int(np.count_nonzero(flags == Interpolation.PROPAGATED)),
+            "longest_nan_run": int(runs.max()) if runs.size else 0}
+
+
+def job_interpolate(gt_path, args):
+    gt, flags = load_gt_and_flags(gt_path)
+    video_path = find_video(gt_path)
+    org_w = args.width or (video_size(video_path)[0] if video_path else None)
+    if org_w is None:
+        raise ValueError("frame width unknown: no video next to the gt file, use --width")
+    indexes, Y_alpha, xy_ends = Interpolation.interpolate_gaps(gt[:, 0:2], flags, org_w, method=args.method)
+    gt[indexes, 0:2] = Y_alpha
+    gt[indexes, 2:] = xy_ends
+    flags[indexes] = Interpolation.INTERPOLATED
+    path = output_path(gt_path, args.root, args.out)
+    np.save(path, gt)
+    np.save(os.path.splitext(path)[0] + "_flags.npy", flags)
+    return {"frames": len(gt), "filled": int(indexes.size), "nan_frames": int(np.count_nonzero(np.isnan(gt[:, 0])))}
+
+
+def job_rescale(gt_path, args):
+    gt, flags = load_gt_and_flags(gt_path)
+    if args.src_size is not None:
+        org_size = args.src_size
+    else:
+        video_path = find_video(gt_path)
+        if video_path is None:
+            raise ValueError("source frame size unknown: no video next to the gt file, use --src-size")
+        org_size = video_size(video_path)
+    rescaled = rescale_gt(gt, org_size, args.size)
+    path = output_path(gt_path, args.root, args.out)
+    np.save(path, rescaled)
+    np.save(os.path.splitext(path)[0] + "_flags.npy", flags)
+    return {"frames": len(gt), "from": "{}x{}".format(*org_size), "to": "{}x{}".format(*args.size)}
+
+
+def job_export(gt_path, args):
+    from AnnotationGUI.Exporter import export_gt  # only export jobs import the exporter
+    gt, flags = load_gt_and_flags(gt_path)
+    org_size = None
+    if args.masks is not None:
+        org_size = args.src_size
+        if org_size is None:
+            video_path = find_video(gt_path)
+            if video_path is None:
+                raise ValueError("frame size unknown: no video next to the gt file, use --src-size")
+            org_size = video_size(video_path)
+    path = output_path(gt_path, args.root, args.out, extension="")
+    # files are already processed in parallel: masks of a file are rasterized in the job's process
+    written = export_gt(gt, flags, os.path.dirname(path), os.path.basename(path), org_size, args.format or ["csv"],
+                        args.masks, args.mask_size, args.memory_mb, workers=1)
+    return {"frames": len(gt), **written}
+
+
+def job_refine(gt_path, args):
+    from AnnotationGUI.LineRefinement import refine_video  # only refinement jobs import OpenCV
+    gt, flags = load_gt_and_flags(gt_path)
+    video_path = find_video(gt_path)
+    if video_path is None:
+        raise ValueError("no video next to the gt file")
+    indexes = np.flatnonzero(flags == Interpolation.VALIDATED)
+    refined_gt, refined_mask = refine_video(video_path, gt, indexes, band=args.band)
+    path = output_path(gt_path, args.root, args.out)
+    np.save(path, refined_gt)
+    np.save(os.path.splitext(path)[0] + "_flags.npy", flags)
+    shift = np.abs(refined_gt[refined_mask, 0] - gt[refined_mask, 0])
+    return {"frames": len(gt), "validated": int(indexes.size), "refined": int(np.count_nonzero(refined_mask)),
+            "mean_Y_shift": float(shift.mean()) if shift.size else 0.0}
+
+
+JOBS = {"coverage": job_coverage, "interpolate": job_interpolate, "rescale": job_rescale, "export": job_export,
+        "refine": job_refine}
+
+
+def run_job(command, gt_path, args):
+    """
+    Runs the job 'command' on the gt file gt_path (in a worker process).
+    :return: a dictionary with the gt path, the status ('ok' or 'error'), the elapsed time and the job's results
+    """
+    start = time.perf_counter()
+    try:
+        result = {"status": "ok", **JOBS[command](gt_path, args)}
+    except Exception as error:  # a failing file must not stop the batch
+        result = {"status": "error", "error": repr(error)}
+    return {"gt_path": gt_path, "seconds": time.perf_counter() - start, **result}
+
+
+def parse_size(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Headless batch processing of horizon gt files.")
+    parser.add_argument("command", choices=sorted(JOBS), help="job to run on each gt file")
+    parser.add_argument("root", help="directory searched (recursively) for videos and gt files")
+    parser.add_argument("--out", help="output directory (required by interpolate, rescale and export)")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes (default: all CPUs)")
+    parser.add_argument("--method", choices=("linear", "spline"), default="linear", help="interpolation method")
+    parser.add_argument("--width", type=int, default=None, help="frame width (if no video is next to a gt file)")
+    parser.add_argument("--size", type=parse_size, help="new frame size WxH (rescale)")
+    parser.add_argument("--src-size", type=parse_size, default=None,
+                        help="original frame size WxH (rescale, export of masks)")
+    parser.add_argument("--format", action="append", choices=("csv", "json", "parquet"), default=None,
+                        help="export table format, repeatable (default: csv); parquet needs pyarrow")
+    parser.add_argument("--masks", choices=("memmap", "npz"), default=None, help="also export sky/sea masks (export)")
+    parser.add_argument("--mask-size", type=parse_size, default=None, help="mask size WxH (default: frame size)")
+    parser.add_argument("--memory-mb", type=int, default=512, help="memory budget of mask rasterization, per job")
+    parser.add_argument("--band", type=int, default=8, help="half-height in pixels of the band searched (refine)")
+    parser.add_argument("--report", help="write the per-file report to this JSON file")
+    args = parser.parse_args(argv)
+    if args.command != "coverage" and args.out is None:
+        parser.error("--out is required by " + args.command)
+    if args.command == "rescale" and args.size is None:
+        parser.error("--size is required by rescale")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    gt_paths, videos_without_gt = find_dataset_files(args.root)
+    start = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = [pool.submit(run_job, args.command, gt_path, args) for gt_path in gt_paths]
+        for done, future in enumerate(as_completed(futures), start=1):
+            result = future.result()
+            result["video"] = video_key(result["gt_path"], args.root)
+            results.append(result)
+            details = ", ".join("{}={}".format(k, v) for k, v in result.items()
+                                if k not in ("gt_path", "video", "status", "seconds"))
+            print("[{}/{}] {} {} ({:.2f} s) {}".format(done, len(futures), result["video"],
+                                                      result["status"], result["seconds"], details), flush=True)
+    elapsed = time.perf_counter() - start
+    errors = sum(result["status"] != "ok" for result in results)
+    print("{} gt files processed in {:.2f} s ({} errors, {:.2f} s of work)".format(
+        len(results), elapsed, errors, sum(result["seconds"] for result in results)))
+    for video_path in videos_without_gt:
+        print("no gt file: " + os.path.relpath(video_path, args.root))
+    if args.report:
+        with open(args.report, "w") as report_file:
+            json.dump({"command": args.command, "seconds": elapsed, "results": sorted(results, key=lambda r: r["gt_path"]),
+                       "videos_without_gt": videos_without_gt}, report_file, indent=2)
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
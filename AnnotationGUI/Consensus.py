@@ -0,0 +1,344 @@
+"""
+Consensus of several annotations of the same videos: each annotator produces a gt file (<video name>_LineGT.npy, in
+the (N, 6) layout of Geometry), the versions of a video are stacked into an array of shape (K, N, 6) and merged into
+one gt file: the median line of each frame, unless the annotators disagree on it (the frame is then "disputed").
+
+Usage examples:
+    python -m AnnotationGUI.Consensus "D:/Annotations/Alice" "D:/Annotations/Bob" "D:/Annotations/Carol" --out "D:/Merged"
+    python -m AnnotationGUI.Consensus --files alice_LineGT.npy bob_LineGT.npy --out "D:/Merged/video_LineGT.npy"
+    python -m AnnotationGUI.Consensus --benchmark
+
+Versions of a video are the gt files at the same relative path under each annotator directory (as in Evaluation). For
+each video, the merged gt file, its flags file and the list of disputed frames (<video name>_Disputed.json, see
+DisputedFrames) are written at the same relative path under --out. Put the list next to the video (or in the gt
+directory) to jump through the disputed frames in the GUI.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from AnnotationGUI import Interpolation
+from AnnotationGUI.Geometry import xy_ends_from_y_alpha
+from AnnotationGUI.BatchCLI import find_dataset_files, output_path, GT_SUFFIX
+
+DISPUTED_SUFFIX = "_Disputed.json"
+# reasons of a disputed frame (bit flags)
+Y_SPREAD = 1  # the Y values of the annotators spread over more than the Y threshold
+ALPHA_SPREAD = 2  # the alpha values of the annotators spread over more than the alpha threshold
+TOO_FEW = 4  # fewer annotators than required annotated the frame
+REASON_NAMES = {Y_SPREAD: "Y spread", ALPHA_SPREAD: "alpha spread", TOO_FEW: "too few annotators"}
+
+
+def stack_versions(gts):
+    """
+    :param gts: a list of K gt arrays of shape (N, 6) (versions of the annotation of one video)
+    :return: a float32 array of shape (K, N, 6)
+    """
+    lengths = {len(gt) for gt in gts}
+    if len(lengths) > 1:
+        raise ValueError("versions have different numbers of frames: {}".format(sorted(lengths)))
+    return np.stack([np.asarray(gt, dtype=np.float32) for gt in gts])
+
+
+def _sorted_median_and_range(values):
+    """
+    Vectorized median and range of each column of 'values', ignoring nan (columns are sorted once: nan go last).
+    :param values: array of shape (K, N)
+    :return: a tuple (median, range, count) of arrays of shape (N,) (median and range are nan where count is 0)
+    """
+    count = np.count_nonzero(~np.isnan(values), axis=0)
+    ordered = np.sort(values, axis=0)
+    last = np.maximum(count - 1, 0)[None]
+    lower = np.take_along_axis(ordered, ((count - 1) // 2).clip(0)[None], axis=0)[0]
+    upper = np.take_along_axis(ordered, (count // 2).clip(0, len(values) - 1)[None], axis=0)[0]
+    median = 0.5 * (lower + upper)
+    spread = np.take_along_axis(ordered, last, axis=0)[0] - ordered[0]
+    median[count == 0] = np.nan
+    spread[count == 0] = np.nan
+    return median, spread, count
+
+
+def infer_org_w(stack):
+    """
+    :return: width of the original frames of gt rows (lines end at x = org_w - 1, see Geometry), or None if no row is
+    annotated
+    """
+    xe = stack[..., 4]
+    if np.isnan(xe).all():
+        return None
+    return int(round(float(np.nanmax(xe)))) + 1
+
+
+def consensus(stack, y_threshold=5.0, alpha_threshold=1.0, min_annotators=None, org_w=None):
+    """
+    Computes the per-frame agreement of K versions of an annotation (vectorized over the frames).
+    :param stack: array of shape (K, N, 6) of gt rows (see stack_versions)
+    :param y_threshold: largest spread (max - min) of the Y values of a frame, in pixels, for it not to be disputed
+    :param alpha_threshold: largest spread of the alpha values of a frame, in degrees
+    :param min_annotators: smallest number of annotators of a frame for it to get a median line (default: a majority)
+    :param org_w: width of the original frames (default: inferred from the end points of the rows)
+    :return: a dictionary of arrays over the N frames:
+        * "gt": the median line (median of Y and median of alpha, end points recomputed from them), or nan where fewer
+          than min_annotators annotated the frame,
+        * "annotators": the number of versions annotating the frame,
+        * "Y_spread", "alpha_spread": max - min of Y and alpha over these versions (nan without annotation),
+        * "reasons": the reasons of disputed frames (Y_SPREAD | ALPHA_SPREAD | TOO_FEW bits, 0 if not disputed),
+        * "disputed": a boolean mask of frames annotated by at least one version with a non-zero reason.
+    """
+    stack = np.asarray(stack, dtype=np.float32)
+    versions = len(stack)
+    min_annotators = versions // 2 + 1 if min_annotators is None else min(max(min_annotators, 1), versions)
+    org_w = infer_org_w(stack) if org_w is None else org_w
+    rows_nan = np.isnan(stack).any(axis=2)  # degenerate or non-annotated rows don't count
+    Y = np.where(rows_nan, np.nan, stack[..., 0])
+    alpha = np.where(rows_nan, np.nan, stack[..., 1])
+    Y_median, Y_spread, count = _sorted_median_and_range(Y)
+    alpha_median, alpha_spread = _sorted_median_and_range(alpha)[0:2]
+
+    reasons = np.zeros(count.shape, dtype=np.uint8)
+    with np.errstate(invalid='ignore'):
+        reasons[Y_spread > y_threshold] |= Y_SPREAD
+        reasons[alpha_spread > alpha_threshold] |= ALPHA_SPREAD
+    reasons[(count > 0) & (count < min_annotators)] |= TOO_FEW
+    gt = np.full((count.size, 6), np.nan, dtype=np.float32)
+    merged = count >= min_annotators
+    if org_w is not None and merged.any():
+        gt[merged, 0] = Y_median[merged]
+        gt[merged, 1] = alpha_median[merged]
+        gt[merged, 2:] = xy_ends_from_y_alpha(Y_median[merged], alpha_median[merged], org_w)
+    return {"gt": gt, "annotators": count, "Y_spread": Y_spread, "alpha_spread": alpha_spread, "reasons": reasons,
+            "disputed": reasons != 0}
+
+
+class DisputedFrames:
+    """
+    The disputed frames of a merged annotation, in increasing order, with the values of each annotator (to be shown
+    while reviewing them). Saved as JSON (<video name>_Disputed.json).
+    """
+    def __init__(self, frames, reasons, Y, alpha, frames_nbr, versions=()):
+        """
+        :param frames: indexes of the disputed frames (sorted)
+        :param reasons: reason bits of each disputed frame (see consensus)
+        :param Y: array of shape (len(frames), K) of the Y values of each of the K annotators (nan if not annotated)
+        :param alpha: array of shape (len(frames), K) of the alpha values of each annotator
+        :param frames_nbr: number of frames of the video
+        :param versions: names of the K versions (e.g., paths of the gt files)
+        """
+        self.frames = np.asarray(frames, dtype=np.int64)
+        self.reasons = np.asarray(reasons, dtype=np.uint8)
+        self.Y = np.asarray(Y, dtype=np.float32)
+        self.alpha = np.asarray(alpha, dtype=np.float32)
+        self.annotators = self.Y.shape[1]
+        self.frames_nbr = int(frames_nbr)
+        self.versions = list(versions)
+
+    @classmethod
+    def from_consensus(cls, stack, result, versions=()):
+        frames = np.flatnonzero(result["disputed"])
+        return cls(frames, result["reasons"][frames], stack[:, frames, 0].T, stack[:, frames, 1].T, stack.shape[1],
+                   versions)
+
+    def __len__(self):
+        return self.frames.size
+
+    def next_frame(self, index):
+        """
+        :return: the first disputed frame after the frame 'index', or None
+        """
+        k = int(np.searchsorted(self.frames, index, side='right'))
+        return int(self.frames[k]) if k < self.frames.size else None
+
+    def previous_frame(self, index):
+        """
+        :return: the last disputed frame before the frame 'index', or None
+        """
+        k = int(np.searchsorted(self.frames, index, side='left')) - 1
+        return int(self.frames[k]) if k >= 0 else None
+
+    def describe(self, index):
+        """
+        :return: a text describing the disputed frame 'index' (its rank, reasons and the values of each annotator),
+        or None if it isn't disputed
+        """
+        k = int(np.searchsorted(self.frames, index))
+        if k == self.frames.size or self.frames[k] != index:
+            return None
+        reasons = ", ".join(name for bit, name in REASON_NAMES.items() if self.reasons[k] & bit)
+        values = " / ".join("-" if np.isnan(Y) else "{:.1f}".format(Y) for Y in self.Y[k])
+        angles = " / ".join("-" if np.isnan(a) else "{:.2f}".format(a) for a in self.alpha[k])
+        return "Disputed {}/{}: {}\nY: {}\nalpha: {}".format(k + 1, self.frames.size, reasons, values, angles)
+
+    def save(self, path):
+        def listed(values):  # nan are written as null
+            return [[None if np.isnan(v) else round(float(v), 3) for v in row] for row in values]
+
+        with open(path, "w") as disputed_file:
+            json.dump({"frames_nbr": self.frames_nbr, "annotators": self.annotators, "versions": self.versions,
+                       "frames": self.frames.tolist(),
+                       "reasons": self.reasons.tolist(), "Y": listed(self.Y), "alpha": listed(self.alpha)},
+                      disputed_file)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as disputed_file:
+            data = json.load(disputed_file)
+
+        def array(values):  # shape (frames, annotators), even without disputed frames
+            return np.array([[np.nan if v is None else v for v in row] for row in values],
+                            dtype=np.float32).reshape(len(values), data["annotators"])
+
+        return cls(data["frames"], data["reasons"], array(data["Y"]), array(data["alpha"]), data["frames_nbr"],
+                   data.get("versions", ()))
+
+
+def disputed_path(gt_path):
+    """
+    :return: path of the list of disputed frames of the gt file gt_path (<video name>_Disputed.json)
+    """
+    return gt_path[:-len(GT_SUFFIX)] + DISPUTED_SUFFIX if gt_path.endswith(GT_SUFFIX) else \
+        os.path.splitext(gt_path)[0] + DISPUTED_SUFFIX
+
+
+def merge_files(gt_paths, out_gt_path, y_threshold=5.0, alpha_threshold=1.0, min_annotators=None,
+                keep_disputed=False):
+    """
+    Merges versions of the annotation of one video (in a worker process): writes the merged gt file out_gt_path, its
+    flags file (VALIDATED where the annotators agree) and the list of disputed frames (see DisputedFrames).
+    :param keep_disputed: if True, disputed frames with enough annotators keep their median line, flagged
+    INTERPOLATED (to be reviewed); otherwise they're left non-annotated
+    :return: a tuple (out_gt_path, report), where report counts frames, merged and disputed frames (by reason), or
+    (out_gt_path, {"error": ...}) if the versions can't be merged
+    """
+    try:
+        stack = stack_versions([np.load(path) for path in gt_paths])
+        result = consensus(stack, y_threshold, alpha_threshold, min_annotators)
+    except Exception as error:  # a missing or malformed file must not stop the merge of the dataset
+        return out_gt_path, {"error": repr(error)}
+    gt, disputed = result["gt"], result["disputed"]
+    merged = ~np.isnan(gt[:, 0])
+    flags = np.where(merged, Interpolation.VALIDATED, Interpolation.NOT_ANNOTATED).astype(np.uint8)
+    if keep_disputed:
+        flags[merged & disputed] = Interpolation.INTERPOLATED
+    else:
+        gt[disputed] = np.nan
+        flags[disputed] = Interpolation.NOT_ANNOTATED
+    np.save(out_gt_path, gt)
+    np.save(os.path.splitext(out_gt_path)[0] + "_flags.npy", flags)
+    DisputedFrames.from_consensus(stack, result, versions=gt_paths).save(disputed_path(out_gt_path))
+    report = {"versions": len(gt_paths), "frames": len(gt), "agreed": int(np.count_nonzero(merged & ~disputed)),
+              "disputed": int(np.count_nonzero(disputed))}
+    for bit, name in REASON_NAMES.items():
+        report[name.replace(" ", "_")] = int(np.count_nonzero(result["reasons"] & bit))
+    return out_gt_path, report
+
+
+def find_versions(roots, min_versions=2):
+    """
+    :param roots: the annotator directories, searched recursively for gt files
+    :return: a tuple (versions, single), where versions is a dictionary {relative gt path: [gt path under each root
+    having it]} of the videos with at least min_versions versions, and single the sorted list of the other relative
+    paths
+    """
+    versions = {}
+    for root in roots:
+        for gt_path in find_dataset_files(root)[0]:
+            versions.setdefault(os.path.relpath(gt_path, root), []).append(gt_path)
+    single = sorted(relative for relative, paths in versions.items() if len(paths) < min_versions)
+    return {relative: paths for relative, paths in sorted(versions.items()) if len(paths) >= min_versions}, single
+
+
+def merge_directories(roots, out_dir, y_threshold=5.0, alpha_threshold=1.0, min_annotators=None, keep_disputed=False,
+                      workers=None, progress_callback=None):
+    """
+    Merges the versions of all videos found under the annotator directories roots, in a pool of processes.
+    :param progress_callback: a function called as progress_callback(relative gt path, report, done, total) for each
+    video
+    :return: a dictionary {"videos": {relative gt path: report}, "single": relative gt paths with a single version}
+    """
+    versions, single = find_versions(roots)
+    videos = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # output_path mirrors the relative path under out_dir (and creates its directory)
+        futures = {pool.submit(merge_files, paths, output_path(os.path.join(out_dir, relative), out_dir, out_dir),
+                               y_threshold, alpha_threshold, min_annotators, keep_disputed): relative
+                   for relative, paths in versions.items()}
+        for done, future in enumerate(as_completed(futures), start=1):
+            relative = futures[future]
+            videos[relative] = future.result()[1]
+            if progress_callback is not None:
+                progress_callback(relative, videos[relative], done, len(futures))
+    return {"videos": dict(sorted(videos.items())), "single": single}
+
+
+def benchmark(frames_nbr=1000000, versions=3, repeats=5):
+    """
+    Measures the throughput of consensus on synthetic versions (the lines of Evaluation.synthetic_dataset with
+    annotator noise) of frames_nbr frames.
+    :return: a dictionary {"frames": ..., "versions": ..., "seconds": best time of 'repeats' runs, "frames_per_second":
+    ...}
+    """
+    from AnnotationGUI.Evaluation import synthetic_dataset
+    stack = stack_versions([synthetic_dataset(frames_nbr, seed=seed)[1] for seed in range(versions)])
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        consensus(stack)
+        times.append(time.perf_counter() - start)
+    return {"frames": frames_nbr, "versions": versions, "seconds": min(times),
+            "frames_per_second": frames_nbr / min(times)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Merge the annotations of several annotators into consensus gt files.")
+    parser.add_argument("roots", nargs="*", help="annotator directories, searched (recursively) for gt files")
+    parser.add_argument("--files", nargs="+", default=None, help="versions of one video (instead of directories)")
+    parser.add_argument("--out", help="output directory (or merged gt file with --files)")
+    parser.add_argument("--y-threshold", type=float, default=5.0, help="largest Y spread of a frame, in pixels")
+    parser.add_argument("--alpha-threshold", type=float, default=1.0, help="largest alpha spread, in degrees")
+    parser.add_argument("--min-annotators", type=int, default=None,
+                        help="annotators needed for a median line (default: a majority)")
+    parser.add_argument("--keep-disputed", action="store_true",
+                        help="keep the median line of disputed frames (flagged interpolated)")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes (default: all CPUs)")
+    parser.add_argument("--report", help="write the full report to this JSON file")
+    parser.add_argument("--benchmark", action="store_true", help="benchmark the consensus on 3 x 1M synthetic frames")
+    args = parser.parse_args(argv)
+    if args.benchmark:
+        print(benchmark())
+        return 0
+    if args.out is None or (args.files is None and len(args.roots) < 2):
+        parser.error("--out and either two annotator directories or --files are required")
+    thresholds = (args.y_threshold, args.alpha_threshold, args.min_annotators, args.keep_disputed)
+
+    def describe(report):
+        if "error" in report:
+            return report["error"]
+        return "{} versions, {} frames: {} agreed, {} disputed".format(report["versions"], report["frames"],
+                                                                       report["agreed"], report["disputed"])
+
+    start = time.perf_counter()
+    if args.files is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        results = {"videos": {args.out: merge_files(args.files, args.out, *thresholds)[1]}, "single": []}
+        print("{}: {}".format(args.out, describe(results["videos"][args.out])))
+    else:
+        results = merge_directories(args.roots, args.out, *thresholds, workers=args.workers, progress_callback=lambda
+                                    relative, report, done, total: print("[{}/{}] {}: {}".format(
+                                        done, total, relative, describe(report)), flush=True))
+        for relative in results["single"]:
+            print("{}: a single version, not merged".format(relative))
+    reports = [report for report in results["videos"].values() if "error" not in report]
+    print("{} videos merged in {:.1f} s: {} frames disputed out of {}".format(
+        len(reports), time.perf_counter() - start, sum(r["disputed"] for r in reports),
+        sum(r["frames"] for r in reports)))
+    if args.report:
+        with open(args.report, "w") as report_file:
+            json.dump(results, report_file, indent=2)
+    return 1 if any("error" in report for report in results["videos"].values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
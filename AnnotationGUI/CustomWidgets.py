@@ -1,11 +1,16 @@
 import tkinter as tk
 from tkinter import ttk
-from PIL import Image, ImageTk, ImageDraw
+from PIL import Image, ImageTk
 import numpy as np
 from AnnotationGUI import CustomWidgetsHelpers as cls_h
+from AnnotationGUI.Geometry import gt_from_xy_ends
+from AnnotationGUI.LineRefinement import refine_line
+from AnnotationGUI.Profiling import PROFILER, profiled
+from AnnotationGUI.TilePyramid import TilePyramid
 import cv2 as cv
 from warnings import warn
-from math import pi, atan
+from collections import deque
+import time
 
 
 class ImageDisplay(tk.Frame):
@@ -21,41 +26,74 @@ class ImageDisplay(tk.Frame):
         self.wmax = wmax  # maximum width allowed (in pixels) of the image to display
         self.w_scaled = None  # the scaled width of the displayed image
         self.h_scaled = None  # the scaled height of the displayed image
-        self.cur_with_valid_drawings = None  # same as self.cur_shown overlaid with validated (i.e., non-canceled) drawings
-        self.cur_shown = None  # the PIL image that appears on the ImageDisplay NOW
+        self.cur_shown = None  # the PIL image that appears on the ImageDisplay NOW (drawings excluded: they're canvas items)
+        self.cur_shown_is_org = False  # True if self.cur_shown is the (scaled) original image self.im_as_pil_org
         self.im_as_pil_org = None  # the last original (i.e., no pre-processing) image loaded, as a PIL image
         self.drawings_layer = None
         self.Y_hl = -1
         self.alpha_hl = -1
 
-        # Creating a tkinter image "image_as_tk" that can be displayed on a Label widget
+        # Creating a tkinter image "image_as_tk" that can be displayed on a Canvas widget
         self.im_as_np_org = None  # original numpy version of the image being displayed. If the displayed image is colored, this attribute is a BGR image.
         self.im_as_np_org = np.multiply(np.ones((self.hmax, self.wmax), dtype=np.uint8), 100)  # initilize to a gray image
-        self.im_as_pil = Image.fromarray(self.im_as_np_org)
+        self.im_as_pil = Image.fromarray(self.im_as_np_org).convert('RGB')  # RGB: later frames are pasted in this mode
         self.im_as_tk = ImageTk.PhotoImage(self.im_as_pil)
 
         self.frame = tk.LabelFrame(master=master, text=name)  # master is the master of the custom widget ImageDisplay
-        self.imagelabel = tk.Label(self.frame, image=self.im_as_tk)
-        self.imagelabel.grid(row=0, column=0)
+        # The image is shown on a single canvas image item, updated in place by self.show_img. Drawn lines are canvas
+        # line items overlaid on it, so drawing never re-rasterises the image. The image item is placed at
+        # (self.pad, self.pad) to keep the 2-pixel padding of a tk.Label (see cls_h.compensate_xy_padding).
+        self.pad = 2
+        self.canvas = tk.Canvas(self.frame, width=self.wmax + 2 * self.pad, height=self.hmax + 2 * self.pad,
+                                borderwidth=0, highlightthickness=0)
+        self.image_item = self.canvas.create_image(self.pad, self.pad, anchor='nw', image=self.im_as_tk)
+        self.rubber_band_item = self.canvas.create_line(0, 0, 0, 0, fill="#800000", width=1, state='hidden')
+        self.render_times_ms = deque(maxlen=100)  # durations of the last calls to self.show_img, in milliseconds
+        # Zoom: the original image is shown zoom times larger than its fit-to-display size (w_scaled, h_scaled), as tiles
+        # of a TilePyramid (canvas image items tagged 'tile', replacing self.image_item while zoomed). Only the part of
+        # the zoomed image starting at (self.view_x, self.view_y) (in displayed pixels) is visible. Drawings and
+        # overlays keep their coordinates on the image at fit size (the "scaled" coordinates), whatever the zoom.
+        self.zoom = 1.0
+        self.max_zoom = 8  # maximum number of displayed pixels per pixel of the original image
+        self.view_x = 0
+        self.view_y = 0
+        self.pyramid = None  # TilePyramid of self.im_as_np_org, created on the first zoom of each original image
+        self.org_is_bgr = True  # True if self.im_as_np_org is a BGR image (it's RGB if it was given as a PIL image)
+        self._tiles = {}  # keys are (tx, ty) of the shown tiles, values are tuples (PhotoImage, canvas item)
+        self._tiles_size = None  # size of the zoomed image self._tiles were resampled at
+        self._overlays = {}  # keys are tags of overlays, values are tuples (lines, fill, width) (see self.draw_overlay)
+        self._pan_last = None  # last mouse position while panning
 
         # # # # # # # Creating configuring elements/sub-widgets of ImageDisplay as its attributes # # # # # # # # #
         self.coord_label = tk.Label(self.frame,
                                     text="Current position (x,y): Load an image/images and hover the mouse on")
+        self.render_time_label = tk.Label(self.frame, text="Render time: -")
         self.dr_options_frame = tk.Frame(master=self.frame)  # frame holding drawing options
         # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
         self._dr_opt = tk.IntVar()  # drawing option dr_opt, a variable bound to radio buttons choosing the drawing mode
         self._dr_opt.set(0)
         self.line_option = ttk.Radiobutton(master=self.dr_options_frame, text="╲", variable=self._dr_opt,
                                            value=0)  # a chackbutton to choose to draw lines
+        self.snap_to_edges = tk.BooleanVar(value=False)  # if True, drawn horizons are refined (see self.refine_horizon)
+        # a function returning the full-resolution frame (BGR) of the shown original image when the latter is a
+        # downscaled proxy (see the org_size argument of self.show_img), or None if it can't; set by the owner
+        self.full_res_source = None
+        self.snap_option = ttk.Checkbutton(master=self.dr_options_frame, text="Snap", variable=self.snap_to_edges)
+        self.fit_button = ttk.Button(master=self.dr_options_frame, text="Fit", width=4, command=self.reset_zoom)
+        self.zoom_label = tk.Label(master=self.dr_options_frame, text="100%")
 
         # configuring elements/sub-widgets of ImageDisplay as its attributes.
 
         # # # # # # # # # # # Configuring geometry of ImageDisplay widgets # # # # # # # # # # # # # # # # # # # #
         # geometry inside self.cb_frame
         self.line_option.grid(row=0, column=0, sticky='N')
+        self.snap_option.grid(row=1, column=0, sticky='N')
+        self.fit_button.grid(row=2, column=0, sticky='N')
+        self.zoom_label.grid(row=3, column=0, sticky='N')
         # geometry inside self.frame
-        self.imagelabel.grid(row=0, column=0)
+        self.canvas.grid(row=0, column=0)
         self.coord_label.grid(row=1, column=0, sticky='W')
+        self.render_time_label.grid(row=2, column=0, sticky='W')
         self.dr_options_frame.grid(row=0, column=1, sticky='N')
 
         self.frame.grid(row=0, column=0)
@@ -88,6 +126,22 @@ class ImageDisplay(tk.Frame):
         self.org_w = None  # original width of the image being displayed
         self.org_h = None  # original height of the image being displayed
 
+        # # # # # # # # # # # # # # # # Binding events on self.canvas # # # # # # # # # # # # # # # # # # # # # # # #
+        # bound once: the canvas persists across displayed images
+        self.canvas.bind("<Motion>", self._show_xy_coords)
+        self.canvas.bind("<Button-1>", self._draw_shapes)
+        self.canvas.bind("<Motion>", self._draw_shapes, add="+")
+        # only the left button draws: the release of another button (e.g., Button-4/5 of a Control+wheel zoom on X11)
+        # must not end the drawing
+        self.canvas.bind("<ButtonRelease-1>", self._draw_shapes)
+        self.canvas.bind("<Button-3>", self._draw_shapes)
+        # zoom with the mouse wheel while holding Control (Button-4/5 are the wheel on X11), pan with the middle button
+        self.canvas.bind("<Control-MouseWheel>", self._zoom_with_wheel)
+        self.canvas.bind("<Control-Button-4>", self._zoom_with_wheel)
+        self.canvas.bind("<Control-Button-5>", self._zoom_with_wheel)
+        self.canvas.bind("<ButtonPress-2>", self._pan)
+        self.canvas.bind("<B2-Motion>", self._pan)
+
     def bind_to(self, event_id, callback):
         """
         binds callback functions to specific events.
@@ -99,21 +153,24 @@ class ImageDisplay(tk.Frame):
         if callback not in self._callbacks[event_id]:
             self._callbacks[event_id].append(callback)
 
-    def show_img(self, src, src_type, set_as_org=True, bgr2rgb=True):
+    def show_img(self, src, src_type, set_as_org=True, bgr2rgb=True, org_size=None):
         """
-        show the image taken from the source src on the image display
+        show the image taken from the source src on the image display. The displayed image replaces the previous one,
+        including its overlaid drawings (see self.draw_overlay).
         :param src: the source of the image. Posible options are: PIL image, Numpy image, path of the image
         :param src_type: a string indicating the type (option) of src. src_type is one of the following: 'pil', 'numpy' or 'path'
         :param set_as_org: if True, src is used to update the attributes self.im_as_pil_org and self.im_as_np_org
         :param bgr2rgb: if True and src is a nummpy image (src_type = 'numpy'), src is converted from BGR to RGB.
+        :param org_size: a tuple (width, height) of the full-resolution image that src is a downscaled proxy of. If
+        given (and set_as_org is True), mouse coordinates are mapped to this size instead of the size of src.
         :return: None
         """
+        render_start = time.perf_counter()
         opened = None
         src_org_copy = src  # src may be changed. Thus, we save an original copy in src_org_copy
         w_s = 0
         h_s = 0
         src_rgb_pil = 0
-        self.imagelabel.grid_forget()  # delete previous image label
         if src_type == 'pil':
             self.cur_shown, w_s, h_s = cls_h.check_img_size(im_as_pil=src,
                                                             wmax=self.wmax,
@@ -123,10 +180,12 @@ class ImageDisplay(tk.Frame):
                 if cls_h.is_gray(src):
                     warn("argument bgr2rgb is set to True, yet the argument src has only one channel")
                 else:
-                    src = cv.cvtColor(src, cv.COLOR_RGB2BGR)
-            self.cur_shown, w_s, h_s = cls_h.check_img_size(im_as_pil=Image.fromarray(src),
-                                                            wmax=self.wmax,
-                                                            hmax=self.hmax)
+                    with PROFILER.span("show_img.color_conversion"):
+                        src = cv.cvtColor(src, cv.COLOR_RGB2BGR)
+            with PROFILER.span("show_img.resize"):
+                self.cur_shown, w_s, h_s = cls_h.check_img_size(im_as_pil=Image.fromarray(src),
+                                                                wmax=self.wmax,
+                                                                hmax=self.hmax)
 
         elif src_type == 'path':
             opened = Image.open(src)
@@ -142,9 +201,16 @@ class ImageDisplay(tk.Frame):
             # merge the single banded self.cur_shown into an image with 'RGB' mode. Merged images must have 'L' mode.
             self.cur_shown = Image.merge("RGB", (self.cur_shown, self.cur_shown, self.cur_shown))
 
-        self.im_as_tk = ImageTk.PhotoImage(self.cur_shown)
-        self.imagelabel = tk.Label(self.frame, image=self.im_as_tk)
-        self.imagelabel.grid(row=0, column=0)
+        self.clear_overlays()
+        with PROFILER.span("show_img.upload"):
+            if (self.im_as_tk.width(), self.im_as_tk.height()) == self.cur_shown.size:
+                self.im_as_tk.paste(self.cur_shown)  # update the displayed image in place
+            else:
+                self.im_as_tk = ImageTk.PhotoImage(self.cur_shown)
+                self.canvas.itemconfig(self.image_item, image=self.im_as_tk)
+                self.canvas.config(width=self.cur_shown.size[0] + 2 * self.pad,
+                                   height=self.cur_shown.size[1] + 2 * self.pad)
+        self.cur_shown_is_org = set_as_org
 
         if set_as_org:
             for New_Org_Img_callback in self._callbacks["<New-Org-Img>"]:  # execute callback(s) corresponding to setting src as an original image
@@ -162,25 +228,200 @@ class ImageDisplay(tk.Frame):
                     self.im_as_np_org = cv.cvtColor(self.im_as_np_org, cv.COLOR_RGB2BGR)  # convert from RGB to BGR
             else:
                 raise ValueError("Unkown specifier for src_type: must be a string containing 'numpy', 'pil' or 'path'")
-            self.org_w, self.org_h = self.im_as_pil_org.size
-            self.cur_with_valid_drawings = self.cur_shown.copy()  # the image containing previous non-canceled drawings is set to the original image shown on the Image Display
+            org_w, org_h = self.im_as_pil_org.size if org_size is None else org_size
+            if (org_w, org_h, w_s, h_s) != (self.org_w, self.org_h, self.w_scaled, self.h_scaled):
+                self.zoom, self.view_x, self.view_y = 1.0, 0, 0  # the view of the previous image doesn't apply
+            self.org_w, self.org_h = org_w, org_h
             self.w_scaled = w_s
             self.h_scaled = h_s
+            self.org_is_bgr = src_type == 'path' or (src_type == 'numpy' and bgr2rgb)
+            self.pyramid = None
+            self._tiles_size = None  # tiles of the previous image must be resampled
+            self.reset_drawings()
+        if self.zoom != 1.0 or self._tiles:
+            if not set_as_org:
+                self.zoom, self.view_x, self.view_y = 1.0, 0, 0  # processed images are shown at fit size
+            self._render_view()
+
+        render_end = time.perf_counter()
+        self.render_times_ms.append((render_end - render_start) * 1000)
+        if PROFILER.enabled:
+            PROFILER.record("show_img", render_start, render_end)
+        self.render_time_label.config(text="Render time: {:.1f} ms (mean of last {}: {:.1f} ms)".format(
+            self.render_times_ms[-1], len(self.render_times_ms), sum(self.render_times_ms) / len(self.render_times_ms)))
+
+    def restore_org(self):
+        """
+        Shows the original image (scaled) without drawings. The image is uploaded only if another one is displayed.
+        """
+        if self.cur_shown_is_org:
+            self.clear_overlays()
+        else:
+            self.show_img(src=self.im_as_pil_org, src_type='pil', set_as_org=False)
+            self.cur_shown_is_org = True
+
+    def reset_drawings(self):
+        """
+        Deletes all shapes' ends coordinates. Done when a new image is displayed (not processed ones) and set as
+        original, because the shapes no longer correspond to the displayed image.
+        """
+        self.all_rects_scaled = []
+        self.all_lines_scaled = []
+        self.all_rects_org = []
+        self.all_lines_org = []
+
+    def draw_overlay(self, lines, fill, width, tag='drawings'):
+        """
+        Draws lines as canvas items over the displayed image, replacing previous lines drawn with the same tag.
+        :param lines: a list of lines, each given as [x_start, y_start, x_end, y_end] in displayed (scaled) pixels
+        :param fill: color of the lines (a Tkinter color string, e.g., '#ff0000')
+        :param width: width of the lines in pixels
+        :param tag: a string identifying the overlay
+        """
+        self._overlays[tag] = (lines, fill, width)
+        self.canvas.delete(tag)
+        for line in lines:
+            self.canvas.create_line(*self._scaled_to_canvas(line), fill=fill, width=width, tags=('overlay', tag))
+
+    def clear_overlays(self):
+        """
+        Deletes all lines drawn over the displayed image (including the line being drawn).
+        """
+        self._overlays = {}
+        self.canvas.delete('overlay')
+        self.canvas.itemconfig(self.rubber_band_item, state='hidden')
+
+    def _zoom_factors(self):
+        """
+        :return: a tuple (width, height) of the zoomed image, in displayed pixels, and the horizontal and vertical zoom
+        factors (width / self.w_scaled and height / self.h_scaled, equal to self.zoom up to rounding)
+        """
+        zoomed_w, zoomed_h = int(round(self.w_scaled * self.zoom)), int(round(self.h_scaled * self.zoom))
+        return (zoomed_w, zoomed_h), zoomed_w / self.w_scaled, zoomed_h / self.h_scaled
+
+    def _event_to_scaled(self, event):
+        """
+        :return: the position (x, y) of the mouse event on the image at fit size (w_scaled, h_scaled), whatever the zoom
+        """
+        x, y = cls_h.compensate_xy_padding(event.x, event.y, self.w_scaled, self.h_scaled)
+        if self.zoom == 1.0:
+            return x, y
+        _, zoom_x, zoom_y = self._zoom_factors()
+        return (x + self.view_x) / zoom_x, (y + self.view_y) / zoom_y
+
+    def _scaled_to_canvas(self, line):
+        """
+        :return: the coordinates on the canvas of a line [x_start, y_start, x_end, y_end] given on the image at fit size
+        """
+        if self.zoom == 1.0:
+            return [c + self.pad for c in line]
+        _, zoom_x, zoom_y = self._zoom_factors()
+        return [line[0] * zoom_x - self.view_x + self.pad, line[1] * zoom_y - self.view_y + self.pad,
+                line[2] * zoom_x - self.view_x + self.pad, line[3] * zoom_y - self.view_y + self.pad]
 
-            # when a new image is displayed (not processed ones) and set as original, delete all shapes' ends coordinates (because they no longer correspond to the displayed image)
-            self.all_rects_scaled = []
-            self.all_lines_scaled = []
-            self.all_rects_org = []
-            self.all_lines_org = []
+    def zoom_at(self, factor, x, y):
+        """
+        Multiplies the zoom by factor (within [1, self.max_zoom pixels per original pixel]), keeping the point (x, y) of
+        the view (in displayed pixels) under the mouse.
+        """
+        if self.w_scaled is None:
+            return
+        (zoomed_w, zoomed_h), zoom_x, zoom_y = self._zoom_factors()
+        scaled_x, scaled_y = (x + self.view_x) / zoom_x, (y + self.view_y) / zoom_y
+        self.zoom = min(max(self.zoom * factor, 1.0), max(self.max_zoom * self.org_w / self.w_scaled, 1.0))
+        if abs(self.zoom - 1.0) < 1e-6:
+            self.zoom = 1.0
+        _, zoom_x, zoom_y = self._zoom_factors()
+        self.set_view(scaled_x * zoom_x - x, scaled_y * zoom_y - y)
+
+    def set_view(self, view_x, view_y):
+        """
+        Moves the view to (view_x, view_y) on the zoomed image (clipped to the image) and shows it.
+        """
+        (zoomed_w, zoomed_h), _, _ = self._zoom_factors()
+        self.view_x = int(round(min(max(view_x, 0), zoomed_w - self.w_scaled)))
+        self.view_y = int(round(min(max(view_y, 0), zoomed_h - self.h_scaled)))
+        self._render_view()
 
-        # # # # # # # # # # # # # # # # Binding events on the new self.imagelabel # # # # # # # # # # # # # # # # # # #
-        self.imagelabel.bind("<Motion>", self._show_xy_coords)
-        self.imagelabel.bind("<Button-1>", self._draw_shapes)
-        self.imagelabel.bind("<Motion>", self._draw_shapes, add="+")
-        self.imagelabel.bind("<ButtonRelease>", self._draw_shapes)
-        self.imagelabel.bind("<Button-3>", self._draw_shapes)
-        # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+    def reset_zoom(self):
+        """
+        Shows the whole image at fit size.
+        """
+        self.zoom, self.view_x, self.view_y = 1.0, 0, 0
+        self._render_view()
 
+    def _render_view(self):
+        """
+        Shows the view of the zoomed image: the tiles of the view that aren't shown yet are resampled from self.pyramid
+        and uploaded, the tiles that left the view are deleted, and overlays are moved to their zoomed coordinates.
+        """
+        with PROFILER.span("ImageDisplay.render_view"):
+            if self.zoom == 1.0:
+                self.canvas.delete('tile')
+                self._tiles = {}
+                self.canvas.itemconfig(self.image_item, state='normal')
+            else:
+                if self.pyramid is None:
+                    self.pyramid = TilePyramid(self.im_as_np_org, bgr2rgb=self.org_is_bgr)
+                zoomed_size, _, _ = self._zoom_factors()
+                if zoomed_size != self._tiles_size:  # another zoom or another image: no shown tile can be reused
+                    self.canvas.delete('tile')
+                    self._tiles, self._tiles_size = {}, zoomed_size
+                visible = self.pyramid.visible_tiles(zoomed_size, (self.view_x, self.view_y,
+                                                                   self.w_scaled, self.h_scaled))
+                for key in set(self._tiles) - set(visible):
+                    self.canvas.delete(self._tiles.pop(key)[1])
+                tile_size = self.pyramid.tile_size
+                for tx, ty in visible:
+                    if (tx, ty) not in self._tiles:
+                        photo = ImageTk.PhotoImage(Image.fromarray(self.pyramid.tile(zoomed_size, tx, ty)))
+                        self._tiles[(tx, ty)] = (photo, self.canvas.create_image(0, 0, anchor='nw', image=photo,
+                                                                                 tags=('tile',)))
+                    self.canvas.coords(self._tiles[(tx, ty)][1], self.pad + tx * tile_size - self.view_x,
+                                       self.pad + ty * tile_size - self.view_y)
+                self.canvas.itemconfig(self.image_item, state='hidden')
+                self.canvas.tag_lower('tile')
+            for tag, (lines, fill, width) in list(self._overlays.items()):
+                self.draw_overlay(lines, fill, width, tag)
+            if self.in_drawing:
+                self.canvas.coords(self.rubber_band_item, *self._scaled_to_canvas(
+                    [self.sh_x_s_scaled, self.sh_y_s_scaled, self.sh_x_e_scaled, self.sh_y_e_scaled]))
+        self.zoom_label.config(text="{:.0f}%".format(self.zoom * 100))
+
+    def _zoom_with_wheel(self, event):
+        zoom_in = event.num == 4 or (str(event.type) == 'MouseWheel' and event.delta > 0)
+        x, y = cls_h.compensate_xy_padding(event.x, event.y, self.w_scaled or 1, self.h_scaled or 1)
+        self.zoom_at(1.25 if zoom_in else 0.8, x, y)
+        return "break"  # Control + wheel doesn't browse frames (see MainInterface)
+
+    def _pan(self, event):
+        if str(event.type) == "ButtonPress":
+            self._pan_last = (event.x, event.y)
+            return "break"
+        if self._pan_last is not None and self.zoom != 1.0:
+            self.set_view(self.view_x - (event.x - self._pan_last[0]), self.view_y - (event.y - self._pan_last[1]))
+        self._pan_last = (event.x, event.y)
+        return "break"
+
+    def show_hud(self, text):
+        """
+        Shows (or updates) a text box in the top left corner of the image, above all other canvas items. Unlike
+        overlays, the HUD is kept when another image is displayed.
+        """
+        if not self.canvas.find_withtag('hud'):
+            self.canvas.create_rectangle(0, 0, 0, 0, fill="#000000", stipple="gray50", outline="", tags=('hud', 'hud_box'))
+            self.canvas.create_text(self.pad + 6, self.pad + 6, anchor='nw', fill="#00ff00", font=("Courier", 9),
+                                    tags=('hud', 'hud_text'))
+        self.canvas.itemconfig('hud_text', text=text)
+        x0, y0, x1, y1 = self.canvas.bbox('hud_text')
+        self.canvas.coords('hud_box', x0 - 4, y0 - 4, x1 + 4, y1 + 4)
+        self.canvas.tag_raise('hud_box')
+        self.canvas.tag_raise('hud_text')
+
+    def hide_hud(self):
+        self.canvas.delete('hud')
+
+    @profiled("ImageDisplay._show_xy_coords")
     def _show_xy_coords(self, event):
         # #Scaling the coordinates if the displayed image has been rescaled
         # self.org_w, self.org_h = self.im_as_pil_org.size
@@ -191,29 +432,32 @@ class ImageDisplay(tk.Frame):
         #     x = event.x
         #     y = event.y
 
-        x, y = cls_h.rescale_to_org_xy(event.x, event.y, self.org_w, self.org_h, self.w_scaled, self.h_scaled)
-
-        x, y = cls_h.compensate_xy_padding(x, y, self.org_w, self.org_h)
+        # the padding is compensated in displayed pixels, then the position on the zoomed image is mapped to the original
+        x, y = cls_h.compensate_xy_padding(event.x, event.y, self.w_scaled, self.h_scaled)
+        (zoomed_w, zoomed_h), _, _ = self._zoom_factors()
+        x, y = cls_h.rescale_to_org_xy(x + self.view_x, y + self.view_y, self.org_w, self.org_h, zoomed_w, zoomed_h)
 
         self.cur_org_x = x
         self.cur_org_y = y
 
         # update the text label displaying the coordinates of the current mouse
-        self.coord_label.config(text="Current position (x,y): " + "(" + str(x) + "," + str(y) + ")              ")
+        self.coord_label.config(text="Current position (x,y): ({:.1f},{:.1f})              ".format(x, y))
 
+    @profiled("ImageDisplay._draw_shapes")
     def _draw_shapes(self, event):
         """
-        This method applies user-drawn shapes on the class attribute self.cur_with_valid_drawings
+        This method draws user-drawn shapes as line items over the image displayed on self.canvas
         :param event: a Tkinter event object that's passed automatically by the binding method
         :return: None
         """
         # draw a line on A COPY of the original image
         # display it using set_img
 
+        if event.num == 2:  # the middle button pans the view (see self._pan)
+            return
         if str(
                 event.type) == "ButtonPress" and event.num == 1:  # True if left mouse button is clicked <=> drawing has been started
-            self.sh_x_s_scaled, self.sh_y_s_scaled = cls_h.compensate_xy_padding(event.x, event.y, self.w_scaled,
-                                                                                 self.h_scaled)  # self.w_scaled and self.h_scaled because the coordinates correspond to the scaled image
+            self.sh_x_s_scaled, self.sh_y_s_scaled = self._event_to_scaled(event)  # on the image at fit size
             self.sh_x_s_org, self.sh_y_s_org = self.cur_org_x, self.cur_org_y
             self.in_drawing = True  # drawing has been started
             self.drawing_canceled = False  # False because a the user started a new drawing
@@ -222,15 +466,15 @@ class ImageDisplay(tk.Frame):
                 event.type) == "ButtonPress" and event.num == 3:  # True if right mouse button is clicked <=> current drawing has been canceled
             self.drawing_canceled = True
             self.in_drawing = False  # the user has finished the drawing
-            self.show_img(src=self.cur_with_valid_drawings, src_type='pil',
-                          set_as_org=False)  # immediatly display previous drawings, which has the effect to remove canceled drawing
+            self.canvas.itemconfig(self.rubber_band_item, state='hidden')  # remove canceled drawing
 
-        if str(event.type) == "ButtonRelease":
+        if str(event.type) == "ButtonRelease" and event.num == 1:
             self.in_drawing = False  # False means drawing has been finished
+            self.canvas.itemconfig(self.rubber_band_item, state='hidden')
             if not self.drawing_canceled:  # True if the finished drawing (i.e., drawing of the last line) hasn't been canceled
 
 
-                self.sh_x_e_scaled, self.sh_y_e_scaled = cls_h.compensate_xy_padding(event.x, event.y, self.w_scaled, self.h_scaled)
+                self.sh_x_e_scaled, self.sh_y_e_scaled = self._event_to_scaled(event)
                 self.sh_ends_scaled = [self.sh_x_s_scaled, self.sh_y_s_scaled, self.sh_x_e_scaled, self.sh_y_e_scaled]
                 self.sh_x_e_org, self.sh_y_e_org = self.cur_org_x, self.cur_org_y
                 self.sh_ends_org = [self.sh_x_s_org, self.sh_y_s_org, self.sh_x_e_org, self.sh_y_e_org]
@@ -242,34 +486,62 @@ class ImageDisplay(tk.Frame):
 
                 # we are interested in drawing the line on the entire image
                 self.get_horizon_coordinates()
-                shape_drawer = ImageDraw.Draw(self.cur_shown)
-                shape_drawer.line((self.hl_x_s_scaled,
-                                   self.hl_y_s_scaled,
-                                   self.hl_x_e_scaled,
-                                   self.hl_y_e_scaled),
-                                  fill=128,
-                                  width=3)
-                self.show_img(src=self.cur_shown, src_type='pil', set_as_org=False)
-                self.cur_with_valid_drawings = self.cur_shown.copy()  # draw the last line
-                del shape_drawer
+                if np.isnan(self.Y_hl):  # vertical line: not a horizon
+                    return
+                if self.snap_to_edges.get():
+                    self.refine_horizon()
+                self.draw_overlay([[self.hl_x_s_scaled, self.hl_y_s_scaled, self.hl_x_e_scaled, self.hl_y_e_scaled]],
+                                  fill="#800000", width=3, tag='horizon')
 
         if self.in_drawing:
-            self.cur_shown = self.cur_with_valid_drawings.copy()
-            shape_drawer = ImageDraw.Draw(self.cur_shown)
-            self.sh_x_e_scaled, self.sh_y_e_scaled = cls_h.compensate_xy_padding(event.x, event.y, self.w_scaled,
-                                                                                 self.h_scaled)  # self.w_scaled and self.h_scaled because the coordinates correspond to the scaled image
+            self.sh_x_e_scaled, self.sh_y_e_scaled = self._event_to_scaled(event)  # on the image at fit size
             if not ((self.sh_x_s_scaled == self.sh_x_e_scaled) and (
                     self.sh_y_s_scaled == self.sh_y_e_scaled)):  # Drawing is done only if starting and end points of shape are not the same
 
-                shape_drawer.line((self.sh_x_s_scaled,
-                                   self.sh_y_s_scaled,
-                                   self.sh_x_e_scaled,
-                                   self.sh_y_e_scaled),
-                                  fill=128,
-                                  width=1)
+                # move the rubber band line item: no image is re-rendered while drawing
+                self.canvas.coords(self.rubber_band_item, *self._scaled_to_canvas(
+                    [self.sh_x_s_scaled, self.sh_y_s_scaled, self.sh_x_e_scaled, self.sh_y_e_scaled]))
+                self.canvas.itemconfig(self.rubber_band_item, state='normal')
+                self.canvas.tag_raise(self.rubber_band_item)
 
-                self.show_img(src=self.cur_shown, src_type='pil', set_as_org=False)
-                del shape_drawer
+    def set_horizon(self, xs, ys, xe, ye):
+        """
+        Sets (and draws) the horizon line from its end points on the original image, as if the user had drawn it. Used to
+        show a proposed horizon that the user can validate.
+        :param xs: x coordinate of the line's start point on the original image
+        :param ys: y coordinate of the line's start point on the original image
+        :param xe: x coordinate of the line's end point on the original image
+        :param ye: y coordinate of the line's end point on the original image
+        """
+        self.Y_hl, self.alpha_hl, self.hl_x_s_org, self.hl_y_s_org, self.hl_x_e_org, self.hl_y_e_org = \
+            [float(c) for c in gt_from_xy_ends(xs, ys, xe, ye, self.org_w)[0]]
+        sx, sy = self.w_scaled / self.org_w, self.h_scaled / self.org_h
+        self.hl_x_s_scaled, self.hl_y_s_scaled = self.hl_x_s_org * sx, self.hl_y_s_org * sy
+        self.hl_x_e_scaled, self.hl_y_e_scaled = self.hl_x_e_org * sx, self.hl_y_e_org * sy
+        self.draw_overlay([[self.hl_x_s_scaled, self.hl_y_s_scaled, self.hl_x_e_scaled, self.hl_y_e_scaled]],
+                          fill="#800000", width=3, tag='horizon')
+
+    def refine_horizon(self):
+        """
+        Snaps the current horizon line to the strongest edge near it on the full-resolution image, with sub-pixel
+        precision (see LineRefinement.refine_line). The full-resolution image is self.im_as_np_org, or the frame given
+        by self.full_res_source if self.im_as_np_org is a proxy (refining on the proxy would lose the precision of the
+        original pixels). The band searched around the line covers the imprecision of a mouse position on the displayed
+        (downscaled or zoomed) image. The line is kept as it is if no edge supports it.
+        """
+        image = self.im_as_np_org
+        if image.shape[1] != self.org_w and self.full_res_source is not None:
+            image = self.full_res_source()
+            if image is None or image.shape[1] != self.org_w:  # can't be read: refine on the proxy
+                image = self.im_as_np_org
+        img_h, img_w = image.shape[0:2]
+        sx, sy = img_w / self.org_w, img_h / self.org_h  # from original pixels to pixels of image (1 unless a proxy)
+        band = max(4, int(np.ceil(3 * img_w / (self.w_scaled * self.zoom))))
+        with PROFILER.span("ImageDisplay.refine_horizon"):
+            row = refine_line(image, self.hl_x_s_org * sx, self.hl_y_s_org * sy,
+                              self.hl_x_e_org * sx, self.hl_y_e_org * sy, band=band)
+        if row is not None:
+            self.set_horizon(row[2] / sx, row[3] / sy, row[4] / sx, row[5] / sy)
 
     def get_last_line_pixs(self):
         pass
@@ -280,25 +552,13 @@ class ImageDisplay(tk.Frame):
         horizon line on scaled image and original image as well.
         :return:
         """
-        self.hl_x_s_scaled = 0
-        self.hl_x_e_scaled = self.w_scaled - 1
-        self.hl_slope_scaled = (self.sh_y_e_scaled - self.sh_y_s_scaled) / (self.sh_x_e_scaled - self.sh_x_s_scaled)
-        self.hl_intercept_scaled = self.sh_y_s_scaled - self.hl_slope_scaled * self.sh_x_s_scaled
-
-        self.hl_x_s_scaled = 0
-        self.hl_x_e_scaled = self.w_scaled - 1
-        self.hl_y_s_scaled = self.hl_intercept_scaled
-        self.hl_y_e_scaled = self.hl_slope_scaled * self.hl_x_e_scaled + self.hl_intercept_scaled
+        # lines drawn vertically (or as a single point) are degenerate: all coordinates are np.nan (see Geometry)
+        self.hl_x_s_scaled, self.hl_y_s_scaled, self.hl_x_e_scaled, self.hl_y_e_scaled = \
+            [float(c) for c in gt_from_xy_ends(self.sh_x_s_scaled, self.sh_y_s_scaled, self.sh_x_e_scaled,
+                                               self.sh_y_e_scaled, self.w_scaled)[0, 2:]]
 
         # computing Y and alpha of the horizon
-        self.hl_slope_org = (self.sh_y_e_org - self.sh_y_s_org) / (self.sh_x_e_org - self.sh_x_s_org)
-        self.hl_intercept_org = self.sh_y_s_org - self.hl_slope_org * self.sh_x_s_org
         self.X_hl = int((self.org_w - 1)/2)  # x coordinate corresponding to self.Y_hl
-
-        self.Y_hl = (self.hl_slope_org * self.X_hl) + self.hl_intercept_org
-        self.alpha_hl = (-atan(self.hl_slope_org))*(180/pi)
-
-        self.hl_x_s_org = 0
-        self.hl_x_e_org = self.org_w - 1
-        self.hl_y_s_org = self.hl_intercept_org
-        self.hl_y_e_org = self.hl_slope_org * self.hl_x_e_org + self.hl_intercept_org
+        self.Y_hl, self.alpha_hl, self.hl_x_s_org, self.hl_y_s_org, self.hl_x_e_org, self.hl_y_e_org = \
+            [float(c) for c in gt_from_xy_ends(self.sh_x_s_org, self.sh_y_s_org, self.sh_x_e_org, self.sh_y_e_org,
+                                               self.org_w)[0]]
@@ -76,11 +76,12 @@ def rescale_to_org_xy(x, y, org_w, org_h, w_scaled, h_scaled):
     :param org_h: height of the original image (i.e., height before rescaling)
     :param w_scaled: the width of the scaled image
     :param h_scaled: the height of the scaled image
-    :return: a tuple (x, y) of the rescaled coordinates
+    :return: a tuple (x, y) of the rescaled coordinates, as floats: they aren't truncated to integers, which would
+    quantise annotations to the pixels of the scaled image
     """
     if w_scaled != 1 and h_scaled != 1:  # True if the image is scaled
-        x = int(x * (org_w / w_scaled))
-        y = int(y * (org_h / h_scaled))
+        x = x * (org_w / w_scaled)
+        y = y * (org_h / h_scaled)
         return x, y
     else:  # True if the image isn't scaled
         return x, y
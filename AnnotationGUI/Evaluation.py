@@ -0,0 +1,211 @@
+"""
+Scoring of horizon predictions against gt files, both in the (N, 6) layout (Y, alpha, xs, ys, xe, ye) of
+<video name>_LineGT.npy files (see Geometry).
+
+Usage examples:
+    python -m AnnotationGUI.Evaluation "D:/Datasets/Onshore" "D:/Predictions/Onshore" --report scores.json
+    python -m AnnotationGUI.Evaluation --benchmark
+
+Prediction files are looked for at the same relative path under the predictions directory as the gt files under the
+gt directory (with the same name, or with the suffix given by --pred-suffix instead of _LineGT.npy).
+"""
+import os
+import sys
+import time
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from AnnotationGUI.BatchCLI import find_dataset_files, video_key, GT_SUFFIX
+
+METRICS = ("Y_error", "alpha_error", "endpoint_distance")
+PERCENTILES = (50, 75, 90, 95, 99)
+# fixed histogram bins, so that histograms of different videos can be summed
+HISTOGRAM_EDGES = {"Y_error": np.array([0, 1, 2, 3, 5, 10, 20, 50, 100, np.inf]),
+                   "alpha_error": np.array([0, 0.1, 0.25, 0.5, 1, 2, 5, 10, np.inf]),
+                   "endpoint_distance": np.array([0, 1, 2, 3, 5, 10, 20, 50, 100, np.inf])}
+
+
+def frame_errors(gt, pred):
+    """
+    Computes per-frame errors of the predictions pred against gt (vectorized). Frames where gt or pred is nan are
+    skipped.
+    :param gt: array of shape (N, 6) of gt rows
+    :param pred: array of shape (N, 6) of predicted rows
+    :return: a dictionary {"evaluated": boolean mask of the N frames scored, "Y_error": ..., "alpha_error": ...,
+    "endpoint_distance": ...}, where errors are float32 arrays over the evaluated frames:
+        * Y_error is |Y_pred - Y_gt| in pixels,
+        * alpha_error is the absolute angle between the lines in degrees (lines have no direction: at most 90°),
+        * endpoint_distance is the mean distance between the corresponding end points of the lines, in pixels.
+    """
+    gt = np.asarray(gt, dtype=np.float32)
+    pred = np.asarray(pred, dtype=np.float32)
+    if gt.shape != pred.shape:
+        raise ValueError("gt and predictions have different shapes: {} and {}".format(gt.shape, pred.shape))
+    evaluated = ~(np.isnan(gt).any(axis=1) | np.isnan(pred).any(axis=1))
+    gt, pred = gt[evaluated], pred[evaluated]
+    difference = pred - gt
+    alpha_error = np.abs((difference[:, 1] + 90) % 180 - 90)
+    endpoint_distance = 0.5 * (np.hypot(difference[:, 2], difference[:, 3]) +
+                               np.hypot(difference[:, 4], difference[:, 5]))
+    return {"evaluated": evaluated, "Y_error": np.abs(difference[:, 0]), "alpha_error": alpha_error,
+            "endpoint_distance": endpoint_distance}
+
+
+def summarize(errors, metric):
+    """
+    :param errors: a 1-D array of errors of the metric 'metric' (see METRICS)
+    :return: a dictionary of summary statistics: mean, max, percentiles and histogram (counts and bin edges)
+    """
+    counts = np.histogram(errors, bins=HISTOGRAM_EDGES[metric])[0]
+    edges = [None if np.isinf(edge) else float(edge) for edge in HISTOGRAM_EDGES[metric]]  # None: no upper bound
+    summary = {"histogram": {"edges": edges, "counts": counts.tolist()}}
+    if errors.size == 0:
+        summary.update({"mean": None, "max": None, "percentiles": {str(p): None for p in PERCENTILES}})
+        return summary
+    values = np.percentile(errors, PERCENTILES)
+    summary.update({"mean": float(np.mean(errors, dtype=np.float64)), "max": float(np.max(errors)),
+                    "percentiles": {str(p): float(v) for p, v in zip(PERCENTILES, values)}})
+    return summary
+
+
+def evaluate(gt, pred, errors=None):
+    """
+    Scores predictions against gt.
+    :param errors: the per-frame errors frame_errors(gt, pred) if they're already computed, or None
+    :return: a dictionary with the number of frames, of annotated gt frames, of evaluated frames, of missed frames
+    (annotated in gt but not predicted) and the summary (see summarize) of each metric
+    """
+    if errors is None:
+        errors = frame_errors(gt, pred)
+    annotated = ~np.isnan(np.asarray(gt)[:, 0])
+    report = {"frames": len(gt), "annotated": int(np.count_nonzero(annotated)),
+              "evaluated": int(np.count_nonzero(errors["evaluated"])),
+              "missed": int(np.count_nonzero(annotated & ~errors["evaluated"]))}
+    for metric in METRICS:
+        report[metric] = summarize(errors[metric], metric)
+    return report
+
+
+def prediction_path(gt_path, gt_root, pred_root, pred_suffix=GT_SUFFIX):
+    """
+    :return: path of the prediction file matching the gt file gt_path (see the module's docstring)
+    """
+    relative = os.path.relpath(gt_path, gt_root)[:-len(GT_SUFFIX)]
+    return os.path.join(pred_root, relative + pred_suffix)
+
+
+def _evaluate_file(gt_path, pred_path):
+    """
+    Scores one prediction file (in a worker process).
+    :return: a tuple (gt_path, report, errors), where errors holds the per-frame errors used for the overall report,
+    or (gt_path, {"error": ...}, None) if the files can't be compared
+    """
+    try:
+        gt, pred = np.load(gt_path), np.load(pred_path)
+        errors = frame_errors(gt, pred)
+    except Exception as error:  # a missing or malformed file must not stop the evaluation
+        return gt_path, {"error": repr(error)}, None
+    report = evaluate(gt, pred, errors)
+    return gt_path, report, {metric: errors[metric] for metric in METRICS}
+
+
+def evaluate_directories(gt_root, pred_root, pred_suffix=GT_SUFFIX, workers=None, progress_callback=None):
+    """
+    Scores the prediction files of all gt files under gt_root, in a pool of processes.
+    :param progress_callback: a function called as progress_callback(gt_path, report, done, total) for each file
+    :return: a dictionary {"videos": {video name (see BatchCLI.video_key): report}, "overall": report over all evaluated
+    frames}
+    """
+    gt_paths = find_dataset_files(gt_root)[0]
+    videos = {}
+    all_errors = {metric: [] for metric in METRICS}
+    totals = {"frames": 0, "annotated": 0, "evaluated": 0, "missed": 0}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_evaluate_file, gt_path, prediction_path(gt_path, gt_root, pred_root, pred_suffix))
+                   for gt_path in gt_paths]
+        for done, future in enumerate(as_completed(futures), start=1):
+            gt_path, report, errors = future.result()
+            videos[video_key(gt_path, gt_root)] = report
+            if errors is not None:
+                for key in totals:
+                    totals[key] += report[key]
+                for metric in METRICS:
+                    all_errors[metric].append(errors[metric])
+            if progress_callback is not None:
+                progress_callback(gt_path, report, done, len(futures))
+    overall = dict(totals)
+    for metric in METRICS:
+        errors = np.concatenate(all_errors[metric]) if all_errors[metric] else np.zeros(0, dtype=np.float32)
+        overall[metric] = summarize(errors, metric)
+    return {"videos": dict(sorted(videos.items())), "overall": overall}
+
+
+def synthetic_dataset(frames_nbr, org_w=1920, org_h=1080, nan_ratio=0.05, seed=0):
+    """
+    :return: a tuple (gt, pred) of synthetic arrays of shape (frames_nbr, 6): random lines, and the same lines with
+    noise on Y and alpha (a fraction nan_ratio of the frames is nan in each array)
+    """
+    from AnnotationGUI.Geometry import gt_from_slope_intercept
+    rng = np.random.default_rng(seed)
+    slope = np.tan(np.radians(rng.uniform(-10, 10, frames_nbr)))
+    intercept = rng.uniform(0.2, 0.8, frames_nbr) * org_h
+    gt = gt_from_slope_intercept(slope, intercept, org_w)
+    pred = gt_from_slope_intercept(slope + rng.normal(0, 0.005, frames_nbr),
+                                   intercept + rng.normal(0, 3, frames_nbr), org_w)
+    gt[rng.random(frames_nbr) < nan_ratio] = np.nan
+    pred[rng.random(frames_nbr) < nan_ratio] = np.nan
+    return gt, pred
+
+
+def benchmark(frames_nbr=1000000, repeats=5):
+    """
+    Measures the throughput of evaluate on a synthetic dataset of frames_nbr frames.
+    :return: a dictionary {"frames": ..., "seconds": best time of 'repeats' runs, "frames_per_second": ...}
+    """
+    gt, pred = synthetic_dataset(frames_nbr)
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        evaluate(gt, pred)
+        times.append(time.perf_counter() - start)
+    return {"frames": frames_nbr, "seconds": min(times), "frames_per_second": frames_nbr / min(times)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score horizon predictions against gt files.")
+    parser.add_argument("gt_root", nargs="?", help="directory searched (recursively) for gt files")
+    parser.add_argument("pred_root", nargs="?", help="directory of the prediction files")
+    parser.add_argument("--pred-suffix", default=GT_SUFFIX, help="suffix of prediction files (default: _LineGT.npy)")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes (default: all CPUs)")
+    parser.add_argument("--report", help="write the full report to this JSON file")
+    parser.add_argument("--benchmark", action="store_true", help="benchmark the evaluation on 1M synthetic frames")
+    args = parser.parse_args(argv)
+    if args.benchmark:
+        print(benchmark())
+        return 0
+    if args.gt_root is None or args.pred_root is None:
+        parser.error("gt_root and pred_root are required")
+
+    def print_progress(gt_path, report, done, total):
+        if "error" in report:
+            details = report["error"]
+        else:
+            details = "{} frames evaluated, Y_error median {}, alpha_error median {}".format(
+                report["evaluated"], report["Y_error"]["percentiles"]["50"],
+                report["alpha_error"]["percentiles"]["50"])
+        print("[{}/{}] {}: {}".format(done, total, video_key(gt_path, args.gt_root), details), flush=True)
+
+    results = evaluate_directories(args.gt_root, args.pred_root, args.pred_suffix, args.workers, print_progress)
+    overall = results["overall"]
+    print("overall: {} frames evaluated, {} missed".format(overall["evaluated"], overall["missed"]))
+    for metric in METRICS:
+        print("  {}: mean {}, percentiles {}".format(metric, overall[metric]["mean"], overall[metric]["percentiles"]))
+    if args.report:
+        with open(args.report, "w") as report_file:
+            json.dump(results, report_file, indent=2)
+    return 1 if any("error" in report for report in results["videos"].values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
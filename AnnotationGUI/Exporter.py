@@ -0,0 +1,281 @@
+"""
+Streaming export of gt annotations to tables (CSV, JSON, Parquet) and per-frame sky/sea masks.
+
+Tables are written in chunks of rows, and masks are rasterized from the line equations of chunks of frames in a pool
+of processes, so that the memory used doesn't depend on the length of the video. Masks are written either to a
+memory-mapped npy file (uint8, shape (frames_nbr, h, w)), or to a directory of compressed chunks (bits packed along
+rows), much smaller on disk.
+
+    python -m AnnotationGUI.Exporter video_LineGT.npy --out export --size 1920x1080 --format parquet --masks npz
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from AnnotationGUI.Geometry import rescale_gt, slope_intercept_from_gt
+
+COLUMNS = ("frame", "Y", "alpha", "xs", "ys", "xe", "ye", "flag")
+TABLE_FORMATS = ("csv", "json", "parquet")
+MASK_STORES = ("memmap", "npz")
+# values of mask pixels
+SEA = 0
+SKY = 1
+NOT_ANNOTATED = 255  # all pixels of the masks of non-annotated frames (memmap store only)
+
+
+def table_chunks(gt, flags, chunk_rows=65536):
+    """
+    :return: a generator of (frames, gt rows, flags) chunks of at most chunk_rows frames
+    """
+    for start in range(0, len(gt), chunk_rows):
+        stop = min(start + chunk_rows, len(gt))
+        yield np.arange(start, stop), np.asarray(gt[start:stop], dtype=np.float64), np.asarray(flags[start:stop])
+
+
+def export_table(path, gt, flags, table_format="csv", chunk_rows=65536):
+    """
+    Writes the gt rows and flags of all frames to a table with the columns COLUMNS, one chunk of rows at a time.
+    Non-annotated values are empty (CSV), null (JSON) or null (Parquet).
+    :param path: path of the table file
+    :param gt: array of shape (N, 6) of gt rows (may be memory-mapped)
+    :param flags: array of shape (N,) of per-frame flags (see Interpolation)
+    :param table_format: one of TABLE_FORMATS. Parquet needs pyarrow.
+    :param chunk_rows: number of rows converted at once
+    """
+    if table_format == "csv":
+        with open(path, "w") as table_file:
+            table_file.write(",".join(COLUMNS) + "\n")
+            for frames, rows, chunk_flags in table_chunks(gt, flags, chunk_rows):
+                table = np.char.mod("%.6g", rows)
+                table[np.isnan(rows)] = ""
+                lines = [",".join(fields) for fields in zip(frames.astype(str), *table.T, chunk_flags.astype(str))]
+                table_file.write("\n".join(lines) + "\n")
+    elif table_format == "json":
+        with open(path, "w") as table_file:
+            table_file.write("[")
+            separator = ""
+            for frames, rows, chunk_flags in table_chunks(gt, flags, chunk_rows):
+                values = np.where(np.isnan(rows), None, rows.astype(object)).tolist()
+                for frame, row, flag in zip(frames.tolist(), values, chunk_flags.tolist()):
+                    table_file.write(separator + json.dumps(dict(zip(COLUMNS, [frame] + row + [flag]))))
+                    separator = ", "
+            table_file.write("]")
+    elif table_format == "parquet":
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("exporting Parquet tables needs pyarrow (pip install pyarrow)") from None
+        schema = pa.schema([("frame", pa.int64())] + [(c, pa.float32()) for c in COLUMNS[1:-1]] +
+                           [("flag", pa.uint8())])
+        with pq.ParquetWriter(path, schema) as writer:
+            for frames, rows, chunk_flags in table_chunks(gt, flags, chunk_rows):
+                columns = [pa.array(frames)] + \
+                    [pa.array(rows[:, c].astype(np.float32), mask=np.isnan(rows[:, c])) for c in range(6)] + \
+                    [pa.array(chunk_flags.astype(np.uint8))]
+                writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+    else:
+        raise ValueError("unknown table format: must be one of " + ", ".join(TABLE_FORMATS))
+
+
+def mask_boundaries(gt, size):
+    """
+    Computes, for each frame and each pixel column, the number of sky pixels of the column: pixel (x, y) (centre at
+    integer coordinates) is sky if it's above the horizon line, i.e., y < slope * x + intercept.
+    :param gt: array of shape (F, 6) of gt rows, in pixels of frames of size 'size'
+    :param size: a tuple (width, height) of the frames
+    :return: an int32 array of shape (F, width), in [0, height] (-1 for non-annotated frames)
+    """
+    w, h = size
+    slope, intercept = slope_intercept_from_gt(gt, w)
+    with np.errstate(invalid='ignore'):
+        line_y = slope[:, None] * np.arange(w, dtype=np.float64)[None, :] + intercept[:, None]
+        boundaries = np.clip(np.ceil(line_y), 0, h)
+    boundaries[np.isnan(boundaries)] = -1
+    return boundaries.astype(np.int32)
+
+
+def rasterize_masks(gt, size, out=None):
+    """
+    Rasterizes the sky/sea masks of frames (see mask_boundaries): SKY above the horizon, SEA below, and NOT_ANNOTATED
+    for all pixels of frames without annotation.
+    :param gt: array of shape (F, 6) of gt rows, in pixels of frames of size 'size'
+    :param size: a tuple (width, height) of the frames (and masks)
+    :param out: a uint8 array of shape (F, height, width) the masks are written to (allocated if None)
+    :return: out
+    """
+    w, h = size
+    index_type = np.int16 if h < 2 ** 15 else np.int32  # comparing 16-bit integers is about twice as fast
+    boundaries = mask_boundaries(gt, size).astype(index_type)
+    if out is None:
+        out = np.empty((len(gt), h, w), dtype=np.uint8)
+    rows = np.arange(h, dtype=index_type)[:, None]
+    for i, frame_boundaries in enumerate(boundaries):  # one frame at a time keeps temporaries small
+        if frame_boundaries[0] < 0:
+            out[i] = NOT_ANNOTATED
+        else:
+            np.less(rows, frame_boundaries[None, :], out=out[i].view(bool))
+    return out
+
+
+def chunk_path(masks_dir, start):
+    return os.path.join(masks_dir, "masks_{:09d}.npz".format(start))
+
+
+def _masks_chunk(store, out_path, gt, start, size):
+    """
+    Rasterizes the masks of the frames start to start + len(gt) - 1 and writes them to the store. Runs in a worker
+    process.
+    :return: the number of frames written
+    """
+    if store == "memmap":
+        masks = np.load(out_path, mmap_mode="r+")
+        rasterize_masks(gt, size, out=masks[start:start + len(gt)])
+        masks.flush()
+        del masks
+    else:
+        masks = rasterize_masks(gt, size)
+        annotated = masks[:, 0, 0] != NOT_ANNOTATED
+        masks[~annotated] = SEA
+        with open(chunk_path(out_path, start), "wb") as chunk_file:
+            np.savez_compressed(chunk_file, start=start, size=np.array(size), annotated=annotated,
+                                bits=np.packbits(masks.view(bool), axis=2))
+    return len(gt)
+
+
+def chunk_frames_for_budget(size, memory_mb, workers):
+    """
+    :return: the number of frames per chunk such that the masks being rasterized by all workers (and their packed
+    copies) fit in memory_mb megabytes
+    """
+    w, h = size
+    return max(1, int(memory_mb * 2 ** 20 / (2 * w * h * workers)))
+
+
+def export_masks(out_path, gt, org_size, mask_size=None, store="npz", memory_mb=512, workers=None,
+                 progress_callback=None):
+    """
+    Rasterizes the sky/sea masks of all frames in chunks of frames, in a pool of processes, and writes them to a store:
+        * 'memmap': a uint8 npy file of shape (frames_nbr, h, w) (see rasterize_masks), written in place by the workers,
+        * 'npz': a directory of compressed chunks (see load_masks), whose frames without annotation are flagged.
+    :param out_path: path of the npy file (memmap) or of the directory (npz)
+    :param gt: array of shape (N, 6) of gt rows, in pixels of the original frames
+    :param org_size: a tuple (width, height) of the original frames
+    :param mask_size: a tuple (width, height) of the masks (default: org_size); gt is rescaled to it
+    :param store: one of MASK_STORES
+    :param memory_mb: memory budget of all workers, in megabytes
+    :param workers: number of worker processes (default: number of CPUs); 1 rasterizes in the calling process
+    :param progress_callback: a function called as progress_callback(frames_done, frames_nbr) after each chunk
+    :return: out_path
+    """
+    if store not in MASK_STORES:
+        raise ValueError("unknown mask store: must be one of " + ", ".join(MASK_STORES))
+    mask_size = tuple(mask_size or org_size)
+    workers = workers or os.cpu_count() or 1
+    frames_nbr = len(gt)
+    chunk_len = chunk_frames_for_budget(mask_size, memory_mb, workers)
+    if store == "memmap":
+        np.lib.format.open_memmap(out_path, mode="w+", dtype=np.uint8,
+                                  shape=(frames_nbr, mask_size[1], mask_size[0])).flush()
+    else:
+        os.makedirs(out_path, exist_ok=True)
+
+    def chunks():
+        for start in range(0, frames_nbr, chunk_len):
+            chunk = np.asarray(gt[start:start + chunk_len], dtype=np.float32)
+            if mask_size != tuple(org_size):
+                chunk = rescale_gt(chunk, org_size, mask_size)
+            yield start, chunk
+
+    frames_done = 0
+    if workers == 1:
+        for start, chunk in chunks():
+            frames_done += _masks_chunk(store, out_path, chunk, start, mask_size)
+            if progress_callback is not None:
+                progress_callback(frames_done, frames_nbr)
+        return out_path
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = []
+        for start, chunk in chunks():
+            pending.append(pool.submit(_masks_chunk, store, out_path, chunk, start, mask_size))
+            if len(pending) >= 2 * workers:  # bounded queue: gt chunks aren't all copied to the pool at once
+                frames_done += pending.pop(0).result()
+                if progress_callback is not None:
+                    progress_callback(frames_done, frames_nbr)
+        for future in pending:
+            frames_done += future.result()
+            if progress_callback is not None:
+                progress_callback(frames_done, frames_nbr)
+    return out_path
+
+
+def load_masks(masks_dir, start, stop):
+    """
+    Reads the masks of the frames start to stop - 1 from a directory of compressed chunks (see export_masks).
+    :return: a tuple (masks, annotated): a uint8 array of shape (stop - start, h, w) of SKY and SEA values, and a boolean
+    array of shape (stop - start,), False for frames without annotation (whose masks are all SEA)
+    """
+    chunk_starts = sorted(int(name[6:15]) for name in os.listdir(masks_dir)
+                          if name.startswith("masks_") and name.endswith(".npz"))
+    k = max(int(np.searchsorted(chunk_starts, start, side="right")) - 1, 0)
+    masks, annotated = [], []
+    while k < len(chunk_starts) and chunk_starts[k] < stop:
+        with np.load(chunk_path(masks_dir, chunk_starts[k])) as chunk:
+            w = int(chunk["size"][0])
+            lo, hi = max(start - chunk_starts[k], 0), stop - chunk_starts[k]
+            masks.append(np.unpackbits(chunk["bits"][lo:hi], axis=2, count=w))
+            annotated.append(chunk["annotated"][lo:hi])
+        k += 1
+    return np.concatenate(masks), np.concatenate(annotated)
+
+
+def export_gt(gt, flags, out_dir, name, org_size=None, table_formats=("csv",), masks=None, mask_size=None,
+              memory_mb=512, workers=None, progress_callback=None):
+    """
+    Exports the annotations of a video: one table per format (<name>.<format>) and, optionally, its masks
+    (<name>_Masks.npy or <name>_Masks directory).
+    :param org_size: a tuple (width, height) of the original frames (needed by masks)
+    :param masks: None, or one of MASK_STORES
+    :return: a dictionary of the written paths
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    written = {}
+    for table_format in table_formats:
+        path = os.path.join(out_dir, name + "." + table_format)
+        export_table(path, gt, flags, table_format)
+        written[table_format] = path
+    if masks is not None:
+        if org_size is None:
+            raise ValueError("the frame size is needed to export masks")
+        path = os.path.join(out_dir, name + ("_Masks.npy" if masks == "memmap" else "_Masks"))
+        written["masks"] = export_masks(path, gt, org_size, mask_size, masks, memory_mb, workers, progress_callback)
+    return written
+
+
+def main(argv=None):
+    from AnnotationGUI.BatchCLI import load_gt_and_flags, parse_size
+    parser = argparse.ArgumentParser(description="Export gt files to tables and sky/sea masks.")
+    parser.add_argument("gt_files", nargs="+", help="gt files (<video name>_LineGT.npy)")
+    parser.add_argument("--out", required=True, help="output directory")
+    parser.add_argument("--format", action="append", choices=TABLE_FORMATS, help="table format (repeatable)")
+    parser.add_argument("--masks", choices=MASK_STORES, default=None, help="also export masks to this store")
+    parser.add_argument("--size", type=parse_size, default=None, help="original frame size WxH (needed by masks)")
+    parser.add_argument("--mask-size", type=parse_size, default=None, help="mask size WxH (default: --size)")
+    parser.add_argument("--memory-mb", type=int, default=512, help="memory budget of mask rasterization")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes")
+    args = parser.parse_args(argv)
+    for gt_file in args.gt_files:
+        gt, flags = load_gt_and_flags(gt_file)
+        start = time.perf_counter()
+        written = export_gt(gt, flags, args.out, os.path.basename(os.path.splitext(gt_file)[0]), args.size,
+                            args.format or ["csv"], args.masks, args.mask_size, args.memory_mb, args.workers)
+        print("{}: {} frames in {:.1f} s -> {}".format(gt_file, len(gt), time.perf_counter() - start,
+                                                      ", ".join(written.values())))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
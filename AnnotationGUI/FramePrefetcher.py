@@ -0,0 +1,258 @@
+import threading
+from collections import OrderedDict
+import cv2 as cv
+from AnnotationGUI.Profiling import PROFILER
+
+
+class LRUFrameCache:
+    """
+    A memory-bounded cache of decoded frames. Frames are evicted in least-recently-used order as soon as the total
+    number of bytes held by the cache exceeds self.max_bytes. All methods are thread-safe, because the cache is filled
+    by the decoding thread of FramePrefetcher and read by the Tkinter thread.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max(int(max_bytes), 0)  # maximum number of bytes the cached frames may occupy
+        self.cur_bytes = 0  # number of bytes currently occupied by the cached frames
+        self.hits = 0  # number of get() calls served from the cache
+        self.misses = 0  # number of get() calls that did not find the requested frame
+        self._frames = OrderedDict()  # keys are frame indexes, values are decoded frames (numpy arrays)
+        self._lock = threading.Lock()
+
+    def get(self, index):
+        """
+        Returns the cached frame with index 'index' (and marks it as the most recently used one), or None if the frame
+        is not cached. Hits and misses are counted.
+        """
+        with self._lock:
+            frame = self._frames.get(index)
+            if frame is None:
+                self.misses += 1
+                return None
+            self._frames.move_to_end(index)
+            self.hits += 1
+            return frame
+
+    def contains(self, index):
+        """
+        Returns True if the frame with index 'index' is cached. Unlike get(), this doesn't count as a hit or a miss.
+        """
+        with self._lock:
+            return index in self._frames
+
+    def put(self, index, frame):
+        """
+        Caches the frame 'frame' under the index 'index', then evicts least recently used frames until the cache fits
+        in self.max_bytes. A frame larger than self.max_bytes is not cached at all.
+        """
+        if frame.nbytes > self.max_bytes:
+            return
+        frame.flags.writeable = False  # cached frames are shared between callers; nobody should draw on them
+        with self._lock:
+            old = self._frames.pop(index, None)
+            if old is not None:
+                self.cur_bytes -= old.nbytes
+            self._frames[index] = frame
+            self.cur_bytes += frame.nbytes
+            self._evict()
+
+    def resize(self, max_bytes):
+        """
+        Changes the memory budget of the cache. If the budget shrinks, the least recently used frames are evicted.
+        """
+        with self._lock:
+            self.max_bytes = max(int(max_bytes), 0)
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+            self.cur_bytes = 0
+
+    def capacity_frames(self, frame_nbytes):
+        """
+        Returns the number of frames of 'frame_nbytes' bytes each that fit in the cache.
+        """
+        if frame_nbytes <= 0:
+            return 0
+        return self.max_bytes // frame_nbytes
+
+    def stats(self):
+        """
+        :return: a dictionary with the number of cached frames, hits, misses, used bytes and maximum bytes.
+        """
+        with self._lock:
+            return {"frames": len(self._frames), "hits": self.hits, "misses": self.misses,
+                    "cur_bytes": self.cur_bytes, "max_bytes": self.max_bytes}
+
+    def _evict(self):
+        # must be called while holding self._lock
+        while self.cur_bytes > self.max_bytes and self._frames:
+            _, frame = self._frames.popitem(last=False)
+            self.cur_bytes -= frame.nbytes
+
+
+class FramePrefetcher:
+    """
+    Serves the frames of a video file from RAM. A background thread owns the cv.VideoCapture object and decodes the
+    frames around the current frame (ahead and behind, spaced by the browsing offset) into an LRUFrameCache. A frame
+    that isn't cached yet is decoded by the same thread with the highest priority, while the caller waits for it.
+    get_frame can be called from several threads at once: demanded frames are decoded in the order they're demanded.
+    """
+    def __init__(self, video_file_path, cache_size_mb=512, lookahead=4, max_grab_gap=16, seek_index=None):
+        """
+        :param video_file_path: path of the video file to read
+        :param cache_size_mb: memory budget of the decoded-frame cache, in megabytes
+        :param lookahead: number of frames to prefetch on each side (ahead and behind) of the current frame
+        :param max_grab_gap: if the requested frame is less than max_grab_gap frames after the current position of the
+        reader, the reader skips to it with grab() instead of seeking (seeking re-decodes from the previous keyframe)
+        :param seek_index: a SeekIndex object of the video file. If given, its true frame count is used and seeks land
+        on the keyframe preceding the requested frame, followed by decoding forward to that frame.
+        """
+        self.video_file_path = video_file_path
+        self.cache = LRUFrameCache(cache_size_mb * 1024 * 1024)
+        self.lookahead = lookahead
+        self.max_grab_gap = max_grab_gap
+        self.center = 0  # index of the frame around which frames are prefetched (i.e., the currently displayed frame)
+        self.browsing_offset = 1  # spacing between prefetched frames
+        self.frame_nbytes = 0  # size in bytes of one decoded frame (known after the first decoded frame)
+
+        self.seek_index = seek_index
+        self._reader = cv.VideoCapture(self.video_file_path)  # only used by the decoding thread after __init__
+        if self.seek_index is not None:
+            self.frames_nbr = self.seek_index.frames_nbr
+        else:
+            self.frames_nbr = int(self._reader.get(cv.CAP_PROP_FRAME_COUNT))
+        self._next_pos = 0  # index of the frame that the next self._reader.read() returns
+        self._demands = []  # indexes of the frames callers are waiting for, oldest first (one entry per caller)
+        self._failed = set()  # indexes of frames that couldn't be decoded
+        # keys are indexes of demanded frames decoded while callers wait for them, values are the frames (kept until the
+        # last of these callers takes it, since a frame too big to be cached isn't in self.cache)
+        self._delivered = {}
+        self._stopped = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="FramePrefetcher", daemon=True)
+        self._thread.start()
+
+    def get_frame(self, index):
+        """
+        Returns the frame with index 'index', decoding it if it isn't cached, and re-centers prefetching around it.
+        :param index: index of the frame to return
+        :return: a tuple (no_error_flag, frame), similar to what cv.VideoCapture.read() returns.
+        """
+        frame = self.cache.get(index)
+        with PROFILER.span("prefetcher.miss" if frame is None else "prefetcher.hit"), self._cond:
+            self.center = index
+            self._cond.notify_all()
+            if frame is None:
+                self._demands.append(index)
+                self._failed.discard(index)
+                try:
+                    while frame is None and not self._stopped and index not in self._failed:
+                        if index in self._delivered:
+                            frame = self._delivered[index]
+                        elif self.cache.contains(index):
+                            frame = self.cache.get(index)
+                        else:
+                            self._cond.wait()
+                finally:
+                    self._demands.remove(index)
+                    if index not in self._demands:
+                        self._delivered.pop(index, None)
+        return frame is not None, frame
+
+    def set_browsing_offset(self, browsing_offset):
+        with self._cond:
+            self.browsing_offset = max(int(browsing_offset), 1)
+            self._cond.notify_all()
+
+    def set_cache_size(self, cache_size_mb):
+        self.cache.resize(cache_size_mb * 1024 * 1024)
+        with self._cond:
+            self._cond.notify_all()
+
+    def stats(self):
+        """
+        :return: statistics of the cache (see LRUFrameCache.stats())
+        """
+        return self.cache.stats()
+
+    def close(self):
+        """
+        Stops the decoding thread and releases the video file.
+        """
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._thread.join()
+        self._reader.release()
+        self.cache.clear()
+
+    def _prefetch_targets(self):
+        """
+        Yields the indexes of frames to prefetch, nearest first, alternating between ahead and behind the center.
+        The number of prefetched frames is limited so that they all fit in the cache along with the current frame;
+        otherwise, prefetched frames would evict each other indefinitely.
+        """
+        lookahead = self.lookahead
+        if self.frame_nbytes:
+            lookahead = min(lookahead, (self.cache.capacity_frames(self.frame_nbytes) - 1) // 2)
+        for k in range(1, lookahead + 1):
+            for index in (self.center + k * self.browsing_offset, self.center - k * self.browsing_offset):
+                if 0 <= index < self.frames_nbr:
+                    yield index
+
+    def _next_target(self):
+        # must be called while holding self._cond
+        for index in self._demands:
+            if not self.cache.contains(index) and index not in self._failed and index not in self._delivered:
+                return index
+        for index in self._prefetch_targets():
+            if not self.cache.contains(index) and index not in self._failed:
+                return index
+        return None
+
+    def _decode(self, index):
+        """
+        Decodes the frame with index 'index', reading forward when the frame is near ahead, seeking otherwise. With a
+        seek index, the reader seeks to the keyframe preceding the frame, unless it's already between that keyframe and
+        the frame, then it reads forward; this decodes the minimum number of frames and always lands on the right one.
+        """
+        keyframe = None if self.seek_index is None else self.seek_index.keyframe_before(index)
+        gap = index - self._next_pos
+        if 0 <= gap <= self.max_grab_gap or (keyframe is not None and keyframe <= self._next_pos <= index):
+            pass
+        elif keyframe is not None:
+            with PROFILER.span("decode.seek"):
+                self._reader.set(cv.CAP_PROP_POS_FRAMES, keyframe)
+            gap = index - keyframe
+        else:
+            with PROFILER.span("decode.seek"):
+                self._reader.set(cv.CAP_PROP_POS_FRAMES, index)
+            gap = 0
+        with PROFILER.span("decode.grab"):
+            for _ in range(gap):
+                self._reader.grab()
+        with PROFILER.span("decode.read"):
+            no_error_flag, frame = self._reader.read()
+        self._next_pos = index + 1
+        return no_error_flag, frame
+
+    def _run(self):
+        while True:
+            with self._cond:
+                index = self._next_target()
+                while index is None and not self._stopped:
+                    self._cond.wait()
+                    index = self._next_target()
+                if self._stopped:
+                    return
+            no_error_flag, frame = self._decode(index)
+            with self._cond:
+                if no_error_flag:
+                    self.frame_nbytes = frame.nbytes
+                    self.cache.put(index, frame)
+                else:
+                    self._failed.add(index)
+                if no_error_flag and index in self._demands:
+                    self._delivered[index] = frame
+                self._cond.notify_all()
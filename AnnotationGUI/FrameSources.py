@@ -0,0 +1,303 @@
+import os
+import re
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import cv2 as cv
+from AnnotationGUI.FramePrefetcher import FramePrefetcher, LRUFrameCache
+from AnnotationGUI.Profiling import PROFILER
+
+# A frame source serves the frames of a video, of a directory of images or of a stack of frames saved as an npy file,
+# through the interface of FramePrefetcher:
+#   * frames_nbr: number of frames,
+#   * get_frame(index): random access, returns a tuple (no_error_flag, frame) where frame is a BGR uint8 array,
+#   * set_browsing_offset(offset): frames around the last requested frame, spaced by offset, are prefetched,
+#   * set_cache_size(cache_size_mb), stats() and close().
+VIDEO_EXTENSIONS = (".avi", ".mp4", ".mov", ".mkv")
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+NPY_EXTENSION = ".npy"
+
+
+def source_kind(path):
+    """
+    :return: the kind of frame source at path: 'images' (a directory of images), 'npy' (an npy file of frames) or
+    'video' (any other file)
+    """
+    if os.path.isdir(path):
+        return ImageSequenceSource.kind
+    if path.lower().endswith(NPY_EXTENSION):
+        return NpyStackSource.kind
+    return VideoFrameSource.kind
+
+
+def _natural_key(file_name):
+    # frame_2.png comes before frame_10.png
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r"(\d+)", file_name)]
+
+
+def list_images(dir_path):
+    """
+    :return: the sorted (in natural order) list of paths of the image files in the directory dir_path
+    """
+    file_names = [name for name in os.listdir(dir_path) if name.lower().endswith(IMAGE_EXTENSIONS)]
+    return [os.path.join(dir_path, name) for name in sorted(file_names, key=_natural_key)]
+
+
+def read_image(image_path):
+    """
+    :return: the image file image_path as a BGR uint8 array, or None if it can't be decoded
+    """
+    return cv.imread(image_path, cv.IMREAD_COLOR)
+
+
+def as_bgr(frame):
+    """
+    :return: the frame of an npy stack as a BGR array (grayscale and BGRA frames are converted)
+    """
+    if frame.ndim == 2 or frame.shape[2] == 1:
+        return cv.cvtColor(frame, cv.COLOR_GRAY2BGR)
+    if frame.shape[2] == 4:
+        return cv.cvtColor(frame, cv.COLOR_BGRA2BGR)
+    return frame
+
+
+def load_npy_stack(npy_path):
+    """
+    :return: the frames of the npy file npy_path, memory-mapped: a uint8 array of shape (frames_nbr, h, w),
+    (frames_nbr, h, w, 1), (frames_nbr, h, w, 3) or (frames_nbr, h, w, 4), in BGR order
+    """
+    frames = np.load(npy_path, mmap_mode="r")
+    if frames.dtype != np.uint8 or frames.ndim not in (3, 4) or (frames.ndim == 4 and frames.shape[3] not in (1, 3, 4)):
+        raise ValueError("{}: expected a uint8 array of shape (frames, h, w[, channels]), got {} {}".format(
+            npy_path, frames.dtype, frames.shape))
+    return frames
+
+
+class VideoFrameSource(FramePrefetcher):
+    """
+    Frames of a video file (see FramePrefetcher): a single decoding thread, because video decoding is sequential.
+    """
+    kind = "video"
+
+
+class PooledFrameSource:
+    """
+    Base class of frame sources whose frames can be loaded independently of each other (image files, frames of an
+    npy stack): frames are loaded lazily by a pool of threads into an LRUFrameCache. A requested frame that isn't
+    cached is loaded first; then the frames around it (ahead and behind, spaced by the browsing offset) are loaded in
+    the background. Prefetches that haven't started yet are canceled when the requested frame moves away from them.
+    Subclasses implement _load(index).
+    """
+    kind = None
+
+    def __init__(self, frames_nbr, cache_size_mb=512, lookahead=8, workers=None):
+        """
+        :param frames_nbr: number of frames
+        :param cache_size_mb: memory budget of the loaded-frame cache, in megabytes
+        :param lookahead: number of frames to prefetch on each side (ahead and behind) of the current frame
+        :param workers: number of loading threads (default: number of CPUs, at most 8)
+        """
+        self.frames_nbr = frames_nbr
+        self.cache = LRUFrameCache(cache_size_mb * 1024 * 1024)
+        self.lookahead = lookahead
+        self.center = 0  # index of the frame around which frames are prefetched (i.e., the currently displayed frame)
+        self.browsing_offset = 1  # spacing between prefetched frames
+        self.frame_nbytes = 0  # size in bytes of one loaded frame (known after the first loaded frame)
+        self._futures = {}  # keys are indexes of frames being loaded, values are their futures
+        self._demands = []  # indexes of the frames callers of get_frame are waiting for (their loads aren't canceled)
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers or min(8, os.cpu_count() or 1),
+                                        thread_name_prefix=type(self).__name__)
+
+    def get_frame(self, index):
+        """
+        Returns the frame with index 'index', loading it if it isn't cached, and re-centers prefetching around it. Can
+        be called from several threads at once.
+        :return: a tuple (no_error_flag, frame), similar to what cv.VideoCapture.read() returns.
+        """
+        self.center = index
+        frame = self.cache.get(index)
+        with PROFILER.span("prefetcher.miss" if frame is None else "prefetcher.hit"):
+            if frame is None:
+                with self._lock:
+                    self._demands.append(index)
+                try:
+                    self._cancel_prefetches(keep=())
+                    frame = self._submit(index).result()
+                finally:
+                    with self._lock:
+                        self._demands.remove(index)
+        self._prefetch()
+        return frame is not None, frame
+
+    def set_browsing_offset(self, browsing_offset):
+        self.browsing_offset = max(int(browsing_offset), 1)
+        self._prefetch()
+
+    def set_cache_size(self, cache_size_mb):
+        self.cache.resize(cache_size_mb * 1024 * 1024)
+
+    def stats(self):
+        """
+        :return: statistics of the cache (see LRUFrameCache.stats())
+        """
+        return self.cache.stats()
+
+    def close(self):
+        """
+        Stops the loading threads (frames being loaded are finished) and empties the cache.
+        """
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        self.cache.clear()
+
+    def _load(self, index):
+        """
+        :return: the frame with index 'index' as a BGR uint8 array, or None if it can't be loaded. Runs in a loading
+        thread.
+        """
+        raise NotImplementedError
+
+    def _load_into_cache(self, index):
+        try:
+            frame = self._load(index)
+        except Exception:  # a corrupted frame must not stop browsing
+            frame = None
+        if frame is not None:
+            self.frame_nbytes = frame.nbytes
+            self.cache.put(index, frame)
+        with self._lock:
+            self._futures.pop(index, None)
+        return frame
+
+    def _submit(self, index):
+        with self._lock:
+            future = self._futures.get(index)
+            if future is None:
+                future = self._pool.submit(self._load_into_cache, index)
+                self._futures[index] = future
+            return future
+
+    def _prefetch_targets(self):
+        """
+        :return: the list of indexes of frames to prefetch, nearest first, alternating between ahead and behind the
+        center, limited so that they all fit in the cache along with the current frame (see FramePrefetcher).
+        """
+        lookahead = self.lookahead
+        if self.frame_nbytes:
+            lookahead = min(lookahead, (self.cache.capacity_frames(self.frame_nbytes) - 1) // 2)
+        center, offset = self.center, self.browsing_offset
+        return [index for k in range(1, lookahead + 1) for index in (center + k * offset, center - k * offset)
+                if 0 <= index < self.frames_nbr]
+
+    def _cancel_prefetches(self, keep):
+        with self._lock:
+            for index, future in list(self._futures.items()):
+                if index not in keep and index not in self._demands and future.cancel():
+                    del self._futures[index]
+
+    def _prefetch(self):
+        targets = self._prefetch_targets()
+        self._cancel_prefetches(keep=set(targets))
+        for index in targets:
+            if not self.cache.contains(index):
+                try:
+                    self._submit(index)
+                except RuntimeError:  # the pool has been shut down by close()
+                    return
+
+
+class ImageSequenceSource(PooledFrameSource):
+    """
+    Frames of a directory of image files (PNG, JPEG, BMP, TIFF), in natural order of their file names. Images are
+    decoded by a pool of threads (OpenCV releases the GIL while decoding).
+    """
+    kind = "images"
+
+    def __init__(self, dir_path, cache_size_mb=512, lookahead=8, workers=None):
+        self.path = dir_path
+        self.image_paths = list_images(dir_path)
+        super().__init__(len(self.image_paths), cache_size_mb, lookahead, workers)
+
+    def _load(self, index):
+        with PROFILER.span("decode.read"):
+            return read_image(self.image_paths[index])
+
+
+class NpyStackSource(PooledFrameSource):
+    """
+    Frames of an npy file holding a uint8 array of shape (frames_nbr, h, w[, channels]) (see load_npy_stack). The file
+    is memory-mapped: a frame is read from disk when it's first loaded, by a thread of the pool.
+    """
+    kind = "npy"
+
+    def __init__(self, npy_path, cache_size_mb=512, lookahead=8, workers=None):
+        self.path = npy_path
+        self.frames = load_npy_stack(npy_path)
+        super().__init__(len(self.frames), cache_size_mb, lookahead, workers)
+
+    def _load(self, index):
+        with PROFILER.span("decode.read"):
+            return as_bgr(np.array(self.frames[index]))
+
+
+def open_frame_source(path, cache_size_mb=512, seek_index=None):
+    """
+    Opens the frame source at path (see source_kind).
+    :param seek_index: a SeekIndex object of the video file (ignored by other sources)
+    :return: a VideoFrameSource, ImageSequenceSource or NpyStackSource object
+    """
+    kind = source_kind(path)
+    if kind == ImageSequenceSource.kind:
+        return ImageSequenceSource(path, cache_size_mb=cache_size_mb)
+    if kind == NpyStackSource.kind:
+        return NpyStackSource(path, cache_size_mb=cache_size_mb)
+    return VideoFrameSource(path, cache_size_mb=cache_size_mb, seek_index=seek_index)
+
+
+def read_frames(path, start=0, stop=None, keyframe=None, workers=4):
+    """
+    Reads the frames start to stop - 1 of the frame source at path sequentially, without a cache (for processing whole
+    ranges of frames, e.g., tracking or building a proxy). Reading stops at the first frame that can't be decoded.
+    :param keyframe: for a video, index of a keyframe at or before start (seeking there is exact), or None
+    :param workers: number of threads decoding images ahead of the consumer (image directories only)
+    :return: a generator of frames (BGR uint8 arrays)
+    """
+    kind = source_kind(path)
+    if kind == ImageSequenceSource.kind:
+        image_paths = list_images(path)[start:stop]
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = deque(pool.submit(read_image, p) for p in image_paths[:2 * workers])
+            for next_path in image_paths[2 * workers:] + [None] * len(pending):
+                frame = pending.popleft().result()
+                if frame is None:
+                    for future in pending:
+                        future.cancel()
+                    return
+                if next_path is not None:
+                    pending.append(pool.submit(read_image, next_path))
+                yield frame
+    elif kind == NpyStackSource.kind:
+        frames = load_npy_stack(path)
+        for index in range(start, len(frames) if stop is None else min(stop, len(frames))):
+            yield as_bgr(np.array(frames[index]))
+    else:
+        reader = cv.VideoCapture(path)
+        if keyframe is None:
+            if start > 0:
+                reader.set(cv.CAP_PROP_POS_FRAMES, start)
+        else:
+            if keyframe > 0:
+                reader.set(cv.CAP_PROP_POS_FRAMES, keyframe)
+            for _ in range(start - keyframe):
+                reader.grab()
+        try:
+            index = start
+            while stop is None or index < stop:
+                no_error_flag, frame = reader.read()
+                if not no_error_flag:
+                    return
+                yield frame
+                index += 1
+        finally:
+            reader.release()
@@ -0,0 +1,293 @@
+"""
+A dataset-wide store of horizon gt files, for training loaders that read many videos' annotations.
+
+The store is a directory holding:
+    * columns.npy: a float32 array of shape (6, capacity), memory-mapped. Row c holds the column c (Y, alpha, xs, ys,
+      xe, ye) of all stored frames, so each column is contiguous.
+    * index.json: the offset table. Each video has a slot [offset, offset + slot capacity) of columns.npy, of which the
+      first 'length' positions hold its frames (in frame order).
+
+Usage example:
+    python -m AnnotationGUI.GTStore build "D:/Datasets/Onshore" "D:/Datasets/gt_store"
+    store = GTStore("D:/Datasets/gt_store")
+    Y = store.video("VIS_Onshore/MVI_1478_VIS")[0]  # zero-copy view of the Y column of one video (see add_directory)
+    rows = store.select(alpha_min=2.0)  # global rows of annotated frames with alpha >= 2°
+    gt, names, frames = store.sample(1024)
+"""
+import os
+import sys
+import json
+import argparse
+import numpy as np
+
+COLUMNS = ("Y", "alpha", "xs", "ys", "xe", "ye")
+
+
+class GTStore:
+    def __init__(self, store_dir, mode='r'):
+        """
+        Opens an existing store (see GTStore.create to create one).
+        :param store_dir: directory of the store
+        :param mode: 'r' (read-only) or 'r+' (read-write, needed by put, remove and compact)
+        """
+        self.store_dir = store_dir
+        self.mode = mode
+        self.columns_path = os.path.join(store_dir, "columns.npy")
+        self.index_path = os.path.join(store_dir, "index.json")
+        with open(self.index_path) as index_file:
+            index = json.load(index_file)
+        self.size = index["size"]  # number of used positions of columns.npy (live slots and holes)
+        self.slots = index["videos"]  # {video name: {"offset", "length", "capacity", "source_mtime"}}
+        self.columns = np.load(self.columns_path, mmap_mode=mode)
+        self._live_cache = None
+
+    @classmethod
+    def create(cls, store_dir, capacity=1024):
+        """
+        Creates an empty store in the directory store_dir and opens it in read-write mode.
+        """
+        os.makedirs(store_dir, exist_ok=True)
+        columns = np.lib.format.open_memmap(os.path.join(store_dir, "columns.npy"), mode="w+", dtype=np.float32,
+                                            shape=(len(COLUMNS), capacity))
+        columns[:] = np.nan
+        del columns
+        with open(os.path.join(store_dir, "index.json"), "w") as index_file:
+            json.dump({"size": 0, "videos": {}}, index_file)
+        return cls(store_dir, mode='r+')
+
+    # # # # # # # # # # # # # # # # # # # # # # # # Reading # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+    @property
+    def videos(self):
+        return sorted(self.slots)
+
+    def __len__(self):
+        """
+        Number of stored frames (all videos).
+        """
+        return sum(slot["length"] for slot in self.slots.values())
+
+    def video(self, name):
+        """
+        :return: a zero-copy view of shape (6, length) of the gt columns of the video 'name'
+        """
+        slot = self.slots[name]
+        return self.columns[:, slot["offset"]:slot["offset"] + slot["length"]]
+
+    def gt(self, name):
+        """
+        :return: a zero-copy view of shape (length, 6) of the gt of the video 'name', in the layout of gt files
+        """
+        return self.video(name).T
+
+    def global_rows(self, name, frames):
+        """
+        :return: the positions in columns.npy of the frames 'frames' (an index, a slice or an array) of the video 'name'
+        """
+        slot = self.slots[name]
+        return slot["offset"] + np.arange(slot["length"])[frames]
+
+    def _live(self):
+        """
+        :return: a tuple (offsets, lengths, names) of the live slots sorted by offset, and a boolean mask of the live
+        positions of columns.npy
+        """
+        if self._live_cache is None:
+            names = sorted(self.slots, key=lambda name: self.slots[name]["offset"])
+            offsets = np.array([self.slots[name]["offset"] for name in names], dtype=np.int64)
+            lengths = np.array([self.slots[name]["length"] for name in names], dtype=np.int64)
+            mask = np.zeros(self.size, dtype=bool)
+            for offset, length in zip(offsets, lengths):
+                mask[offset:offset + length] = True
+            self._live_cache = (offsets, lengths, np.array(names, dtype=object), mask)
+        return self._live_cache
+
+    def select(self, annotated=True, alpha_min=None, alpha_max=None, Y_min=None, Y_max=None, videos=None):
+        """
+        Vectorized filter over all stored frames.
+        :param annotated: if True, only annotated (non-nan) frames are selected
+        :param alpha_min: minimum alpha (degrees), or None
+        :param alpha_max: maximum alpha (degrees), or None
+        :param Y_min: minimum Y (pixels), or None
+        :param Y_max: maximum Y (pixels), or None
+        :param videos: an iterable of video names the selection is restricted to, or None for all videos
+        :return: a sorted array of the selected positions in columns.npy (see self.rows and self.locate)
+        """
+        _, _, _, mask = self._live()
+        mask = mask.copy()
+        if videos is not None:
+            keep = np.zeros_like(mask)
+            for name in videos:
+                slot = self.slots[name]
+                keep[slot["offset"]:slot["offset"] + slot["length"]] = True
+            mask &= keep
+        Y = self.columns[0, :self.size]
+        alpha = self.columns[1, :self.size]
+        if annotated:
+            mask &= ~np.isnan(Y)
+        for column, bound, keep_above in ((alpha, alpha_min, True), (alpha, alpha_max, False),
+                                          (Y, Y_min, True), (Y, Y_max, False)):
+            if bound is not None:
+                mask &= (column >= bound) if keep_above else (column <= bound)
+        return np.flatnonzero(mask)
+
+    def rows(self, positions):
+        """
+        :return: an array of shape (len(positions), 6) of the gt rows at the positions 'positions' of columns.npy
+        """
+        positions = np.asarray(positions)
+        order = np.argsort(positions, kind='stable')  # read the memory map in increasing order
+        gathered = np.empty((positions.size, len(COLUMNS)), dtype=np.float32)
+        gathered[order] = self.columns[:, positions[order]].T
+        return gathered
+
+    def locate(self, positions):
+        """
+        :return: a tuple (names, frames) of the video names and frame indexes of the positions of columns.npy
+        """
+        offsets, _, names, _ = self._live()
+        slot = np.searchsorted(offsets, positions, side='right') - 1
+        return names[slot], np.asarray(positions) - offsets[slot]
+
+    def sample(self, n, rng=None, **filters):
+        """
+        Randomly samples n frames (with replacement) among the frames selected by self.select(**filters).
+        :return: a tuple (gt rows of shape (n, 6), video names, frame indexes)
+        """
+        rng = np.random.default_rng() if rng is None else rng
+        positions = rng.choice(self.select(**filters), size=n)
+        names, frames = self.locate(positions)
+        return self.rows(positions), names, frames
+
+    # # # # # # # # # # # # # # # # # # # # # # # # Writing # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+    def put(self, name, gt, source_mtime=None):
+        """
+        Stores (or replaces) the gt of the video 'name'. The video's slot is rewritten in place if the new gt fits in
+        it; otherwise, a new slot is appended (the old one becomes a hole, reclaimed by self.compact).
+        :param name: name of the video
+        :param gt: an array of shape (N, 6), with N > 0 (an empty slot would share its offset with the next video,
+        which would make self.locate ambiguous)
+        :param source_mtime: modification time of the gt file gt comes from (see self.add_directory)
+        """
+        gt = np.asarray(gt, dtype=np.float32)
+        if len(gt) == 0:
+            raise ValueError("Can't store the gt of '{}': it has no frames".format(name))
+        slot = self.slots.get(name)
+        if slot is None or len(gt) > slot["capacity"]:
+            self._reserve(self.size + len(gt))
+            slot = {"offset": self.size, "capacity": len(gt)}
+            self.size += len(gt)
+        self.columns[:, slot["offset"]:slot["offset"] + len(gt)] = gt.T
+        self.columns[:, slot["offset"] + len(gt):slot["offset"] + slot["capacity"]] = np.nan
+        slot["length"] = len(gt)
+        slot["source_mtime"] = source_mtime
+        self.slots[name] = slot
+        self._live_cache = None
+        self._save_index()
+
+    def remove(self, name):
+        del self.slots[name]
+        self._live_cache = None
+        self._save_index()
+
+    def _reserve(self, capacity):
+        """
+        Grows columns.npy (doubling its capacity) if it holds less than 'capacity' positions.
+        """
+        if capacity <= self.columns.shape[1]:
+            return
+        new_capacity = max(capacity, 2 * self.columns.shape[1])
+        self._rewrite([(0, 0, self.size)], new_capacity)
+
+    def _rewrite(self, moves, capacity):
+        """
+        Writes a new columns.npy of 'capacity' positions, copying the ranges 'moves' (a list of tuples (new offset,
+        old offset, length)) of the current one, and replaces the current file with it.
+        """
+        tmp_path = self.columns_path + ".tmp.npy"
+        new_columns = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32,
+                                                shape=(len(COLUMNS), capacity))
+        new_columns[:] = np.nan
+        for new_offset, old_offset, length in moves:
+            new_columns[:, new_offset:new_offset + length] = self.columns[:, old_offset:old_offset + length]
+        new_columns.flush()
+        del new_columns
+        del self.columns
+        os.replace(tmp_path, self.columns_path)
+        self.columns = np.load(self.columns_path, mmap_mode=self.mode)
+
+    def compact(self):
+        """
+        Rewrites columns.npy without holes (slots left by videos whose gt grew or that were removed).
+        """
+        moves, offset = [], 0
+        for name in sorted(self.slots, key=lambda name: self.slots[name]["offset"]):
+            slot = self.slots[name]
+            moves.append((offset, slot["offset"], slot["length"]))
+            slot["offset"], slot["capacity"] = offset, slot["length"]
+            offset += slot["length"]
+        self._rewrite(moves, max(offset, 1))
+        self.size = offset
+        self._live_cache = None
+        self._save_index()
+
+    def add_directory(self, root):
+        """
+        Stores the gt files found under the directory root (see BatchCLI.find_dataset_files). Gt files not modified
+        since they were stored are skipped, so that only changed videos are rewritten. Empty gt files are skipped too
+        (and a video whose gt file became empty is removed from the store).
+        :return: the list of names of the stored (new or changed) videos. Videos are named by their path relative to
+        root (see BatchCLI.video_key), so that videos with the same file name in different directories don't collide.
+        """
+        from AnnotationGUI.BatchCLI import find_dataset_files, video_key
+        stored = []
+        for gt_path in find_dataset_files(root)[0]:
+            name = video_key(gt_path, root)
+            mtime = os.path.getmtime(gt_path)
+            if name in self.slots and self.slots[name].get("source_mtime") == mtime:
+                continue
+            gt = np.load(gt_path)
+            if len(gt) == 0:
+                if name in self.slots:
+                    self.remove(name)
+                continue
+            self.put(name, gt, source_mtime=mtime)
+            stored.append(name)
+        return stored
+
+    def _save_index(self):
+        self.columns.flush()
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w") as index_file:
+            json.dump({"size": self.size, "videos": self.slots}, index_file)
+        os.replace(tmp_path, self.index_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or inspect a dataset-wide gt store.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="store (or update) all gt files found under a directory")
+    build.add_argument("root")
+    build.add_argument("store_dir")
+    build.add_argument("--compact", action="store_true", help="reclaim holes after updating")
+    info = subparsers.add_parser("info", help="print the content of a store")
+    info.add_argument("store_dir")
+    args = parser.parse_args(argv)
+    if args.command == "build":
+        if os.path.exists(os.path.join(args.store_dir, "index.json")):
+            store = GTStore(args.store_dir, mode='r+')
+        else:
+            store = GTStore.create(args.store_dir)
+        stored = store.add_directory(args.root)
+        if args.compact:
+            store.compact()
+        print("{} videos stored or updated, {} videos and {} frames in the store".format(
+            len(stored), len(store.videos), len(store)))
+    else:
+        store = GTStore(args.store_dir)
+        annotated = store.select()
+        print("{} videos, {} frames ({} annotated)".format(len(store.videos), len(store), annotated.size))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
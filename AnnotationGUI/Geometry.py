@@ -0,0 +1,161 @@
+import numpy as np
+
+# Vectorized conversions between horizon line representations. A gt row holds (Y, alpha, xs, ys, xe, ye), following
+# the convention of CustomWidgets.ImageDisplay.get_horizon_coordinates:
+#   * Y is the y coordinate of the line at x = int((org_w - 1) / 2), where org_w is the width of the original image,
+#   * alpha is the angle of the line in degrees, positive when the line rises from left to right (-atan(slope)),
+#   * (xs, ys) and (xe, ye) are the points of the line at x = 0 and x = org_w - 1.
+# Degenerate lines (vertical lines, lines through two identical points, non-finite inputs) can't be represented this
+# way: all functions map them to rows of np.nan, like non-annotated frames, instead of raising or warning.
+
+
+def _column(values):
+    return np.atleast_1d(np.asarray(values, dtype=np.float64))
+
+
+def gt_from_slope_intercept(slope, intercept, org_w):
+    """
+    Computes gt rows from the slopes and intercepts of lines (y = slope * x + intercept).
+    :param slope: scalar or array of slopes
+    :param intercept: scalar or array of intercepts (same shape as slope)
+    :param org_w: width of the original image
+    :return: a float32 array of shape (N, 6), where N is the number of lines (rows of degenerate lines are np.nan)
+    """
+    slope, intercept = _column(slope), _column(intercept)
+    x_hl = int((org_w - 1) / 2)
+    gt = np.empty((slope.size, 6), dtype=np.float32)
+    with np.errstate(invalid='ignore', over='ignore'):
+        gt[:, 0] = slope * x_hl + intercept
+        alpha = np.arctan(slope)
+        alpha *= -180 / np.pi
+        gt[:, 1] = alpha
+        gt[:, 2] = 0
+        gt[:, 3] = intercept
+        gt[:, 4] = org_w - 1
+        gt[:, 5] = slope * (org_w - 1) + intercept
+        degenerate = ~np.isfinite(gt[:, 5])  # non-finite slope or intercept
+    if degenerate.any():
+        gt[degenerate] = np.nan
+    return gt
+
+
+def slope_intercept_from_xy_ends(xs, ys, xe, ye):
+    """
+    :return: a tuple (slope, intercept) of float64 arrays of the lines passing through (xs, ys) and (xe, ye) (np.nan for
+    vertical lines and identical points)
+    """
+    xs, ys, xe, ye = (_column(c) for c in (xs, ys, xe, ye))
+    dx = xe - xs
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = np.where(dx != 0, (ye - ys) / np.where(dx != 0, dx, 1), np.nan)
+    return slope, ys - slope * xs
+
+
+def gt_from_xy_ends(xs, ys, xe, ye, org_w):
+    """
+    Computes gt rows from two points (xs, ys), (xe, ye) of each line. Lines are extended to the whole image width.
+    :return: a float32 array of shape (N, 6), where N is the number of lines
+    """
+    return gt_from_slope_intercept(*slope_intercept_from_xy_ends(xs, ys, xe, ye), org_w)
+
+
+def slope_intercept_from_gt(gt, org_w):
+    """
+    :param gt: array of shape (N, 6) (or (N, 2): only Y and alpha are used)
+    :return: a tuple (slope, intercept) of float64 arrays (np.nan for non-annotated rows and for |alpha| >= 90°)
+    """
+    gt = np.asarray(gt)
+    Y = np.asarray(gt[..., 0], dtype=np.float64).ravel()
+    alpha = np.asarray(gt[..., 1], dtype=np.float64).ravel()
+    slope = np.tan(np.radians(alpha))
+    slope *= -1
+    slope[~(np.abs(alpha) < 90)] = np.nan
+    intercept = slope * -int((org_w - 1) / 2)
+    intercept += Y
+    return slope, intercept
+
+
+def xy_ends_from_y_alpha(Y, alpha, org_w):
+    """
+    Computes the end points (xs, ys, xe, ye) of lines at x = 0 and x = org_w - 1 from their Y and alpha.
+    :param Y: scalar or array of Y values
+    :param alpha: scalar or array of alpha values in degrees (same shape as Y)
+    :param org_w: width of the original image
+    :return: a float64 array of shape (N, 4) (rows of degenerate lines are np.nan)
+    """
+    Y, alpha = _column(Y), _column(alpha)
+    slope, intercept = slope_intercept_from_gt(np.column_stack((Y, alpha)), org_w)
+    xy_ends = np.empty((Y.size, 4), dtype=np.float64)
+    xy_ends[:, 0] = 0
+    xy_ends[:, 1] = intercept
+    xy_ends[:, 2] = org_w - 1
+    xy_ends[:, 3] = slope * (org_w - 1) + intercept
+    xy_ends[np.isnan(intercept)] = np.nan
+    return xy_ends
+
+
+def rescale_gt(gt, org_size, new_size):
+    """
+    Maps gt rows from frames of size org_size to the same frames resized to new_size.
+    :param gt: array of shape (N, 6) of gt rows (rows of np.nan are kept as such)
+    :param org_size: a tuple (width, height) of the frames gt refers to
+    :param new_size: a tuple (width, height) of the resized frames
+    :return: a float32 array of shape (N, 6)
+    """
+    slope, intercept = slope_intercept_from_gt(gt, org_size[0])
+    sx, sy = new_size[0] / org_size[0], new_size[1] / org_size[1]
+    return gt_from_slope_intercept(slope * sy / sx, intercept * sy, new_size[0])
+
+
+def crop_gt(gt, org_size, crop):
+    """
+    Maps gt rows from frames of size org_size to the crop 'crop' of these frames. Lines are extended to the width of
+    the crop, whether or not they cross it (see clip_xy_ends).
+    :param gt: array of shape (N, 6) of gt rows
+    :param org_size: a tuple (width, height) of the frames gt refers to
+    :param crop: a tuple (x, y, width, height) of the crop rectangle, in pixels of the frames
+    :return: a float32 array of shape (N, 6)
+    """
+    x0, y0, crop_w, _ = crop
+    slope, intercept = slope_intercept_from_gt(gt, org_size[0])
+    return gt_from_slope_intercept(slope, intercept + slope * x0 - y0, crop_w)
+
+
+def flip_gt(gt, org_size, horizontal=True, vertical=False):
+    """
+    Maps gt rows to the same frames flipped horizontally (mirrored left to right) and/or vertically.
+    :param gt: array of shape (N, 6) of gt rows
+    :param org_size: a tuple (width, height) of the frames gt refers to
+    :return: a float32 array of shape (N, 6)
+    """
+    org_w, org_h = org_size
+    slope, intercept = slope_intercept_from_gt(gt, org_w)
+    if horizontal:  # x' = org_w - 1 - x
+        slope, intercept = -slope, intercept + slope * (org_w - 1)
+    if vertical:  # y' = org_h - 1 - y
+        slope, intercept = -slope, org_h - 1 - intercept
+    return gt_from_slope_intercept(slope, intercept, org_w)
+
+
+def clip_xy_ends(xy_ends, org_size):
+    """
+    Clips line segments to the image bounds [0, org_w - 1] x [0, org_h - 1] (Liang-Barsky algorithm, vectorized).
+    :param xy_ends: array of shape (N, 4) of segments (xs, ys, xe, ye), e.g., gt[:, 2:]
+    :param org_size: a tuple (width, height) of the image
+    :return: a float64 array of shape (N, 4) of the clipped segments (np.nan for segments outside the image)
+    """
+    xy_ends = np.asarray(xy_ends, dtype=np.float64).reshape(-1, 4)
+    xs, ys, xe, ye = xy_ends.T
+    dx, dy = xe - xs, ye - ys
+    t0, t1 = np.zeros(len(xy_ends)), np.ones(len(xy_ends))
+    # each boundary is p * t <= q
+    for p, q in ((-dx, xs), (dx, org_size[0] - 1 - xs), (-dy, ys), (dy, org_size[1] - 1 - ys)):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = q / p
+        entering, leaving = p < 0, p > 0
+        t0 = np.where(entering, np.maximum(t0, t), t0)
+        t1 = np.where(leaving, np.minimum(t1, t), t1)
+        t1 = np.where((p == 0) & (q < 0), -1, t1)  # parallel to the boundary and outside of it
+    clipped = np.column_stack((xs + t0 * dx, ys + t0 * dy, xs + t1 * dx, ys + t1 * dy))
+    clipped[~(t0 <= t1) | np.isnan(xy_ends).any(axis=1)] = np.nan
+    return clipped
@@ -0,0 +1,405 @@
+"""
+Reproducible benchmark of frame navigation, rendering and line drawing in the annotation GUI.
+
+Synthetic videos (a noisy sea/sky scene with a moving horizon) are generated in a temporary directory at several
+resolutions and codecs. For each video, the benchmark measures:
+    * the time to first frame and to ready of MainInterface.open_video (first opening, which builds the seek index,
+      and reopening),
+    * the step latency of browse_next/browse_back at several browsing offsets (from the browsing event to the frame
+      being shown; each series starts with an empty frame cache and requests a different frame at each step),
+    * the render time of ImageDisplay.show_img,
+    * the cost of mouse motion events while drawing a line (ImageDisplay._draw_shapes),
+and the peak resident memory of the process. Results are written to a JSON file, which can be compared to a previous
+run with --compare.
+
+Tk needs a display; on a headless machine, run the benchmark under a virtual X server:
+    xvfb-run -s "-screen 0 1920x1080x24" python -m AnnotationGUI.GuiBenchmark --out results.json
+The render time and the cost of mouse motion events are measured with the renderer of ImageDisplay (--renderer
+canvas, a persistent canvas image updated in place, with lines as canvas items) or with the renderer it replaced
+(--renderer label, a new Label and PhotoImage per shown image, see LabelRenderer). Comparing both runs gives the gain:
+    xvfb-run -s "-screen 0 1920x1080x24" python -m AnnotationGUI.GuiBenchmark --renderer label --out label.json
+    xvfb-run -s "-screen 0 1920x1080x24" python -m AnnotationGUI.GuiBenchmark --out canvas.json --compare label.json
+If no display is available, the benchmark falls back to a headless mode measuring the same pipeline without Tk
+(decoding through FramePrefetcher, colour conversion and resizing as done by show_img); GUI-only measurements are
+then omitted.
+
+    python -m AnnotationGUI.GuiBenchmark --out new.json --compare baseline.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import argparse
+import tkinter as tk
+from types import SimpleNamespace
+import numpy as np
+import cv2 as cv
+
+RESOLUTIONS = {"480p": (854, 480), "720p": (1280, 720), "1080p": (1920, 1080)}
+CODECS = {"mp4v": ".mp4", "MJPG": ".avi"}  # fourcc: file extension
+OFFSETS = (1, 5, 30)
+RENDERERS = ("canvas", "label")
+
+
+def make_synthetic_video(path, size, frames_nbr, codec, fps=30, seed=0):
+    """
+    Writes a synthetic video: a noisy sea/sky scene whose horizon moves and tilts slowly.
+    :param path: path of the video file to write
+    :param size: a tuple (width, height)
+    :param frames_nbr: number of frames
+    :param codec: a fourcc code (see CODECS)
+    """
+    w, h = size
+    rng = np.random.default_rng(seed)
+    writer = cv.VideoWriter(path, cv.VideoWriter_fourcc(*codec), fps, (w, h))
+    if not writer.isOpened():
+        raise RuntimeError("OpenCV can't write {} videos".format(codec))
+    rows, columns = np.arange(h)[:, None], np.arange(w)[None, :]
+    sky, sea = np.array([230, 200, 170], np.uint8), np.array([90, 60, 20], np.uint8)
+    for i in range(frames_nbr):
+        slope = 0.05 * np.sin(i / 25)
+        intercept = h * (0.5 + 0.1 * np.sin(i / 10)) - slope * w / 2
+        frame = np.where((rows > slope * columns + intercept)[..., None], sea, sky)
+        noise = rng.integers(0, 25, size=(h, w, 1), dtype=np.uint8)
+        writer.write(cv.add(frame, np.repeat(noise, 3, axis=2)))
+    writer.release()
+
+
+def peak_rss_mb():
+    """
+    :return: the peak resident set size of the process in megabytes, or None if it can't be measured
+    """
+    try:
+        import resource
+    except ImportError:  # Windows
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return psutil.Process().memory_info().peak_wset / 2 ** 20
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10  # bytes on macOS, kilobytes elsewhere
+
+
+def summarize_ms(seconds):
+    """
+    :return: a dictionary of statistics (in milliseconds) of the durations 'seconds'
+    """
+    ms = np.asarray(seconds) * 1000
+    return {"n": int(ms.size), "mean": float(ms.mean()), "p50": float(np.percentile(ms, 50)),
+            "p90": float(np.percentile(ms, 90)), "max": float(ms.max())}
+
+
+def _remove_sidecars(video_path):
+    # deletes the files written next to the video (seek index, journal, autosave), so that opening it is a first opening
+    base = os.path.splitext(video_path)[0]
+    for suffix in ("_SeekIndex.npz", "_LineGT.journal", "_LineGT.npy", "_LineGT_flags.npy"):
+        if os.path.exists(base + suffix):
+            os.remove(base + suffix)
+
+
+class LabelRenderer:
+    """
+    The renderer of ImageDisplay before it drew on a persistent canvas, kept to measure the difference: each shown
+    image is a new PhotoImage on a new Label (the previous Label is only ungridded, as it was), and each mouse motion
+    while drawing copies the shown image, draws the line on the copy and shows the copy the same way.
+    """
+    def __init__(self, master, wmax, hmax):
+        self.wmax = wmax
+        self.hmax = hmax
+        self.frame = tk.LabelFrame(master=master, text="Label renderer")
+        self.im_as_tk = None
+        self.label = tk.Label(self.frame)
+        self.label.grid(row=0, column=0)
+        self.frame.grid(row=0, column=0)
+        self.cur_shown = None  # the PIL image shown now, drawings included
+        self.cur_with_valid_drawings = None  # the shown original image, on which lines are drawn
+        self.im_as_pil_org = None
+        self.line_start = None  # (x, y) of the start of the line being drawn, None if no line is being drawn
+
+    def show_img(self, src, src_type, set_as_org=True):
+        """
+        Shows 'src', a BGR numpy image (src_type 'numpy') or a PIL image (src_type 'pil'), as ImageDisplay.show_img did.
+        """
+        from PIL import Image, ImageTk
+        from AnnotationGUI.CustomWidgetsHelpers import check_img_size
+        self.label.grid_forget()
+        if src_type == 'numpy':
+            src = Image.fromarray(cv.cvtColor(src, cv.COLOR_RGB2BGR))
+        self.cur_shown = check_img_size(im_as_pil=src, wmax=self.wmax, hmax=self.hmax)[0]
+        self.im_as_tk = ImageTk.PhotoImage(self.cur_shown)
+        self.label = tk.Label(self.frame, image=self.im_as_tk)
+        self.label.grid(row=0, column=0)
+        if set_as_org:
+            self.im_as_pil_org = src
+            self.cur_with_valid_drawings = self.cur_shown.copy()
+        self.label.bind("<Button-1>", self._draw_line)
+        self.label.bind("<Motion>", self._draw_line)
+        self.label.bind("<ButtonRelease-1>", self._draw_line)
+
+    def _draw_line(self, event):
+        from PIL import ImageDraw
+        if str(event.type) == "ButtonPress":
+            self.line_start = (event.x, event.y)
+        elif str(event.type) == "ButtonRelease":
+            self.line_start = None
+        elif self.line_start is not None:
+            self.cur_shown = self.cur_with_valid_drawings.copy()
+            ImageDraw.Draw(self.cur_shown).line(self.line_start + (event.x, event.y), fill=128, width=1)
+            self.show_img(self.cur_shown, 'pil', set_as_org=False)
+
+
+def bench_render(root, show_img, widget, steps):
+    """
+    Measures the render time of a frame and the cost of mouse motion events while drawing a line.
+    :param show_img: a function showing the frame, returning the size (width, height) it's shown at
+    :param widget: a function returning the widget receiving mouse events (the Label renderer replaces its widget)
+    :return: a dictionary of measurements
+    """
+    results = {}
+    times = []
+    for _ in range(steps):
+        start = time.perf_counter()
+        w, h = show_img()
+        root.update_idletasks()
+        times.append(time.perf_counter() - start)
+    results["show_img"] = summarize_ms(times)
+
+    # a line drawn from left to right with the left mouse button: one press, many motion events, one release
+    widget().event_generate("<Button-1>", x=10, y=h // 2)
+    times = []
+    for x in np.linspace(11, w - 10, steps * 4).astype(int):
+        start = time.perf_counter()
+        widget().event_generate("<Motion>", x=int(x), y=h // 2 + int(x) % 7)
+        root.update_idletasks()
+        times.append(time.perf_counter() - start)
+    widget().event_generate("<ButtonRelease-1>", x=w - 10, y=h // 2)
+    results["draw_motion"] = summarize_ms(times)
+    return results
+
+
+def step_series(frames_nbr, offset, sign, steps):
+    """
+    Plans a series of browsing steps that each request a different frame: the series starts at the first frame (next,
+    sign = 1) or at the last one (back, sign = -1), and has at most 'steps' steps, fewer if the video is too short
+    (a step past the end would be clamped and request the frame already shown, a cache hit).
+    :return: a tuple (index of the start frame, number of steps)
+    """
+    return (0 if sign > 0 else frames_nbr - 1), min(steps, (frames_nbr - 1) // offset)
+
+
+def bench_tk(app, video_path, steps, renderer="canvas"):
+    """
+    Drives the MainInterface 'app' and its ImageDisplay. The same MainInterface is reused for all videos (as in the
+    GUI), because ImageDisplay callbacks are registered at class level.
+    :param renderer: one of RENDERERS: rendering is measured on the ImageDisplay of app ("canvas") or on a LabelRenderer
+    of the same size in another window ("label")
+    :return: a dictionary of measurements
+    """
+    root = app.master
+    results = {}
+
+    def wait_shown():
+        while app.navigation_scheduler.pending:
+            root.update()
+        root.update_idletasks()
+
+    for opening in ("first_open", "reopen"):
+        if opening == "first_open":
+            _remove_sidecars(video_path)
+        start = time.perf_counter()
+        app.open_video(video_path)  # opens in the background (see VideoOpener)
+        first_frame_ms = None
+        while app.opener is not None:
+            root.update()
+            if first_frame_ms is None and app.opening_first_frame_shown:
+                first_frame_ms = (time.perf_counter() - start) * 1000
+        root.update_idletasks()
+        results[opening + "_ms"] = (time.perf_counter() - start) * 1000
+        results[opening + "_first_frame_ms"] = first_frame_ms
+
+    key_press = SimpleNamespace(type="KeyPress", delta=0)
+    for offset in OFFSETS:
+        app.browsing_offset = offset
+        app.video_reader.set_browsing_offset(offset)
+        for direction, sign, browse in (("next", 1, app.browse_next), ("back", -1, app.browse_back)):
+            index, steps_nbr = step_series(app.frames_nbr, offset, sign, steps)
+            app.go_to_frame(index)  # not measured
+            wait_shown()
+            app.video_reader.cache.clear()  # frames decoded by previous series would be cache hits
+            times = []
+            for _ in range(steps_nbr):
+                start = time.perf_counter()
+                browse(key_press)
+                wait_shown()
+                times.append(time.perf_counter() - start)
+            if times:  # no step fits in videos shorter than the offset
+                results["step_{}_offset_{}".format(direction, offset)] = summarize_ms(times)
+
+    frame = app.frame_as_np
+    if renderer == "canvas":
+        display = app.img_display
+
+        def show_img():
+            display.show_img(src=frame, src_type='numpy', set_as_org=True)
+            return display.w_scaled, display.h_scaled
+        results.update(bench_render(root, show_img, lambda: display.canvas, steps))
+    else:
+        window = tk.Toplevel(root)
+        label_renderer = LabelRenderer(window, app.max_img_width, app.max_img_height)
+        root.update()
+
+        def show_img():
+            label_renderer.show_img(frame, 'numpy')
+            return label_renderer.cur_shown.size
+        results.update(bench_render(root, show_img, lambda: label_renderer.label, steps))
+        window.destroy()
+    return results
+
+
+def bench_headless(video_path, steps, wmax=1720, hmax=960):
+    """
+    Measures the non-Tk part of the display pipeline: opening, decoding through FramePrefetcher, colour conversion and
+    resizing (as done by ImageDisplay.show_img for a display of wmax x hmax pixels).
+    :return: a dictionary of measurements
+    """
+    from PIL import Image
+    from AnnotationGUI.SeekIndex import get_seek_index
+    from AnnotationGUI.FramePrefetcher import FramePrefetcher
+    from AnnotationGUI.CustomWidgetsHelpers import check_img_size
+
+    def prepare(frame):
+        return check_img_size(Image.fromarray(cv.cvtColor(frame, cv.COLOR_BGR2RGB)), wmax, hmax)
+
+    results = {}
+    reader = None
+    for opening in ("first_open", "reopen"):
+        if opening == "first_open":
+            _remove_sidecars(video_path)
+        if reader is not None:
+            reader.close()
+        start = time.perf_counter()
+        reader = FramePrefetcher(video_path, seek_index=get_seek_index(video_path))
+        prepare(reader.get_frame(0)[1])
+        results[opening + "_ms"] = (time.perf_counter() - start) * 1000
+
+    for offset in OFFSETS:
+        reader.set_browsing_offset(offset)
+        for direction, sign in (("next", 1), ("back", -1)):
+            index, steps_nbr = step_series(reader.frames_nbr, offset, sign, steps)
+            reader.get_frame(index)  # not measured
+            reader.cache.clear()  # frames decoded by previous series would be cache hits
+            times = []
+            for _ in range(steps_nbr):
+                index += sign * offset
+                start = time.perf_counter()
+                prepare(reader.get_frame(index)[1])
+                times.append(time.perf_counter() - start)
+            if times:  # no step fits in videos shorter than the offset
+                results["step_{}_offset_{}".format(direction, offset)] = summarize_ms(times)
+
+    frame = reader.get_frame(index)[1]
+    times = []
+    for _ in range(steps):
+        start = time.perf_counter()
+        prepare(frame)
+        times.append(time.perf_counter() - start)
+    results["show_img_prepare"] = summarize_ms(times)
+    reader.close()
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    :return: a list of lines describing the measurements of 'results' slower than in 'baseline' by more than
+    'tolerance' (a fraction), comparing means of summaries and single values. Measurements missing from either run
+    (e.g., None when a first frame wasn't shown) are skipped.
+    """
+    lines = []
+    for video, measurements in results["videos"].items():
+        for name, value in measurements.items():
+            old = baseline.get("videos", {}).get(video, {}).get(name)
+            if old is None or value is None or isinstance(old, dict) != isinstance(value, dict):
+                continue
+            new_ms, old_ms = (value["mean"], old["mean"]) if isinstance(value, dict) else (value, old)
+            if old_ms > 0 and new_ms > old_ms * (1 + tolerance):
+                lines.append("{} {}: {:.2f} ms -> {:.2f} ms (+{:.0f}%)".format(video, name, old_ms, new_ms,
+                                                                             100 * (new_ms / old_ms - 1)))
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark frame navigation, rendering and line drawing.")
+    parser.add_argument("--out", default="gui_benchmark.json", help="JSON file the results are written to")
+    parser.add_argument("--resolutions", default=",".join(RESOLUTIONS), help="comma-separated, among " +
+                        ", ".join(RESOLUTIONS))
+    parser.add_argument("--codecs", default=",".join(CODECS), help="comma-separated, among " + ", ".join(CODECS))
+    parser.add_argument("--frames", type=int, default=300, help="number of frames of each synthetic video")
+    parser.add_argument("--steps", type=int, default=30, help="number of measured steps per measurement")
+    parser.add_argument("--headless", action="store_true", help="don't use Tk even if a display is available")
+    parser.add_argument("--renderer", choices=RENDERERS, default="canvas",
+                        help="renderer the render time and motion events are measured with (Tk only)")
+    parser.add_argument("--compare", help="a previous results file; slower measurements are reported")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="relative slowdown reported by --compare")
+    args = parser.parse_args(argv)
+
+    root, app = None, None
+    if not args.headless:
+        try:
+            root = tk.Tk()
+        except tk.TclError as error:
+            print("no display ({}): running the headless benchmark".format(error))
+    if root is not None:
+        from AnnotationGUI.MainInterface import MainInterface
+        root.geometry("1920x1080+0+0")
+        app = MainInterface(master=root)
+        app.grid(row=0, column=0)
+        root.update()
+    if root is None and args.renderer != "canvas":
+        print("--renderer {} needs Tk: rendering isn't measured by the headless benchmark".format(args.renderer))
+    results = {"mode": "tk" if root is not None else "headless",
+               "renderer": args.renderer if root is not None else None,
+               "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                               "opencv": cv.__version__, "cpus": os.cpu_count()},
+               "videos": {}}
+    work_dir = tempfile.mkdtemp(prefix="horizon_benchmark_")
+    try:
+        for resolution in args.resolutions.split(","):
+            for codec in args.codecs.split(","):
+                name = "{}_{}".format(resolution, codec)
+                video_path = os.path.join(work_dir, name + CODECS[codec])
+                make_synthetic_video(video_path, RESOLUTIONS[resolution], args.frames, codec)
+                if app is not None:
+                    measurements = bench_tk(app, video_path, args.steps, args.renderer)
+                else:
+                    measurements = bench_headless(video_path, args.steps)
+                results["videos"][name] = measurements
+                print("{}: first frame {:.1f} ms, step (offset 1) {:.1f} ms".format(
+                    name, measurements["first_open_ms"], measurements["step_next_offset_1"]["mean"]), flush=True)
+    finally:
+        if app is not None:  # release the last video before deleting it
+            app.navigation_scheduler.close()
+            if app.video_reader is not None:
+                app.video_reader.close()
+            if app.journal is not None:
+                app.journal.close()
+            root.destroy()
+        shutil.rmtree(work_dir, ignore_errors=True)
+    results["peak_rss_mb"] = peak_rss_mb()
+    with open(args.out, "w") as out_file:
+        json.dump(results, out_file, indent=2)
+    print("results written to {} (peak RSS: {} MB)".format(args.out, results["peak_rss_mb"]))
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        for line in regressions:
+            print("slower: " + line)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
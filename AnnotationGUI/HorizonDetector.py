@@ -0,0 +1,176 @@
+import os
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import cv2 as cv
+from AnnotationGUI.Geometry import gt_from_slope_intercept
+from AnnotationGUI.FrameSources import read_frames
+from AnnotationGUI.SeekIndex import SeekIndex
+
+
+def detect_horizon(frame, max_width=640, max_tilt=30, band=3):
+    """
+    Proposes a horizon line on a frame with a classical (CPU-only) detector: a Canny edge map of the downscaled
+    grayscale frame, a Hough transform restricted to lines tilted by less than max_tilt degrees, and a least-squares
+    refit on the edge pixels lying within 'band' pixels of the strongest Hough line.
+    :param frame: a BGR or grayscale image (numpy array)
+    :param max_width: frames wider than max_width are downscaled to this width before detection
+    :param max_tilt: maximum absolute angle (in degrees) of proposed lines
+    :param band: half-width (in downscaled pixels) of the band of edge pixels used to refit the Hough line
+    :return: a float32 array (Y, alpha, xs, ys, xe, ye) in pixels of the frame (see Geometry), all np.nan if no line
+    is found
+    """
+    org_h, org_w = frame.shape[0:2]
+    gray = frame if frame.ndim == 2 else cv.cvtColor(frame, cv.COLOR_BGR2GRAY)
+    if org_w > max_width:
+        gray = cv.resize(gray, (max_width, int(org_h * max_width / org_w)), interpolation=cv.INTER_AREA)
+    h, w = gray.shape
+    gray = cv.GaussianBlur(gray, (5, 5), 0)
+    median = float(np.median(gray))
+    edges = cv.Canny(gray, max(0.0, 0.66 * median), min(255.0, 1.33 * median))
+
+    # theta is the angle of the line's normal: horizontal lines have theta = 90°
+    tilt = np.radians(max_tilt)
+    lines = cv.HoughLines(edges, 1, np.pi / 360, threshold=w // 4,
+                          min_theta=np.pi / 2 - tilt, max_theta=np.pi / 2 + tilt)
+    if lines is None:
+        return np.full(6, np.nan, dtype=np.float32)
+    rho, theta = lines[0, 0]  # lines are sorted by decreasing number of votes
+    slope = -np.cos(theta) / np.sin(theta)
+    intercept = rho / np.sin(theta)
+
+    ys, xs = np.nonzero(edges)
+    near = np.abs(ys - (slope * xs + intercept)) <= band
+    if np.count_nonzero(near) >= 2 and np.ptp(xs[near]) > 0:
+        slope, intercept = np.polyfit(xs[near], ys[near], 1)
+
+    # back to the frame's pixels
+    sx, sy = w / org_w, h / org_h
+    return gt_from_slope_intercept(slope * sx / sy, intercept / sy, org_w)[0]
+
+
+def proposals_path(video_file_path):
+    """
+    :return: path of the file caching the proposals of the video file video_file_path (next to the video)
+    """
+    return os.path.splitext(video_file_path)[0] + "_Proposals.npy"
+
+
+def load_proposals(video_file_path):
+    """
+    :return: the cached proposals (an array of shape (frames_nbr, 6)) of the video file, or None if there are none or
+    if they're older than the video file.
+    """
+    path = proposals_path(video_file_path)
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(video_file_path):
+        return np.load(path)
+    return None
+
+
+def _propose_chunk(video_file_path, start, stop, keyframe):
+    """
+    Proposes horizons on the frames start to stop - 1, decoded sequentially. Runs in a worker process.
+    :param keyframe: index of a keyframe at or before start (seeking there is exact), or None
+    :return: a tuple (start, proposals array of shape (stop - start, 6))
+    """
+    proposals = np.full((stop - start, 6), np.nan, dtype=np.float32)
+    for i, frame in enumerate(read_frames(video_file_path, start, stop, keyframe=keyframe)):
+        proposals[i] = detect_horizon(frame)
+    return start, proposals
+
+
+def propose_video(video_file_path, frames_nbr, seek_index=None, workers=None, chunk_len=500,
+                  progress_callback=None):
+    """
+    Proposes horizons on all frames of a video, in chunks of consecutive frames processed by a pool of processes, and
+    caches the proposals next to the video (see proposals_path). A cache file that can't be written (e.g., read-only
+    directory) is not an error. Worker processes are spawned, not forked: this runs in a thread of the GUI, and forking a
+    process running other threads (decoding, navigation, Tk) can deadlock the child on a lock one of them held.
+    :param video_file_path: path of the video file (or of another frame source, see FrameSources)
+    :param frames_nbr: number of frames in the video
+    :param seek_index: a SeekIndex of the video, used to start each chunk on an exact frame
+    :param workers: number of worker processes (default: number of CPUs)
+    :param chunk_len: number of frames per chunk
+    :param progress_callback: a function called as progress_callback(frames_done, frames_nbr) after each chunk
+    :return: an array of shape (frames_nbr, 6)
+    """
+    proposals = np.full((frames_nbr, 6), np.nan, dtype=np.float32)
+    frames_done = 0
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = []
+        for start in range(0, frames_nbr, chunk_len):
+            keyframe = None if seek_index is None else seek_index.keyframe_before(start)
+            futures.append(pool.submit(_propose_chunk, video_file_path, start, min(start + chunk_len, frames_nbr),
+                                       keyframe))
+        for future in as_completed(futures):
+            start, chunk = future.result()
+            proposals[start:start + len(chunk)] = chunk
+            frames_done += len(chunk)
+            if progress_callback is not None:
+                progress_callback(frames_done, frames_nbr)
+    try:
+        save_proposals(video_file_path, proposals)
+    except OSError:
+        pass
+    return proposals
+
+
+def save_proposals(video_file_path, proposals):
+    """
+    Writes the proposals cache of a video, replacing it atomically (a crash while writing never leaves a torn file).
+    """
+    path = proposals_path(video_file_path)
+    with open(path + ".tmp", "wb") as tmp_file:  # np.save would append '.npy' to the temporary path
+        np.save(tmp_file, proposals)
+    os.replace(path + ".tmp", path)
+
+
+def _synthetic_frame(w, h, rng):
+    # a noisy sea/sky frame with a tilted horizon
+    slope = rng.uniform(-0.2, 0.2)
+    intercept = rng.uniform(0.3, 0.7) * h
+    rows = np.arange(h)[:, None]
+    sea = rows > slope * np.arange(w)[None, :] + intercept
+    frame = np.where(sea[..., None], np.array([90, 60, 20], np.uint8), np.array([230, 200, 170], np.uint8))
+    noise = rng.integers(0, 25, size=(h, w, 1), dtype=np.uint8)
+    return cv.add(frame.astype(np.uint8), np.repeat(noise, 3, axis=2))
+
+
+def _benchmark_worker(w, h, frames_nbr, seed):
+    rng = np.random.default_rng(seed)
+    frames = [_synthetic_frame(w, h, rng) for _ in range(min(frames_nbr, 16))]
+    start = time.perf_counter()
+    for i in range(frames_nbr):
+        detect_horizon(frames[i % len(frames)])
+    return frames_nbr / (time.perf_counter() - start)
+
+
+def benchmark_detector(w=1920, h=1080, frames_nbr=200, workers=None):
+    """
+    Measures the throughput of detect_horizon on synthetic frames (decoding excluded), in frames per second per core
+    and in total with 'workers' processes.
+    :return: a dictionary {"fps_per_core": ..., "fps_total": ..., "workers": ...}
+    """
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        fps = list(pool.map(_benchmark_worker, [w] * workers, [h] * workers, [frames_nbr] * workers, range(workers)))
+    return {"fps_per_core": float(np.mean(fps)), "fps_total": float(np.sum(fps)), "workers": workers}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Horizon proposals for whole videos, or a detector benchmark.")
+    parser.add_argument("videos", nargs="*", help="video files to compute proposals for")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--benchmark", action="store_true", help="benchmark the detector on synthetic 1080p frames")
+    args = parser.parse_args()
+    if args.benchmark:
+        print(benchmark_detector(workers=args.workers))
+    for video in args.videos:
+        seek_index = SeekIndex.load(video) or SeekIndex.build(video)
+        start = time.perf_counter()
+        propose_video(video, seek_index.frames_nbr, seek_index=seek_index, workers=args.workers)
+        elapsed = time.perf_counter() - start
+        print("{}: {} frames in {:.1f} s ({:.1f} fps)".format(video, seek_index.frames_nbr, elapsed,
+                                                              seek_index.frames_nbr / elapsed))
@@ -0,0 +1,136 @@
+import numpy as np
+import cv2 as cv
+from AnnotationGUI.Geometry import gt_from_slope_intercept
+from AnnotationGUI.FrameSources import read_frames
+
+
+class HorizonTracker:
+    """
+    Follows a horizon line through consecutive frames by template matching on a band around the line.
+
+    The band around the line of the previous (downscaled, grayscale) frame is cut into vertical strips. Each strip is
+    searched for in the next frame, only vertically: along the horizon, the image is nearly invariant (aperture
+    problem), so only vertical motion can be measured, and it's all that's needed. A line is fitted to the matched
+    strip positions (with one pass of outlier rejection). The confidence of a frame is the fraction of strips that
+    matched well and agree with the fitted line.
+    """
+    def __init__(self, max_width=640, strips_nbr=32, band=8, search=12, min_score=0.8, min_std=2.0,
+                 fit_max_error=1.5):
+        """
+        :param max_width: frames wider than max_width are downscaled to this width before tracking
+        :param strips_nbr: number of strips along the line
+        :param band: half-height (in downscaled pixels) of the band around the line
+        :param search: maximum vertical displacement (in downscaled pixels) of a strip between two frames
+        :param min_score: minimum normalized correlation of a well-matched strip
+        :param min_std: minimum intensity standard deviation of a strip (flat strips can't be matched)
+        :param fit_max_error: maximum distance (in downscaled pixels) of a matched strip to the fitted line
+        """
+        self.max_width = max_width
+        self.strips_nbr = strips_nbr
+        self.band = band
+        self.search = search
+        self.min_score = min_score
+        self.min_std = min_std
+        self.fit_max_error = fit_max_error
+        self.scale = 1  # downscaled size / original size
+        self.org_w = None
+        self.prev_gray = None
+        self.slope = None  # slope of the tracked line on downscaled frames
+        self.intercept = None  # intercept of the tracked line on downscaled frames
+
+    def _prepare(self, frame):
+        gray = frame if frame.ndim == 2 else cv.cvtColor(frame, cv.COLOR_BGR2GRAY)
+        if self.scale != 1:
+            gray = cv.resize(gray, None, fx=self.scale, fy=self.scale, interpolation=cv.INTER_AREA)
+        return gray
+
+    def start(self, frame, xs, ys, xe, ye):
+        """
+        Starts tracking the line passing through (xs, ys) and (xe, ye) (original pixels) on the frame 'frame'.
+        """
+        self.org_w = frame.shape[1]
+        self.scale = min(1, self.max_width / self.org_w)
+        self.prev_gray = self._prepare(frame)
+        self.slope = (ye - ys) / (xe - xs)
+        self.intercept = (ys - self.slope * xs) * self.scale
+
+    def track(self, frame):
+        """
+        Tracks the line to the frame 'frame', which must follow the previously tracked frame.
+        :return: a tuple (gt_row, confidence), where gt_row is a float32 array (Y, alpha, xs, ys, xe, ye) in original
+        pixels and confidence is in [0, 1]. If the line is lost, gt_row is all np.nan and confidence is 0.
+        """
+        gray = self._prepare(frame)
+        h, w = gray.shape
+        half_w = max(w // (2 * self.strips_nbr), 2)
+        b, r = self.band, self.search
+        xs = np.linspace(half_w, w - half_w - 1, self.strips_nbr).astype(np.int64)
+        ys = np.round(self.slope * xs + self.intercept).astype(np.int64)
+        matched_x, matched_y = [], []
+        for x, y in zip(xs, ys):
+            if y - b - r < 0 or y + b + r + 1 > h:
+                continue
+            template = self.prev_gray[y - b:y + b + 1, x - half_w:x + half_w + 1]
+            if template.std() < self.min_std:
+                continue
+            scores = cv.matchTemplate(gray[y - b - r:y + b + r + 1, x - half_w:x + half_w + 1], template,
+                                      cv.TM_CCOEFF_NORMED).ravel()
+            best = int(np.argmax(scores))
+            if scores[best] < self.min_score:
+                continue
+            dy = float(best)
+            if 0 < best < len(scores) - 1:  # sub-pixel peak (parabola through the best score and its neighbours)
+                denominator = scores[best - 1] - 2 * scores[best] + scores[best + 1]
+                if denominator != 0:
+                    dy += 0.5 * (scores[best - 1] - scores[best + 1]) / denominator
+            matched_x.append(x)
+            matched_y.append(self.slope * x + self.intercept + dy - r)
+        self.prev_gray = gray
+        if len(matched_x) < 4:
+            return np.full(6, np.nan, dtype=np.float32), 0.0
+        matched_x, matched_y = np.array(matched_x, dtype=np.float64), np.array(matched_y)
+        slope, intercept = np.polyfit(matched_x, matched_y, 1)
+        inliers = np.abs(matched_y - (slope * matched_x + intercept)) < self.fit_max_error
+        if np.count_nonzero(inliers) >= 4:
+            slope, intercept = np.polyfit(matched_x[inliers], matched_y[inliers], 1)
+        self.slope, self.intercept = slope, intercept
+        confidence = np.count_nonzero(inliers) / self.strips_nbr
+        return gt_from_slope_intercept(slope, intercept / self.scale, self.org_w)[0], float(confidence)
+
+
+def track_video(video_file_path, start_index, start_xy_ends, stop_index, seek_index=None, min_confidence=0.5,
+                progress_callback=None, should_stop=None):
+    """
+    Tracks the horizon annotated on the frame start_index through the following frames, up to stop_index (excluded) or
+    until the confidence drops below min_confidence. Frames are decoded sequentially: the reader seeks once, to the
+    start frame (exactly, through the keyframe preceding it if seek_index is given).
+    :param video_file_path: path of the video file (or of another frame source, see FrameSources)
+    :param start_index: index of the annotated frame to start from
+    :param start_xy_ends: end points (xs, ys, xe, ye) of the annotated horizon on the start frame
+    :param stop_index: index of the frame where tracking stops (e.g., the next validated frame)
+    :param seek_index: a SeekIndex object of the video
+    :param min_confidence: tracking stops at the first frame whose confidence is lower
+    :param progress_callback: a function called as progress_callback(index, gt_row, confidence) for each tracked frame
+    :param should_stop: a function returning True if tracking must be canceled
+    :return: the index of the frame where tracking stopped (a low-confidence frame, which is not annotated, or
+    stop_index)
+    """
+    keyframe = None if seek_index is None else seek_index.keyframe_before(start_index)
+    frames = read_frames(video_file_path, start_index, stop_index, keyframe=keyframe)
+    frame = next(frames, None)
+    tracker = HorizonTracker()
+    if frame is not None:
+        tracker.start(frame, *start_xy_ends)
+    index = start_index + 1
+    while frame is not None and index < stop_index and not (should_stop is not None and should_stop()):
+        frame = next(frames, None)
+        if frame is None:
+            break
+        gt_row, confidence = tracker.track(frame)
+        if confidence < min_confidence:
+            break
+        if progress_callback is not None:
+            progress_callback(index, gt_row, confidence)
+        index += 1
+    frames.close()
+    return index
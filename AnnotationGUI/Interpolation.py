@@ -0,0 +1,101 @@
+import numpy as np
+from AnnotationGUI.Geometry import xy_ends_from_y_alpha
+
+# values of the per-frame annotation flags (see MainInterface.gt_flags)
+NOT_ANNOTATED = 0
+VALIDATED = 1  # annotated by hand (or loaded from a gt file)
+INTERPOLATED = 2  # filled automatically from validated frames
+TRACKED = 3  # followed from a validated frame by HorizonTracker
+PROPAGATED = 4  # copied from a validated frame to the other frames of its static segment (see SceneSegmentation)
+# flags of keyframes: interpolation and tracking start from them and never overwrite them
+KEYFRAME_FLAGS = (VALIDATED, PROPAGATED)
+
+
+def is_keyframe(flags):
+    """
+    :return: a boolean array, True where 'flags' is one of KEYFRAME_FLAGS
+    """
+    return np.isin(flags, KEYFRAME_FLAGS)
+
+
+def flags_for_gt(gt, flags=None):
+    """
+    :param gt: a gt array of shape (N, 6) (or (N, 2)), with np.nan values for frames that aren't annotated
+    :param flags: the flags saved along gt (e.g., read from its _LineGT_flags.npy file), or None
+    :return: 'flags' if it has one flag per frame of gt; otherwise (no flags, or stale flags of another gt file),
+    flags derived from gt: VALIDATED for annotated frames, NOT_ANNOTATED for the others
+    """
+    if flags is not None and np.shape(flags) == (len(gt),):
+        return np.asarray(flags, dtype=np.uint8)
+    return np.where(np.isnan(gt[:, 0]), NOT_ANNOTATED, VALIDATED).astype(np.uint8)
+
+
+def _pchip_slopes(x, y):
+    """
+    Slopes at the knots x of the monotone piecewise cubic Hermite interpolant (Fritsch-Carlson) of the data y.
+    :param x: increasing knots, shape (K,)
+    :param y: values at the knots, shape (K, C) (C columns interpolated independently)
+    """
+    h = np.diff(x)[:, None]
+    delta = np.diff(y, axis=0) / h
+    d = np.zeros_like(y)
+    if len(x) == 2:
+        d[:] = delta
+        return d
+    # interior knots: weighted harmonic mean of neighbouring secants, 0 at local extrema
+    w1 = 2 * h[1:] + h[:-1]
+    w2 = h[1:] + 2 * h[:-1]
+    same_sign = delta[:-1] * delta[1:] > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        harmonic = (w1 + w2) / (w1 / delta[:-1] + w2 / delta[1:])
+    d[1:-1] = np.where(same_sign, harmonic, 0)
+    # end knots: one-sided three-point estimates, limited to keep monotonicity
+    for end, (h0, h1, d0, d1) in ((0, (h[0], h[1], delta[0], delta[1])), (-1, (h[-1], h[-2], delta[-1], delta[-2]))):
+        de = ((2 * h0 + h1) * d0 - h0 * d1) / (h0 + h1)
+        de = np.where(np.sign(de) != np.sign(d0), 0, de)
+        de = np.where((np.sign(d0) != np.sign(d1)) & (np.abs(de) > 3 * np.abs(d0)), 3 * d0, de)
+        d[end] = de
+    return d
+
+
+def _interp(x, xp, fp, method):
+    """
+    Interpolates the columns of fp (values at the increasing knots xp) at x, with method 'linear' or 'spline'.
+    """
+    if method == 'linear' or len(xp) < 3:
+        return np.stack([np.interp(x, xp, fp[:, c]) for c in range(fp.shape[1])], axis=1)
+    if method != 'spline':
+        raise ValueError("Unknown interpolation method: must be 'linear' or 'spline'")
+    d = _pchip_slopes(xp.astype(np.float64), fp)
+    k = np.clip(np.searchsorted(xp, x, side='right') - 1, 0, len(xp) - 2)
+    h = (xp[k + 1] - xp[k]).astype(np.float64)[:, None]
+    t = (x - xp[k])[:, None] / h
+    h00 = (1 + 2 * t) * (1 - t) ** 2
+    h10 = t * (1 - t) ** 2
+    h01 = t ** 2 * (3 - 2 * t)
+    h11 = t ** 2 * (t - 1)
+    return h00 * fp[k] + h10 * h * d[k] + h01 * fp[k + 1] + h11 * h * d[k + 1]
+
+
+def interpolate_gaps(gt_Y_alpha, gt_flags, org_w, method='linear'):
+    """
+    Fills, in one vectorized pass, every frame lying between two keyframes (validated or propagated frames, see
+    KEYFRAME_FLAGS) that is non-annotated or previously interpolated (so that it follows newly validated keyframes).
+    Tracked frames are kept.
+    Y and alpha are interpolated over frame indexes, then end points are recomputed from them, so that the three
+    stay consistent. Frames before the first keyframe or after the last one are left untouched.
+    :param gt_Y_alpha: array of shape (N, 2) of Y and alpha (np.nan for non-annotated frames)
+    :param gt_flags: array of shape (N,) of flags (NOT_ANNOTATED, VALIDATED, INTERPOLATED, TRACKED or PROPAGATED)
+    :param org_w: width of the original frames
+    :param method: 'linear', or 'spline' (monotone cubic, which doesn't overshoot between keyframes)
+    :return: a tuple (indexes, Y_alpha, xy_ends) of the filled frames' indexes, their Y and alpha (shape (M, 2)) and
+    their end points (shape (M, 4)).
+    """
+    keyframes = np.flatnonzero(is_keyframe(gt_flags) & ~np.isnan(gt_Y_alpha[:, 0]))
+    if keyframes.size < 2:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, 2)), np.zeros((0, 4))
+    frames = np.arange(keyframes[0], keyframes[-1] + 1)
+    indexes = frames[(gt_flags[frames] == NOT_ANNOTATED) | (gt_flags[frames] == INTERPOLATED)]
+    Y_alpha = _interp(indexes.astype(np.float64), keyframes, gt_Y_alpha[keyframes].astype(np.float64), method)
+    xy_ends = xy_ends_from_y_alpha(Y_alpha[:, 0], Y_alpha[:, 1], org_w)
+    return indexes, Y_alpha, xy_ends
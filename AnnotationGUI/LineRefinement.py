@@ -0,0 +1,115 @@
+import numpy as np
+from AnnotationGUI.Geometry import gt_from_slope_intercept
+
+# weights of the B, G and R channels in the grayscale conversion (as in cv.COLOR_BGR2GRAY)
+BGR_TO_GRAY = np.array([0.114, 0.587, 0.299], dtype=np.float32)
+
+
+def refine_line(image, xs, ys, xe, ye, band=8, columns_nbr=512, min_inliers=0.25, max_residual=1.5):
+    """
+    Snaps a roughly drawn line to the strongest edge near it, with sub-pixel precision. Only the pixels of a band around
+    the line are read (vectorized gathering), so refinement takes a few milliseconds even on 4K frames:
+        * in columns_nbr columns spread along the line, the vertical intensity profile across the band is sampled and
+          smoothed, and its derivative is computed,
+        * in each column, the edge is the maximum of the absolute derivative, located with sub-pixel precision by
+          fitting a parabola through the maximum and its two neighbours,
+        * a line is fitted to the edges of the columns with a strong enough edge, weighted by edge strength, then
+          refitted without the columns farther than max_residual pixels from the first fit.
+    Lines steeper than 45° are not refined (the profiles are vertical).
+    :param image: the full-resolution frame (BGR or grayscale numpy array)
+    :param xs: x coordinate of the line's start point, in pixels of image
+    :param ys: y coordinate of the line's start point
+    :param xe: x coordinate of the line's end point
+    :param ye: y coordinate of the line's end point
+    :param band: half-height (in pixels) of the band searched around the line
+    :param columns_nbr: maximum number of sampled columns
+    :param min_inliers: minimum fraction of sampled columns supporting the refined line
+    :param max_residual: maximum distance (in pixels) of a supporting column's edge to the refined line
+    :return: a float32 gt row (Y, alpha, xs, ys, xe, ye) of the refined line (see Geometry), or None if no edge
+    supports a line within the band
+    """
+    h, w = image.shape[0:2]
+    if xe == xs or abs((ye - ys) / (xe - xs)) > 1:
+        return None
+    slope = (ye - ys) / (xe - xs)
+    intercept = ys - slope * xs
+
+    # sample band rows (with 2 extra rows on each side for smoothing and derivation) in each sampled column
+    x = np.unique(np.linspace(0, w - 1, min(columns_nbr, w)).astype(np.int64))
+    offsets = np.arange(-band - 2, band + 3)
+    y_center = np.round(slope * x + intercept).astype(np.int64)
+    inside = (y_center - band - 2 >= 0) & (y_center + band + 2 < h)
+    x, y_center = x[inside], y_center[inside]
+    if x.size < 4:
+        return None
+    rows = y_center[:, None] + offsets[None, :]
+    samples = image[rows, x[:, None]].astype(np.float32)
+    if samples.ndim == 3:
+        samples = samples @ BGR_TO_GRAY
+
+    smoothed = 0.25 * samples[:, :-2] + 0.5 * samples[:, 1:-1] + 0.25 * samples[:, 2:]  # [1, 2, 1] / 4 filter
+    gradient = np.abs(smoothed[:, 2:] - smoothed[:, :-2]) * 0.5  # centered on offsets -band..band
+    peak = np.argmax(gradient, axis=1)
+    peak = np.clip(peak, 1, gradient.shape[1] - 2)  # keep both neighbours inside the band
+    columns = np.arange(x.size)
+    g_prev, g_peak, g_next = gradient[columns, peak - 1], gradient[columns, peak], gradient[columns, peak + 1]
+    denominator = g_prev - 2 * g_peak + g_next
+    with np.errstate(divide='ignore', invalid='ignore'):
+        delta = np.where(denominator < 0, 0.5 * (g_prev - g_next) / denominator, 0)
+    edge_y = y_center + (peak - band) + np.clip(delta, -0.5, 0.5)
+
+    # keep columns with a strong edge: a fraction of the strongest edges' response
+    strong = g_peak >= max(0.25 * np.percentile(g_peak, 90), 1.0)
+    if np.count_nonzero(strong) < max(4, min_inliers * x.size):
+        return None
+    x, edge_y, weights = x[strong].astype(np.float64), edge_y[strong], g_peak[strong].astype(np.float64)
+    fit_slope, fit_intercept = np.polyfit(x, edge_y, 1, w=np.sqrt(weights))
+    inliers = np.abs(edge_y - (fit_slope * x + fit_intercept)) <= max_residual
+    if np.count_nonzero(inliers) < max(4, min_inliers * columns.size):
+        return None
+    fit_slope, fit_intercept = np.polyfit(x[inliers], edge_y[inliers], 1, w=np.sqrt(weights[inliers]))
+
+    # the refined line must stay within the band around the drawn line
+    ends_x = np.array([0, w - 1])
+    if np.any(np.abs((fit_slope - slope) * ends_x + fit_intercept - intercept) > band):
+        return None
+    return gt_from_slope_intercept(fit_slope, fit_intercept, w)[0]
+
+
+def refine_video(video_file_path, gt, indexes, band=8, seek_index=None, progress_callback=None):
+    """
+    Refines the annotations gt[indexes] of a video (see refine_line). Frames are decoded in increasing order, seeking
+    only across long gaps.
+    :param video_file_path: path of the video file
+    :param gt: an array of shape (frames_nbr, 6) of gt rows, in pixels of the video's frames
+    :param indexes: indexes of the frames to refine (e.g., validated frames)
+    :param band: half-height (in pixels) of the band searched around each line
+    :param seek_index: a SeekIndex object of the video (exact seeks through keyframes)
+    :param progress_callback: a function called as progress_callback(frames_done, frames_nbr) after each frame
+    :return: a tuple (refined_gt, refined_mask): a copy of gt with the refined rows, and a boolean mask of the frames
+    that were refined (frames where no edge supports the line keep their annotation)
+    """
+    import cv2 as cv
+    refined_gt = np.array(gt, dtype=np.float32)
+    refined_mask = np.zeros(len(gt), dtype=bool)
+    indexes = np.sort(np.asarray(indexes))
+    reader = cv.VideoCapture(video_file_path)
+    position = 0  # index of the frame returned by the next reader.read()
+    for done, index in enumerate(indexes, start=1):
+        if not 0 <= index - position <= 16:
+            keyframe = None if seek_index is None else seek_index.keyframe_before(index)
+            position = index if keyframe is None else keyframe
+            reader.set(cv.CAP_PROP_POS_FRAMES, position)
+        for _ in range(index - position):
+            reader.grab()
+        no_error_flag, frame = reader.read()
+        position = index + 1
+        if no_error_flag and not np.isnan(refined_gt[index, 0]):
+            row = refine_line(frame, *refined_gt[index, 2:], band=band)
+            if row is not None:
+                refined_gt[index] = row
+                refined_mask[index] = True
+        if progress_callback is not None:
+            progress_callback(done, indexes.size)
+    reader.release()
+    return refined_gt, refined_mask
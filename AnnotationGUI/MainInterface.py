@@ -2,18 +2,29 @@ import tkinter as tk
 from tkinter import ttk
 from tkinter import filedialog
 from tkinter import messagebox
-from PIL import ImageDraw
 import numpy as np
-import cv2 as cv
 import os
+import threading
 from AnnotationGUI.CustomWidgets import ImageDisplay
+from AnnotationGUI.FrameSources import VIDEO_EXTENSIONS, IMAGE_EXTENSIONS, NPY_EXTENSION
+from AnnotationGUI.VideoOpener import VideoOpener
+from AnnotationGUI.ProxyCache import VideoProxy
+from AnnotationGUI.NavigationScheduler import NavigationScheduler
+from AnnotationGUI import HorizonDetector
+from AnnotationGUI import SceneSegmentation
+from AnnotationGUI.ActiveScheduler import ActiveScheduler, cumulative_motion
+from AnnotationGUI import Interpolation
+from AnnotationGUI.HorizonTracker import track_video
+from AnnotationGUI.AutosaveJournal import AnnotationJournal
+from AnnotationGUI.Consensus import DisputedFrames, DISPUTED_SUFFIX
+from AnnotationGUI.Profiling import PROFILER, profiled
 
 class MainInterface(tk.Frame):
     def __init__(self, master):
         super().__init__(master)  # inherit attributes and methods of class widget
         # # # # # # # # # # # # # # # # # # # # #  Attributes of this class # # # # # # # # # # # # # # # # # # # # # # #
         # Non-classified attributes
-        self.video_file_path = os.getcwd()  # directory or directories of the data source chosen by the user. It can be: dirs of PNG images, or dir of PNG, AVI or MAT file.
+        self.video_file_path = os.getcwd()  # path of the frame source chosen by the user: a video file, a directory of images or an npy file of frames (see FrameSources)
         self.gt_file_path = os.getcwd()
         self.frame_index = 0  # the index of the image to display or the current displayed image in the list self.src_img_files (Browsing status is: (self.frame_index+1)/self.frames_nbr)
         self.frames_nbr = 0  # the order of the current browsed image (Browsing status is: self.frame_index/self.frames_nbr)
@@ -21,13 +32,42 @@ class MainInterface(tk.Frame):
         self.gt_Y_alpha = None  # a numpy array that'll hold the gt annotations (Y,alpha)
         self.gt_xy_ends = None  # xy coordinates corresponding to horizon lines in self.gt_Y_alpha
         self.gt_Y_alpha_xy_ends = None
+        self.gt_flags = None  # per-frame flags: Interpolation.NOT_ANNOTATED, VALIDATED, INTERPOLATED, TRACKED or PROPAGATED
+        self.tracking_results = None  # a list of (index, gt_row) produced by the tracking thread, not yet logged
+        self.tracking_range = None  # a tuple (start index, stop index) of the running tracking
+        self.tracking_stop_index = None  # index of the frame where the last tracking stopped
+        self.tracking_canceled = False
+        self.tracking_error = None  # the exception that stopped the last tracking, if any
+        self.tracking_id = 0  # identifies the running tracking: results of an older one (previous video) are dropped
+        self.tracking_lock = threading.Lock()
+        self.journal = None  # an AnnotationJournal autosaving annotations of the loaded video
+        self.autosave_error = None  # the error that disabled autosave of the loaded video (e.g., read-only directory)
+        self.journal_compaction_period = 5 * 60 * 1000  # period (in milliseconds) of the journal compaction
+        self.profiling_hud_shown = False  # if True, timing statistics (see Profiling) are shown over the image
+        self.profiling_was_enabled = PROFILER.enabled  # profiling state to restore when the HUD is hidden
         self.gt_dir = os.getcwd()
         self.Y_hl = np.nan
         self.alpha_hl = np.nan
 
         self.frame_as_np = None  # frame read as numpy type
         self.frame_as_pil = None  # frame reas as PIL type
-        self.video_reader = None  # a VideoCapture Object
+        self.video_reader = None  # a frame source (see FrameSources) serving decoded frames of the loaded video
+        self.seek_index = None  # a SeekIndex object (keyframes and true frame count) of the loaded video
+        self.opener = None  # a VideoOpener opening a video in the background (None when no video is being opened)
+        self.opening_first_frame_shown = False  # True once the first frame of the video being opened is shown
+        self.cache_size_mb = 512  # memory budget (in megabytes) of the decoded-frame cache of self.video_reader
+        self.proxy = None  # a VideoProxy object (display-resolution copy of the loaded video) used in proxy mode
+        self.frame_org_size = None  # (width, height) of the original frame if self.frame_as_np is a proxy frame, None otherwise
+        self.proposals = None  # an array of shape (self.frames_nbr, 6) of horizons proposed by HorizonDetector
+        self.proposals_progress = None  # a tuple (frames done, frames_nbr) while proposals are being computed
+        self.proposals_error = None  # the exception that stopped the last computation of proposals, if any
+        self.segments = None  # a StaticSegments object (see SceneSegmentation) of the loaded video
+        self.segments_progress = None  # a tuple (frames done, frames_nbr) while frame signatures are being computed
+        self.segments_error = None  # the exception that stopped the last computation of signatures, if any
+        self.signature_profiles = None  # row profiles of the frames of the loaded video (see SceneSegmentation)
+        self.disputed = None  # the DisputedFrames (see Consensus) of the loaded video, to review
+        self.active_scheduler = None  # an ActiveScheduler proposing the next most useful frame to annotate
+        self.target_error = 2.0  # expected interpolation error (in pixels) under which no frame is proposed anymore
         self.in_rects_inds = []  # contains indexes of in-frame edges' x,y coordinates of the i^th user-drawn rectangle (ROI)
         self.in_rects_inds_list = []  # a list of one or more lists. The i^th list contains indexes of in-frame edges' xy coordinates of the i^th user-drawn rectangle (ROI)
 
@@ -45,6 +85,7 @@ class MainInterface(tk.Frame):
         self.max_img_width = master.winfo_screenwidth() - 200  # master of ImageDisplay self: refers to an instance of MainInterface class
         self.max_img_height = master.winfo_screenheight() - 120
         self.img_display = ImageDisplay(master=self.frame1, wmax=self.max_img_width, hmax=self.max_img_height)
+        self.img_display.full_res_source = self.read_full_res_frame  # snapping refines proxy frames at full resolution
 
         self.frame2 = tk.Frame(master)  # a frame for remaining widgets (LabelFrames, buttons, etc)
         # Data Directories frame widgets (source and destination dirs)
@@ -52,6 +93,12 @@ class MainInterface(tk.Frame):
         self.src_dir_button = ttk.Button(self.data_dirs_frame, text="Load video file", width=20)
         self.save_gt_button = ttk.Button(self.data_dirs_frame, text="Save annotated file", width=20)
         self.load_existing_gt_button = ttk.Button(self.data_dirs_frame, text="Load existing gt file", width=20)
+        self.autosave_label = tk.Label(self.data_dirs_frame, justify='left', text="Autosave: no video")
+        self.opening_progressbar = ttk.Progressbar(self.data_dirs_frame, orient='horizontal', mode='determinate',
+                                                   length=140)
+        self.opening_status_label = tk.Label(self.data_dirs_frame, justify='left', text="")
+        self.cancel_opening_button = ttk.Button(self.data_dirs_frame, text="Cancel opening", state="disabled",
+                                                width=20)
 
         # Browse frame widgets
         self.browsing_frame = tk.LabelFrame(self.frame2, text="Browse")
@@ -61,6 +108,12 @@ class MainInterface(tk.Frame):
         self.next_button = ttk.Button(self.browsing_frame, text=">>", state="disabled", width=9)
         self.browsing_offset_label = tk.Label(self.browsing_frame, text='Enter a browsing offset:')
         self.browsing_offset_entry = ttk.Entry(self.browsing_frame)
+        self.most_useful_button = ttk.Button(self.browsing_frame, text="Most useful frame (n)", state="disabled",
+                                             width=20)
+        self.target_error_label = tk.Label(self.browsing_frame, text='Target error (pixels):')
+        self.target_error_entry = ttk.Entry(self.browsing_frame)
+        self.target_error_entry.insert(index=0, string=str(self.target_error))
+        self.active_status_label = tk.Label(self.browsing_frame, justify='left', text="")
 
         # Annotation frame widgets
         # Collect patches frame widgets
@@ -73,9 +126,64 @@ class MainInterface(tk.Frame):
         self.shown_hl_thickness_entry.insert(index=0, string="2")
         self.hide_annotation_button = ttk.Button(self.annotation_frame, text="Hide (h)", state="disabled", width=20)
         text = "Current annotation:\n---------------------\nY = {} pixs\nAlpha = {} °".format("???", "???")
+        self.interpolate_button = ttk.Button(self.annotation_frame, text="Interpolate gaps (i)", state="disabled",
+                                             width=20)
+        self.interpolation_method = ttk.Combobox(self.annotation_frame, values=("linear", "spline"), state="readonly",
+                                                 width=17)
+        self.interpolation_method.set("linear")
         self.current_annotation_label = tk.Label(self.annotation_frame, justify='left')
         self.current_annotation_label.config(text=text)
 
+        # Frame cache frame widgets
+        self.frame_cache_frame = tk.LabelFrame(self.frame2, text="Frame cache")
+        self.cache_size_label = tk.Label(self.frame_cache_frame, text='Cache size (MB):')
+        self.cache_size_entry = ttk.Entry(self.frame_cache_frame)
+        self.cache_size_entry.insert(index=0, string=str(self.cache_size_mb))
+        self.cache_stats_label = tk.Label(self.frame_cache_frame, justify='left')
+        self.update_cache_stats()
+        self.proxy_mode = tk.BooleanVar(value=False)
+        self.proxy_mode_checkbutton = ttk.Checkbutton(self.frame_cache_frame, text="Proxy mode",
+                                                      variable=self.proxy_mode, command=self.toggle_proxy_mode)
+        self.proxy_status_label = tk.Label(self.frame_cache_frame, justify='left', text="Proxy: off")
+
+        # Proposals frame widgets
+        self.proposals_frame = tk.LabelFrame(self.frame2, text="Horizon proposals")
+        self.compute_proposals_button = ttk.Button(self.proposals_frame, text="Compute proposals", state="disabled",
+                                                   width=20)
+        self.show_proposal_button = ttk.Button(self.proposals_frame, text="Propose (p)", state="disabled", width=20)
+        self.auto_propose = tk.BooleanVar(value=True)
+        self.auto_propose_checkbutton = ttk.Checkbutton(self.proposals_frame, text="Auto-propose",
+                                                        variable=self.auto_propose)
+        self.proposals_status_label = tk.Label(self.proposals_frame, justify='left', text="Proposals: none")
+
+        # Tracking frame widgets
+        self.tracking_frame = tk.LabelFrame(self.frame2, text="Tracking")
+        self.track_button = ttk.Button(self.tracking_frame, text="Track forward (t)", state="disabled", width=20)
+        self.cancel_tracking_button = ttk.Button(self.tracking_frame, text="Cancel tracking", state="disabled",
+                                                 width=20)
+        self.tracking_progressbar = ttk.Progressbar(self.tracking_frame, orient='horizontal', mode='determinate',
+                                                    length=140)
+        self.tracking_status_label = tk.Label(self.tracking_frame, justify='left', text="")
+
+        # Static segments frame widgets
+        self.segments_frame = tk.LabelFrame(self.frame2, text="Static segments")
+        self.compute_segments_button = ttk.Button(self.segments_frame, text="Detect segments", state="disabled",
+                                                  width=20)
+        self.previous_segment_button = ttk.Button(self.segments_frame, text="|<< (PgUp)", state="disabled", width=9)
+        self.next_segment_button = ttk.Button(self.segments_frame, text="(PgDn) >>|", state="disabled", width=9)
+        self.validate_segment = tk.BooleanVar(value=False)
+        self.validate_segment_checkbutton = ttk.Checkbutton(self.segments_frame, text="Validate whole segment",
+                                                            variable=self.validate_segment)
+        self.segments_status_label = tk.Label(self.segments_frame, justify='left', text="Segments: none")
+
+        # Consensus review frame widgets
+        self.consensus_frame = tk.LabelFrame(self.frame2, text="Consensus review")
+        self.load_disputed_button = ttk.Button(self.consensus_frame, text="Load disputed frames", state="disabled",
+                                               width=20)
+        self.previous_disputed_button = ttk.Button(self.consensus_frame, text="|<< ([)", state="disabled", width=9)
+        self.next_disputed_button = ttk.Button(self.consensus_frame, text="(]) >>|", state="disabled", width=9)
+        self.disputed_status_label = tk.Label(self.consensus_frame, justify='left', text="Disputed frames: none")
+
         # # # # # # # # # Geometry Management # # # # # # # #
         # NOTE on Sturcture of Geometry Management code section:
         # Geometry is managed from top-level to lower-level widgets (Not imperative, just for code readability)
@@ -90,11 +198,20 @@ class MainInterface(tk.Frame):
         self.data_dirs_frame.grid(row=0, column=0, sticky='NW')
         self.browsing_frame.grid(row=1, column=0, sticky='NW', pady=pady)
         self.annotation_frame.grid(row=2, column=0, sticky='NW', pady=pady)
+        self.frame_cache_frame.grid(row=3, column=0, sticky='NW', pady=pady)
+        self.proposals_frame.grid(row=4, column=0, sticky='NW', pady=pady)
+        self.tracking_frame.grid(row=5, column=0, sticky='NW', pady=pady)
+        self.segments_frame.grid(row=6, column=0, sticky='NW', pady=pady)
+        self.consensus_frame.grid(row=7, column=0, sticky='NW', pady=pady)
 
         # geometry of self.images_dirs_frame (attached to self.frame2)
         self.src_dir_button.grid(row=0, column=0)
         self.save_gt_button.grid(row=1, column=0)
         self.load_existing_gt_button.grid(row=2, column=0)
+        self.autosave_label.grid(row=3, column=0, sticky="NW")
+        self.opening_progressbar.grid(row=4, column=0, sticky="NW")
+        self.opening_status_label.grid(row=5, column=0, sticky="NW")
+        self.cancel_opening_button.grid(row=6, column=0, sticky="NW")
 
         # geometry of self.browsing_frame (attached to self.frame2)
         self.back_button.grid(row=0, column=0)
@@ -102,6 +219,10 @@ class MainInterface(tk.Frame):
         self.browsing_status.grid(row=1, column=0, columnspan=2)
         self.browsing_offset_label.grid(row=2, column=0, columnspan=2)
         self.browsing_offset_entry.grid(row=3, column=0, columnspan=2)
+        self.most_useful_button.grid(row=4, column=0, columnspan=2)
+        self.target_error_label.grid(row=5, column=0, columnspan=2)
+        self.target_error_entry.grid(row=6, column=0, columnspan=2)
+        self.active_status_label.grid(row=7, column=0, columnspan=2)
 
         # geometry of self.annotation_frame (attached to self.frame2)
         self.validate_annotation_button.grid(row=0, column=0, sticky="NW")
@@ -110,7 +231,41 @@ class MainInterface(tk.Frame):
         self.hide_annotation_button.grid(row=3, column=0, sticky="NW")
         self.shown_hl_thickness_label.grid(row=4, column=0, sticky="NW")
         self.shown_hl_thickness_entry.grid(row=5, column=0, sticky="NW")
-        self.current_annotation_label.grid(row=6, column=0, sticky="NW")
+        self.interpolate_button.grid(row=6, column=0, sticky="NW")
+        self.interpolation_method.grid(row=7, column=0, sticky="NW")
+        self.current_annotation_label.grid(row=8, column=0, sticky="NW")
+
+        # geometry of self.frame_cache_frame (attached to self.frame2)
+        self.cache_size_label.grid(row=0, column=0, sticky="NW")
+        self.cache_size_entry.grid(row=1, column=0, sticky="NW")
+        self.cache_stats_label.grid(row=2, column=0, sticky="NW")
+        self.proxy_mode_checkbutton.grid(row=3, column=0, sticky="NW")
+        self.proxy_status_label.grid(row=4, column=0, sticky="NW")
+
+        # geometry of self.proposals_frame (attached to self.frame2)
+        self.compute_proposals_button.grid(row=0, column=0, sticky="NW")
+        self.show_proposal_button.grid(row=1, column=0, sticky="NW")
+        self.auto_propose_checkbutton.grid(row=2, column=0, sticky="NW")
+        self.proposals_status_label.grid(row=3, column=0, sticky="NW")
+
+        # geometry of self.tracking_frame (attached to self.frame2)
+        self.track_button.grid(row=0, column=0, sticky="NW")
+        self.cancel_tracking_button.grid(row=1, column=0, sticky="NW")
+        self.tracking_progressbar.grid(row=2, column=0, sticky="NW")
+        self.tracking_status_label.grid(row=3, column=0, sticky="NW")
+
+        # geometry of self.segments_frame (attached to self.frame2)
+        self.compute_segments_button.grid(row=0, column=0, columnspan=2, sticky="NW")
+        self.previous_segment_button.grid(row=1, column=0)
+        self.next_segment_button.grid(row=1, column=1)
+        self.validate_segment_checkbutton.grid(row=2, column=0, columnspan=2, sticky="NW")
+        self.segments_status_label.grid(row=3, column=0, columnspan=2, sticky="NW")
+
+        # geometry of self.consensus_frame (attached to self.frame2)
+        self.load_disputed_button.grid(row=0, column=0, columnspan=2, sticky="NW")
+        self.previous_disputed_button.grid(row=1, column=0)
+        self.next_disputed_button.grid(row=1, column=1)
+        self.disputed_status_label.grid(row=2, column=0, columnspan=2, sticky="NW")
         # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
         # # # # # # Binding custom events of ImageDisplay # # # # # # # # #
@@ -128,6 +283,7 @@ class MainInterface(tk.Frame):
         self.src_dir_button.bind("<Button-1>", self.load_src_imgs)
         self.save_gt_button.bind("<Button-1>", self.set_gt_file)
         self.load_existing_gt_button.bind("<Button-1>", self.load_gt_file)
+        self.cancel_opening_button.bind("<Button-1>", self.cancel_opening)
 
         # self.browsing_frame bound events
         self.next_button.bind("<Button-1>", self.browse_next)
@@ -138,13 +294,35 @@ class MainInterface(tk.Frame):
         self.master.bind("<Left>", self.browse_back, add='+')
 
         self.browsing_offset_entry.bind("<Return>", self.set_offset)
+        self.most_useful_button.bind("<Button-1>", self.go_to_most_useful_frame)
+        self.target_error_entry.bind("<Return>", self.set_target_error)
         self.shown_hl_thickness_entry.bind("<Return>", self.set_hl_thickness)
+        self.cache_size_entry.bind("<Return>", self.set_cache_size)
 
         # self.annotation_frame bound events
         self.validate_annotation_button.bind("<Button-1>", self.validate_annotation)
         self.show_annotation_button.bind("<Button-1>", self.show_annotation)
         self.hide_annotation_button.bind("<Button-1>", self.hide_annotation)
         self.delete_annotation_button.bind("<Button-1>", self.delete_annotation)
+        self.interpolate_button.bind("<Button-1>", self.interpolate_annotations)
+
+        # self.proposals_frame bound events
+        self.compute_proposals_button.bind("<Button-1>", self.compute_proposals)
+        self.show_proposal_button.bind("<Button-1>", self.show_proposal)
+
+        # self.tracking_frame bound events
+        self.track_button.bind("<Button-1>", self.track_annotation)
+        self.cancel_tracking_button.bind("<Button-1>", self.cancel_tracking)
+
+        # self.segments_frame bound events
+        self.compute_segments_button.bind("<Button-1>", self.compute_segments)
+        self.previous_segment_button.bind("<Button-1>", self.go_to_previous_segment)
+        self.next_segment_button.bind("<Button-1>", self.go_to_next_segment)
+
+        # self.consensus_frame bound events
+        self.load_disputed_button.bind("<Button-1>", self.load_disputed_file)
+        self.previous_disputed_button.bind("<Button-1>", self.go_to_previous_disputed)
+        self.next_disputed_button.bind("<Button-1>", self.go_to_next_disputed)
         
         # self.master events
         self.master.bind("<KeyPress-v>", self.validate_annotation)
@@ -153,41 +331,47 @@ class MainInterface(tk.Frame):
         self.master.bind("<KeyPress-h>", self.hide_annotation)
         self.master.bind("<KeyPress-d>", self.delete_annotation)
         self.master.bind("<KeyPress-w>", self.annotate_previous_with_current)
+        self.master.bind("<KeyPress-p>", self.show_proposal)
+        self.master.bind("<KeyPress-i>", self.interpolate_annotations)
+        self.master.bind("<KeyPress-t>", self.track_annotation)
+        self.master.bind("<KeyPress-n>", self.go_to_most_useful_frame)
+        self.master.bind("<Prior>", self.go_to_previous_segment)
+        self.master.bind("<Next>", self.go_to_next_segment)
+        self.master.bind("<bracketleft>", self.go_to_previous_disputed)
+        self.master.bind("<bracketright>", self.go_to_next_disputed)
+        self.master.bind("<F2>", self.toggle_profiling_hud)
+        self.master.bind("<F3>", self.export_profile)
 
 
         # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
         # # # # # # # # other things # # # # # # # # # # # # # # # #
+        # browsing requests are decoded off the Tkinter thread; only the latest requested frame is shown
+        self.navigation_scheduler = NavigationScheduler(widget=self, fetch_frame=self.fetch_frame,
+                                                        on_frame_ready=self.show_browsed_frame,
+                                                        failed_result=(False, None, None))
+        self.after(self.journal_compaction_period, self.compact_journal)
 
         # # # # # # # # # # # # # # # # # # # #
 
     # # # # # # # # # # # Callbacks of ImageDisplay custom events # # # # # # # # # # # # # # #
+    @profiled()
     def new_line(self):
         self.shapes_shown_flag = True
         self.show_drawings()
 
+    @profiled()
     def new_rect(self):
         self.shapes_shown_flag = True
         self.show_drawings()
 
+    @profiled()
     def new_org_im(self):
         """
         This callback is triggered when when a new image is set as the original image (see self.img_display.im_as_pil_org).
-        In this case, two actions are done:
-            action1: the current edge map image self.edge_map and edge coordinates self.edges_xy  do not correspond to the
-            new image. Thus, we set their attributes to None. This enable the program to recompute these attributes for the
-            new image.
-
-            action2: set the flag self.shown_version_flag to 'org', because the image currently shown is the original image
-            (scaled if necessary to suit max dimensions specified by self.max_img_width and self.max_img_height)
+        In this case, the flag self.shown_version_flag is set to 'org', because the image currently shown is the original
+        image (scaled if necessary to suit max dimensions specified by self.max_img_width and self.max_img_height)
         """
-        # delete all image versions of the original image (e.g., edge map version, etc)
-        self.edge_map = None
-        self.edge_map_with_in_frame_edges = None
-        self.edges_xy = None
-        self.in_frame_edges_xy = None
-        self.org_with_in_frame_edges = None
-
         # set flags
         self.shown_version_flag = 'org'
         self.drawings_shown_flag = 'False'
@@ -198,11 +382,16 @@ class MainInterface(tk.Frame):
     # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
     # # # # # # # # # # # Callbacks of MainInterface events # # # # # # # # # # # # # # #
+    @profiled()
     def validate_annotation(self, event):
         """
         executes if the user validates the drawn horizon line as a gt annotation; two actions are taken: log parameters
         of annotated horizon into corresponding array and show the horizon with a thicker line.
         """
+        if self.gt_Y_alpha is None or self.navigation_scheduler.pending:  # no video, or the displayed frame isn't the
+            return  # frame self.frame_index yet
+        if np.isnan(self.img_display.Y_hl):  # no line drawn, or a degenerate (vertical) one
+            return
         self.Y_hl = self.img_display.Y_hl
         self.alpha_hl = self.img_display.alpha_hl
         self.hl_xs = self.img_display.hl_x_s_org
@@ -212,24 +401,63 @@ class MainInterface(tk.Frame):
 
         self.gt_Y_alpha[self.frame_index] = [self.Y_hl, self.alpha_hl]
         self.gt_xy_ends[self.frame_index] = [self.hl_xs, self.hl_ys, self.hl_xe, self.hl_ye]
+        self.gt_flags[self.frame_index] = Interpolation.VALIDATED
+        self.log_changes(self.frame_index)
+        if self.validate_segment.get() and self.segments is not None:
+            self.validate_current_segment()
+            self.reset_active_scheduler()
+        else:
+            self.active_scheduler.add_keyframe(self.frame_index, self.hl_ys, self.hl_ye)
+        self.update_active_status()
 
         self.show_current_annotation()
 
+    def validate_current_segment(self):
+        """
+        Applies the annotation of the current frame to all frames of its static segment (see SceneSegmentation),
+        except frames validated separately. These frames are flagged as propagated, which keeps them apart from frames
+        validated by hand (they're keyframes all the same, see Interpolation.KEYFRAME_FLAGS).
+        """
+        start, stop = self.segments.segment_of(self.frame_index)
+        indexes = np.arange(start, stop)
+        indexes = indexes[self.gt_flags[indexes] != Interpolation.VALIDATED]
+        if indexes.size == 0:
+            return
+        self.gt_Y_alpha[indexes] = self.gt_Y_alpha[self.frame_index]
+        self.gt_xy_ends[indexes] = self.gt_xy_ends[self.frame_index]
+        self.gt_flags[indexes] = Interpolation.PROPAGATED
+        self.log_changes(indexes)
+        self.segments_status_label.config(text="Segments: {} (validated frames {} to {})".format(
+            len(self.segments), start + 1, stop))
+
+    @profiled()
     def show_annotation(self, event):
-        self.show_current_annotation()
+        if self.gt_Y_alpha is not None:
+            self.show_current_annotation()
 
+    @profiled()
     def hide_annotation(self, event):
-        self.img_display.show_img(src=np.copy(self.frame_as_np), src_type='numpy', set_as_org=False)
+        self.img_display.restore_org()
 
+    @profiled()
     def delete_annotation(self, event):
-        self.gt_xy_ends[self.frame_index] = np.array([0, 0, 0, 0], dtype=np.int32)
+        if self.gt_Y_alpha is None or self.navigation_scheduler.pending:
+            return
+        self.gt_xy_ends[self.frame_index] = np.array([0, 0, 0, 0], dtype=np.float32)
         self.gt_Y_alpha[self.frame_index] = np.array([np.nan, np.nan], dtype=np.float32)
+        self.gt_flags[self.frame_index] = Interpolation.NOT_ANNOTATED
+        self.log_changes(self.frame_index)
+        self.active_scheduler.remove_keyframe(self.frame_index)
+        self.update_active_status()
         self.show_current_annotation()
 
+    @profiled()
     def annotate_previous_with_current(self, event):
         """
         Annotate all previous non-annotated frames with annotation on current frame.
         """
+        if self.gt_Y_alpha is None:
+            return
         if self.Y_hl is not np.nan:
             self.all_non_annotated_frames_indexes = np.argwhere(np.isnan(self.gt_Y_alpha[:, 0]))
             self.previous_non_annotated_frames_indexes \
@@ -241,50 +469,222 @@ class MainInterface(tk.Frame):
             self.gt_xy_ends[self.previous_non_annotated_frames_indexes, 1] = self.hl_ys
             self.gt_xy_ends[self.previous_non_annotated_frames_indexes, 2] = self.hl_xe
             self.gt_xy_ends[self.previous_non_annotated_frames_indexes, 3] = self.hl_ye
+            self.gt_flags[self.previous_non_annotated_frames_indexes] = Interpolation.INTERPOLATED
+            self.log_changes(self.previous_non_annotated_frames_indexes)
         else:
             print("validate annotation first")
+
+    @profiled()
+    def interpolate_annotations(self, event):
+        """
+        Fills all frames between validated frames by interpolating Y and alpha of the surrounding validated frames (see
+        Interpolation.interpolate_gaps). Filled frames are flagged as interpolated, not validated.
+        """
+        if self.gt_Y_alpha is None or self.navigation_scheduler.pending:
+            return
+        indexes, Y_alpha, xy_ends = Interpolation.interpolate_gaps(self.gt_Y_alpha, self.gt_flags,
+                                                                   self.img_display.org_w,
+                                                                   method=self.interpolation_method.get())
+        self.gt_Y_alpha[indexes] = Y_alpha
+        self.gt_xy_ends[indexes] = xy_ends
+        self.gt_flags[indexes] = Interpolation.INTERPOLATED
+        self.log_changes(indexes)
+        self.show_current_annotation()
     # # # # #
 
+    @profiled()
     def load_src_imgs(self, event):
         """
         * loads and display the selected video file.
         * creates the array self.gt_Y_alpha with shape = (self.frames_nbr, 2), where self.frames_nbr is the number
         of frames in the selected video file.
         """
-        title = "Choose a directory"
-        filetypes = (("AVI files", "*.avi"), ("MP4 files", "*.mp4"))
-        # data_src_files_dir = tk.filedialog.askopenfilename(initialdir=os.path.dirname(self.video_file_path),
-        #                                                    title=title,
-        #                                                    filetypes=filetypes)
-        idir = r"D:\My Data\All_Maritime_Datasets\CORRECTED SMD\Onshore\Videos"
-        data_src_files_dir = tk.filedialog.askopenfilename(initialdir=idir,
+        title = "Choose a video, an npy file of frames, or an image of an image sequence"
+        video_patterns = " ".join("*" + e for e in VIDEO_EXTENSIONS)
+        image_patterns = " ".join("*" + e for e in IMAGE_EXTENSIONS)
+        filetypes = (("All frame sources", " ".join((video_patterns, "*" + NPY_EXTENSION, image_patterns))),
+                     ("Video files", video_patterns), ("npy frame stacks", "*" + NPY_EXTENSION),
+                     ("Image sequences", image_patterns))
+        data_src_files_dir = tk.filedialog.askopenfilename(initialdir=self.initial_dir(self.video_file_path),
                                                            title=title,
                                                            filetypes=filetypes)
         if os.path.exists(data_src_files_dir):
-            self.video_file_path = os.path.normpath(data_src_files_dir)
-            self.video_reader = cv.VideoCapture(self.video_file_path)
-            self.no_error_flag, self.frame_as_np = self.video_reader.read()
-            if self.no_error_flag:
-                self.img_display.show_img(src=self.frame_as_np, src_type='numpy', set_as_org=True)
-                self.frames_nbr = int(self.video_reader.get(cv.CAP_PROP_FRAME_COUNT))
-                self.frame_index = 0
-                self.browsing_status.config(text=str(self.frame_index + 1) + "/" + str(self.frames_nbr))
-                if self.frames_nbr > 1:
-                    self.next_button.config(state="normal")
-                self.gt_Y_alpha = np.zeros(shape=(self.frames_nbr, 2), dtype=np.float32)
-                self.gt_Y_alpha[:] = np.nan  # all non-annotated frames correspond to nan values.
-                self.gt_xy_ends = np.zeros(shape=(self.frames_nbr, 4), dtype=np.int32)  # 4 for: xs, ys, xe, ye
-                self.validate_annotation_button.config(state='enable')
-                self.delete_annotation_button.config(state='enable')
-                self.show_annotation_button.config(state='enable')
-                self.hide_annotation_button.config(state='enable')
+            if data_src_files_dir.lower().endswith(IMAGE_EXTENSIONS):  # an image stands for the sequence of its directory
+                data_src_files_dir = os.path.dirname(data_src_files_dir)
+            self.open_video(data_src_files_dir)
+
+    @staticmethod
+    def initial_dir(path):
+        """
+        :return: the directory a file dialog starts in: path if it's a directory, otherwise the directory of path
+        """
+        return path if os.path.isdir(path) else os.path.dirname(path)
+
+    def open_video(self, video_file_path):
+        """
+        Starts opening the frame source video_file_path (a video file, a directory of images or an npy file of frames,
+        see FrameSources) in the background (see VideoOpener): its first frame is shown as soon as it's decoded, its
+        metadata as it comes (see self.update_opening_status), and annotating starts once the video is indexed and its
+        autosaved annotations (if any) are restored (see self.finish_opening).
+        """
+        if self.opener is not None:
+            self.opener.cancel()  # the previous opening is closed by its own polling (see self.update_opening_status)
+        self.video_file_path = os.path.normpath(video_file_path)
+        self.navigation_scheduler.cancel()
+        self.stop_tracking()  # its results belong to the previous video
+        if self.video_reader is not None:
+            self.video_reader.close()
+            self.video_reader = None
+            self.toggle_proxy_mode()  # stops the proxy of the previous video
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+        self.autosave_error = None
+        # annotating is disabled until the new video is opened (handlers check self.gt_Y_alpha)
+        self.gt_Y_alpha, self.gt_xy_ends, self.gt_flags, self.frame_as_np = None, None, None, None
+        self.proposals, self.segments, self.signature_profiles, self.active_scheduler = None, None, None, None
+        self.disputed, self.proposals_error, self.segments_error = None, None, None
+        self.load_disputed_button.config(state="disabled")
+        self.back_button.config(state="disabled")
+        self.next_button.config(state="disabled")
+        self.update_autosave_status()
+        self.update_proposals_status()
+        self.update_segments_status()
+        self.update_disputed_status()
+        gt_path = os.path.join(self.gt_dir, os.path.basename(self.video_file_path).split(".")[0] + "_LineGT.npy")
+        self.opener = VideoOpener(self.video_file_path, cache_size_mb=self.cache_size_mb, gt_path=gt_path).start()
+        self.opening_first_frame_shown = False
+        self.opening_progressbar.config(mode='indeterminate', value=0)
+        self.opening_progressbar.start(20)
+        self.cancel_opening_button.config(state='enable')
+        self.update_opening_status(self.opener)
+
+    def update_opening_status(self, opener):
+        """
+        Shows the progress of the VideoOpener 'opener': its first frame once decoded, its metadata and the progress of
+        indexing. Reschedules itself until the opening is done, canceled or replaced by another one.
+        """
+        if opener.done and (opener.canceled or opener is not self.opener):
+            opener.close()
+            if opener is self.opener:
+                self.opener = None
+                self.stop_opening_progress("Opening canceled")
+            return
+        if opener is not self.opener:  # replaced by another opening: polled until its threads are done, then closed
+            self.after(100, self.update_opening_status, opener)
+            return
+        if opener.source_done and opener.error is not None:
+            self.opener = None
+            self.stop_opening_progress("Can't open: {}".format(opener.error))
+            return
+        if opener.first_frame is not None and not self.opening_first_frame_shown:
+            self.opening_first_frame_shown = True
+            self.frame_index = 0
+            self.img_display.show_img(src=opener.first_frame, src_type='numpy', set_as_org=True)
+        details = [os.path.basename(opener.path)]
+        if opener.size is not None:
+            details.append("{}x{}".format(*opener.size) + (", {:.2f} fps".format(opener.fps) if opener.fps else ""))
+        if opener.frames_nbr is not None:
+            details.append("{} frames".format(opener.frames_nbr))
+        elif opener.estimated_frames_nbr is not None:
+            details.append("~{} frames".format(opener.estimated_frames_nbr))
+        if opener.frames_scanned and opener.frames_nbr is None:
+            details.append("indexing: {} frames".format(opener.frames_scanned))
+            if opener.estimated_frames_nbr and str(self.opening_progressbar.cget('mode')) != 'determinate':
+                self.opening_progressbar.stop()
+                self.opening_progressbar.config(mode='determinate', maximum=opener.estimated_frames_nbr)
+            self.opening_progressbar.config(value=opener.frames_scanned)
+        elif opener.source_done and not opener.annotations_done:
+            details.append("loading annotations")
+        self.opening_status_label.config(text="\n".join(details))
+        if opener.done:
+            self.opener = None
+            self.stop_opening_progress("\n".join(details))
+            self.finish_opening(opener)
+        else:
+            self.after(50, self.update_opening_status, opener)
+
+    def stop_opening_progress(self, text):
+        self.opening_progressbar.stop()
+        self.opening_progressbar.config(mode='determinate', value=0)
+        self.opening_status_label.config(text=text)
+        self.cancel_opening_button.config(state='disabled')
+
+    @profiled()
+    def cancel_opening(self, event):
+        if self.opener is not None:
+            self.opener.cancel()
+
+    def finish_opening(self, opener):
+        """
+        Starts annotating the video opened by the VideoOpener 'opener': takes its frame source, restores its autosaved
+        annotations (or its saved gt file), proposals and static segments.
+        """
+        self.video_reader, opener.frame_source = opener.frame_source, None
+        self.seek_index = opener.seek_index
+        self.video_reader.set_browsing_offset(self.browsing_offset)
+        self.frames_nbr = self.video_reader.frames_nbr
+        self.toggle_proxy_mode()
+        self.no_error_flag, self.frame_as_np, self.frame_org_size = opener.first_frame is not None, opener.first_frame, None
+        if self.no_error_flag:
+            self.frame_index = 0
+            self.browsing_status.config(text=str(self.frame_index + 1) + "/" + str(self.frames_nbr))
+            if self.frames_nbr > 1:
+                self.next_button.config(state="normal")
+            self.gt_Y_alpha = np.zeros(shape=(self.frames_nbr, 2), dtype=np.float32)
+            self.gt_Y_alpha[:] = np.nan  # all non-annotated frames correspond to nan values.
+            self.gt_xy_ends = np.zeros(shape=(self.frames_nbr, 4), dtype=np.float32)  # 4 for: xs, ys, xe, ye (sub-pixel)
+            self.gt_flags = np.zeros(shape=self.frames_nbr, dtype=np.uint8)
+            # restore autosaved annotations of this video (if any) and keep autosaving to its journal; without autosave,
+            # a gt file saved for this video in the gt directory becomes the autosave baseline
+            annotations = opener.annotations
+            self.journal = AnnotationJournal(self.video_file_path, self.frames_nbr)
+            try:
+                restored = self.journal.restore(self.gt_Y_alpha, self.gt_xy_ends, self.gt_flags,
+                                                files=annotations["autosave"])
+            except OSError as error:  # the journal can't be written (read-only or network directory)
+                self.disable_autosave(error)
+                # the autosave files were read before the journal failed to open
+                restored = bool(np.any(self.gt_flags != Interpolation.NOT_ANNOTATED))
+            if not restored and annotations["saved_gt"] is not None and len(annotations["saved_gt"][0]) == self.frames_nbr:
+                gt, flags = annotations["saved_gt"]
+                self.gt_Y_alpha[:], self.gt_xy_ends[:] = gt[:, 0:2], gt[:, 2:]
+                self.gt_flags[:] = Interpolation.flags_for_gt(gt, flags)
+                self.compact_journal_now()
+                restored = True
+            if restored:
+                self.show_current_annotation()
+            self.update_autosave_status()
+            self.interpolate_button.config(state='enable')
+            self.track_button.config(state='enable')
+            self.validate_annotation_button.config(state='enable')
+            self.delete_annotation_button.config(state='enable')
+            self.show_annotation_button.config(state='enable')
+            self.hide_annotation_button.config(state='enable')
+            self.compute_proposals_button.config(state='enable')
+            self.compute_segments_button.config(state='enable')
+            self.most_useful_button.config(state='enable')
+            self.show_proposal_button.config(state='enable')
+            self.proposals = annotations["proposals"]
+            if self.proposals is not None and len(self.proposals) != self.frames_nbr:
+                self.proposals = None
+            self.update_proposals_status()
+            self.segments, self.signature_profiles = None, None
+            if annotations["signatures"] is not None and len(annotations["signatures"][0]) == self.frames_nbr:
+                self.segments = annotations["segments"]
+                self.signature_profiles = annotations["signatures"][0]
+            self.update_segments_status()
+            self.disputed = annotations["disputed"]
+            if self.disputed is not None and self.disputed.frames_nbr != self.frames_nbr:
+                self.disputed = None
+            self.load_disputed_button.config(state='enable')
+            self.update_disputed_status()
+            self.reset_active_scheduler()
 
+    @profiled()
     def set_gt_file(self, event):
         title = "Choose the directory where to save the gt annotation file"
-        idir = r"D:\My Data\All_Maritime_Datasets\CORRECTED SMD\Onshore\HorizonGT"
-        gt_dir = tk.filedialog.askdirectory(initialdir=idir, title=title)
-        # gt_dir = tk.filedialog.askdirectory(initialdir=self.gt_dir, title=title)
-        # gt_dir = tk.filedialog.askopenfilename(initialdir=self.gt_dir, title=title)
+        gt_dir = tk.filedialog.askdirectory(initialdir=self.gt_dir, title=title)
         if os.path.exists(gt_dir):
             self.gt_dir = os.path.normpath(gt_dir)
             self.save_gt_file_helper()
@@ -304,6 +704,7 @@ class MainInterface(tk.Frame):
                 self.gt_Y_alpha_xy_ends[:, 0:2] = self.gt_Y_alpha
                 self.gt_Y_alpha_xy_ends[:, 2::] = self.gt_xy_ends
                 np.save(self.gt_abs_path, self.gt_Y_alpha_xy_ends)
+                np.save(self.gt_flags_path(self.gt_abs_path), self.gt_flags)
         else:
             message_text = "You did not annotate all the frames.\n" \
                            "Frames with no annotation will correspond to Y = np.nan and alpha = np.nan\n" \
@@ -316,24 +717,42 @@ class MainInterface(tk.Frame):
                 self.gt_Y_alpha_xy_ends[:, 0:2] = self.gt_Y_alpha
                 self.gt_Y_alpha_xy_ends[:, 2::] = self.gt_xy_ends
                 np.save(self.gt_abs_path, self.gt_Y_alpha_xy_ends)
+                np.save(self.gt_flags_path(self.gt_abs_path), self.gt_flags)
 
+    @profiled()
     def load_gt_file(self, event):
         title = "Choose an npy file to modify"
         filetypes = (("npy file", "*.npy"),)
-        idir = r"D:\My Data\All_Maritime_Datasets\CORRECTED SMD\Onshore\HorizonGT"
-        data_src_files_dir = tk.filedialog.askopenfilename(initialdir=idir,
+        data_src_files_dir = tk.filedialog.askopenfilename(initialdir=self.initial_dir(self.gt_file_path),
                                                            title=title,
                                                            filetypes=filetypes)
-        # data_src_files_dir = tk.filedialog.askopenfilename(initialdir=os.path.dirname(self.gt_file_path),
-        #                                                    title=title,
-        #                                                    filetypes=filetypes)
         if os.path.exists(data_src_files_dir):
             self.gt_file_path = os.path.normpath(data_src_files_dir)
             self.gt_Y_alpha_xy_ends = np.load(self.gt_file_path)
             self.gt_Y_alpha = self.gt_Y_alpha_xy_ends[:, 0:2]
             self.gt_xy_ends = self.gt_Y_alpha_xy_ends[:, 2::]
+            # interpolated frames are listed in a flags file saved along the gt file; without it (or with a flags file
+            # of another length), all annotated frames are considered validated
+            flags_path = self.gt_flags_path(self.gt_file_path)
+            self.gt_flags = Interpolation.flags_for_gt(self.gt_Y_alpha_xy_ends,
+                                                       np.load(flags_path) if os.path.exists(flags_path) else None)
+            # the loaded file becomes the autosave baseline of the loaded video
+            if self.journal is not None and len(self.gt_Y_alpha) == self.journal.frames_nbr:
+                self.compact_journal_now()
+            if len(self.gt_Y_alpha) == self.frames_nbr:
+                self.reset_active_scheduler()
 
+    @staticmethod
+    def gt_flags_path(gt_path):
+        """
+        :return: path of the file holding the per-frame flags of the gt file gt_path (<video name>_LineGT_flags.npy)
+        """
+        return os.path.splitext(gt_path)[0] + "_flags.npy"
+
+    @profiled()
     def browse_next(self, event):
+        if self.video_reader is None:  # no video, or a video being opened
+            return
         event_type = str(event.type)
         if (event_type == 'ButtonPress' or event_type == 'KeyPress') or (
                 event_type == 'MouseWheel' and event.delta > 0):
@@ -342,18 +761,18 @@ class MainInterface(tk.Frame):
             # increment the index of the image or frame to read and display
             self.frame_index = min(self.frame_index + self.browsing_offset,
                                    self.frames_nbr - 1)  # Example to understand why min() is used: if (self.frame_index + self.browsing_offset) = 130 and the total # of frames (or images) = 100, self.frame_index gets updated to 100 - 1 = 99 (because the index starts from 0)
-            self.video_reader.set(cv.CAP_PROP_POS_FRAMES, self.frame_index)
-            self.no_error_flag, self.frame_as_np = self.video_reader.read()
-            if self.no_error_flag:
-                self.img_display.show_img(src=self.frame_as_np, src_type='numpy', set_as_org=True)
-                self.browsing_status.config(
-                    text=str(self.frame_index + 1) + "/" + str(self.frames_nbr))
-                self.back_button.config(state='normal')
-                if self.frame_index + 1 == self.frames_nbr:
-                    self.next_button.config(state='disabled')
-                self.show_current_annotation()
+            # the browsing status is updated immediately; the frame is shown by self.show_browsed_frame once decoded
+            self.browsing_status.config(
+                text=str(self.frame_index + 1) + "/" + str(self.frames_nbr))
+            self.back_button.config(state='normal')
+            if self.frame_index + 1 == self.frames_nbr:
+                self.next_button.config(state='disabled')
+            self.navigation_scheduler.request(self.frame_index)
 
+    @profiled()
     def browse_back(self, event):
+        if self.video_reader is None:
+            return
         event_type = str(event.type)
         if (event_type == 'ButtonPress' or event_type == 'KeyPress') or (
                 event_type == 'MouseWheel' and event.delta < 0):
@@ -361,16 +780,30 @@ class MainInterface(tk.Frame):
             self.alpha_hl = np.nan
             self.frame_index = max(self.frame_index - self.browsing_offset,
                                    0)  # decrement the index. Example to understand why max() is used: if (self.frame_index - self.browsing_offset) = -3, self.frame_index gets updated to 0
-            self.video_reader.set(cv.CAP_PROP_POS_FRAMES, self.frame_index)
-            self.no_error_flag, self.frame_as_np = self.video_reader.read()
-            if self.no_error_flag:
-                self.img_display.show_img(src=self.frame_as_np, src_type='numpy', set_as_org=True)
-                self.browsing_status.config(
-                    text=str(self.frame_index + 1) + "/" + str(self.frames_nbr))
-                self.next_button.config(state='normal')
-                if self.frame_index == 0:
-                    self.back_button.config(state='disabled')
-                self.show_current_annotation()
+            self.browsing_status.config(
+                text=str(self.frame_index + 1) + "/" + str(self.frames_nbr))
+            self.next_button.config(state='normal')
+            if self.frame_index == 0:
+                self.back_button.config(state='disabled')
+            self.navigation_scheduler.request(self.frame_index)
+
+    @profiled()
+    def show_browsed_frame(self, index, fetched):
+        """
+        Callback of self.navigation_scheduler: shows the decoded frame 'index' (the latest browsed frame) and its
+        annotation.
+        :param index: index of the decoded frame
+        :param fetched: the tuple returned by self.fetch_frame(index)
+        """
+        self.no_error_flag, self.frame_as_np, self.frame_org_size = fetched
+        self.update_cache_stats()
+        if self.no_error_flag:
+            self.img_display.show_img(src=self.frame_as_np, src_type='numpy', set_as_org=True,
+                                      org_size=self.frame_org_size)
+            self.show_current_annotation()
+            self.update_disputed_status()
+        else:
+            self.browsing_status.config(text="{}/{} (can't decode this frame)".format(index + 1, self.frames_nbr))
 
     def show_current_annotation(self):
         self.hl_xs, self.hl_ys, self.hl_xe, self.hl_ye = self.gt_xy_ends[self.frame_index]
@@ -384,25 +817,470 @@ class MainInterface(tk.Frame):
         self.shown_hl_thickness_entry.insert(index=0, string=str(self.line_thickness))
         if not np.isnan(Y) and not np.isnan(Y):
             text = "Current annotation:\n---------------------\nY = {} pixs\nAlpha = {} °".format(str(Y), str(alpha))
+            if self.gt_flags[self.frame_index] == Interpolation.INTERPOLATED:
+                text += "\n(interpolated)"
+            elif self.gt_flags[self.frame_index] == Interpolation.TRACKED:
+                text += "\n(tracked)"
+            elif self.gt_flags[self.frame_index] == Interpolation.PROPAGATED:
+                text += "\n(propagated)"
             self.current_annotation_label.config(text=text)
-            self.img_with_annotated_hl = np.copy(self.frame_as_np)
-            cv.line(self.img_with_annotated_hl, (self.hl_xs, self.hl_ys), (self.hl_xe, self.hl_ye), (0, 0, 255), self.line_thickness)
-            self.img_display.show_img(src=self.img_with_annotated_hl, src_type='numpy', set_as_org=False)
+            # the annotated line is drawn over the shown frame; annotations are in original pixels, hence the scaling
+            scale = self.img_display.w_scaled / self.img_display.org_w
+            self.img_display.restore_org()
+            self.img_display.draw_overlay([[self.hl_xs * scale, self.hl_ys * scale,
+                                            self.hl_xe * scale, self.hl_ye * scale]],
+                                          fill="#ff0000", width=self.line_thickness, tag='annotation')
         else:
             text = "Current annotation:\n---------------------\nY = {} pixs\nAlpha = {} °".format("???", "???")
             self.current_annotation_label.config(text=text)
-            # print("showing and writing original img")
-            # cv.imwrite("frame_as_np.png", np.copy(self.frame_as_np))
-            self.img_display.show_img(src=np.copy(self.frame_as_np), src_type='numpy', set_as_org=True)
+            self.img_display.restore_org()
+            self.img_display.reset_drawings()
+            if self.auto_propose.get() and self.proposals is not None:
+                self.show_proposal()
+
+    def fetch_frame(self, index):
+        """
+        Returns the frame with index 'index'. In proxy mode, the frame is read from self.proxy if the latter already
+        holds it; otherwise, it is read at full resolution from self.video_reader. Safe to call from any thread.
+        :return: a tuple (no_error_flag, frame, org_size), where org_size is the size (width, height) of the original
+        frame if 'frame' is a proxy frame, None otherwise.
+        """
+        proxy, video_reader = self.proxy, self.video_reader
+        if proxy is not None:
+            no_error_flag, frame = proxy.get_frame(index)
+            if no_error_flag:
+                return no_error_flag, frame, (proxy.org_w, proxy.org_h)
+        no_error_flag, frame = video_reader.get_frame(index)
+        return no_error_flag, frame, None
+
+    def read_full_res_frame(self):
+        """
+        Reads the current frame at full resolution from self.video_reader, even in proxy mode.
+        :return: the frame, or None if it can't be read
+        """
+        if self.video_reader is None:
+            return None
+        no_error_flag, frame = self.video_reader.get_frame(self.frame_index)
+        return frame if no_error_flag else None
+
+    @profiled()
+    def toggle_proxy_mode(self):
+        """
+        Starts (or reuses) the display-resolution proxy of the loaded video if proxy mode is checked, stops it otherwise.
+        """
+        if self.proxy is not None:
+            self.proxy.close()
+            self.proxy = None
+        if self.proxy_mode.get() and self.video_reader is not None:
+            self.proxy = VideoProxy(self.video_file_path, self.frames_nbr, self.max_img_width, self.max_img_height)
+        self.update_proxy_status()
+
+    def update_proxy_status(self):
+        """
+        Shows the progress of the proxy being built. Reschedules itself until the build has ended.
+        """
+        if self.proxy is None:
+            self.proxy_status_label.config(text="Proxy: off")
+        elif self.proxy.complete:
+            self.proxy_status_label.config(text="Proxy: ready ({})".format(self.proxy.store.kind))
+        elif self.proxy.finished:  # frames already written are still used, the others are read from the video
+            self.proxy_status_label.config(text="Proxy failed at frame {}: {}".format(self.proxy.frames_done,
+                                                                                     self.proxy.error))
+        else:
+            self.proxy_status_label.config(text="Proxy: {}/{} frames".format(self.proxy.frames_done, self.frames_nbr))
+            self.after(500, self.update_proxy_status)
+
+    @profiled()
+    def track_annotation(self, event):
+        """
+        Tracks the annotation of the current frame through the following frames, in a background thread, up to the next
+        keyframe (validated or propagated frame) or until tracking confidence drops (see HorizonTracker.track_video). Tracked frames are logged
+        by self.log_tracking_results as they come, flagged as tracked.
+        """
+        if self.gt_Y_alpha is None or self.tracking_range is not None or self.navigation_scheduler.pending \
+                or np.isnan(self.gt_Y_alpha[self.frame_index, 0]):
+            return
+        start_index = self.frame_index
+        keyframes_after = np.flatnonzero(Interpolation.is_keyframe(self.gt_flags[start_index + 1:]))
+        stop_index = start_index + 1 + keyframes_after[0] if keyframes_after.size else self.frames_nbr
+        with self.tracking_lock:
+            self.tracking_id += 1
+            tracking_id = self.tracking_id
+            self.tracking_results = []
+            self.tracking_stop_index = None
+        self.tracking_range = (start_index, stop_index)
+        self.tracking_canceled = False
+        self.tracking_error = None
+        self.tracking_progressbar.config(maximum=max(stop_index - start_index - 1, 1), value=0)
+        self.tracking_status_label.config(text="Tracking frames {} to {}".format(start_index + 2, stop_index))
+        self.cancel_tracking_button.config(state='enable')
+        video_file_path, seek_index = self.video_file_path, self.seek_index
+        start_xy_ends = tuple(float(c) for c in self.gt_xy_ends[start_index])
+
+        def progress_callback(index, gt_row, confidence):
+            with self.tracking_lock:
+                if tracking_id == self.tracking_id:
+                    self.tracking_results.append((index, gt_row))
+
+        def worker():
+            stop, failure = start_index, None  # a failed tracking stops where it started
+            try:
+                stop = track_video(video_file_path, start_index, start_xy_ends, stop_index, seek_index=seek_index,
+                                   progress_callback=progress_callback,
+                                   should_stop=lambda: self.tracking_canceled or tracking_id != self.tracking_id)
+            except Exception as error:  # e.g., a decoding error: reported by self.log_tracking_results
+                failure = error
+            finally:
+                with self.tracking_lock:
+                    if tracking_id == self.tracking_id:
+                        self.tracking_error = failure
+                        self.tracking_stop_index = stop
+
+        threading.Thread(target=worker, name="HorizonTracker", daemon=True).start()
+        self.after(100, self.log_tracking_results, tracking_id)
+
+    @profiled()
+    def cancel_tracking(self, event):
+        self.tracking_canceled = True
 
+    def stop_tracking(self):
+        """
+        Stops the running tracking (if any) and drops its results not logged yet (e.g., when another video is opened).
+        """
+        with self.tracking_lock:
+            self.tracking_id += 1
+            self.tracking_results = []
+        if self.tracking_range is not None:
+            self.tracking_range = None
+            self.cancel_tracking_button.config(state='disabled')
+            self.tracking_status_label.config(text="Tracking stopped")
+
+    @profiled()
+    def log_tracking_results(self, tracking_id):
+        """
+        Logs the frames tracked since the last call into the gt arrays (keyframes are never overwritten).
+        Reschedules itself until tracking is finished; then, if tracking stopped because its confidence dropped, the
+        frame where it stopped is shown so that the user can annotate it.
+        :param tracking_id: the tracking whose results are logged (see self.tracking_id); a stopped one logs nothing
+        """
+        with self.tracking_lock:
+            if tracking_id != self.tracking_id:
+                return
+            results, self.tracking_results = self.tracking_results, []
+            tracking_stop_index = self.tracking_stop_index
+        try:
+            if results:
+                indexes = np.array([index for index, _ in results])
+                rows = np.array([gt_row for _, gt_row in results])
+                not_keyframes = ~Interpolation.is_keyframe(self.gt_flags[indexes])
+                indexes, rows = indexes[not_keyframes], rows[not_keyframes]
+                self.gt_Y_alpha[indexes] = rows[:, 0:2]
+                self.gt_xy_ends[indexes] = rows[:, 2:]
+                self.gt_flags[indexes] = Interpolation.TRACKED
+                self.log_changes(indexes)
+                self.tracking_progressbar.config(value=results[-1][0] - self.tracking_range[0])
+        finally:
+            if tracking_stop_index is None:
+                self.after(100, self.log_tracking_results, tracking_id)
+            else:
+                self.finish_tracking(tracking_stop_index)
+
+    def finish_tracking(self, tracking_stop_index):
+        start_index, stop_index = self.tracking_range
+        self.tracking_range = None
+        self.cancel_tracking_button.config(state='disabled')
+        if self.tracking_error is not None:
+            self.tracking_status_label.config(text="Tracking failed at frame {}: {}".format(tracking_stop_index + 1,
+                                                                                           self.tracking_error))
+        elif self.tracking_canceled:
+            self.tracking_status_label.config(text="Tracking canceled at frame {}".format(tracking_stop_index + 1))
+        elif tracking_stop_index < stop_index:
+            self.tracking_status_label.config(text="Low confidence at frame {}".format(tracking_stop_index + 1))
+            self.go_to_frame(tracking_stop_index)
+        else:
+            self.tracking_status_label.config(text="Tracked frames {} to {}".format(start_index + 2, stop_index))
+
+    def go_to_frame(self, index):
+        """
+        Browses to the frame with index 'index' (the frame is shown once decoded, see self.navigation_scheduler).
+        """
+        self.Y_hl = np.nan
+        self.alpha_hl = np.nan
+        self.frame_index = min(max(index, 0), self.frames_nbr - 1)
+        self.browsing_status.config(text=str(self.frame_index + 1) + "/" + str(self.frames_nbr))
+        self.back_button.config(state='normal' if self.frame_index > 0 else 'disabled')
+        self.next_button.config(state='normal' if self.frame_index + 1 < self.frames_nbr else 'disabled')
+        self.navigation_scheduler.request(self.frame_index)
+
+    @profiled()
+    def show_proposal(self, event=None):
+        """
+        Draws the horizon proposed for the current frame as the drawn horizon line, so that validating it (v) annotates
+        the frame. The proposal is taken from self.proposals if computed, otherwise it's detected on the current frame.
+        """
+        if self.frame_as_np is None or self.navigation_scheduler.pending:
+            return
+        if self.proposals is not None:
+            xs, ys, xe, ye = self.proposals[self.frame_index, 2:]
+        else:
+            xs, ys, xe, ye = HorizonDetector.detect_horizon(self.frame_as_np)[2:]
+            if self.frame_org_size is not None:  # proposal on a proxy frame: map it to original pixels
+                sx = self.frame_org_size[0] / self.frame_as_np.shape[1]
+                sy = self.frame_org_size[1] / self.frame_as_np.shape[0]
+                xs, ys, xe, ye = xs * sx, ys * sy, xe * sx, ye * sy
+        if not np.isnan(ys):
+            self.img_display.set_horizon(xs, ys, xe, ye)
+
+    @profiled()
+    def compute_proposals(self, event):
+        """
+        Computes horizon proposals for all frames of the loaded video in a background thread (which uses a pool of
+        processes, see HorizonDetector.propose_video).
+        """
+        if self.video_reader is None or self.proposals_progress is not None:
+            return
+        self.proposals_progress = (0, self.frames_nbr)
+        self.proposals_error = None
+        video_file_path, frames_nbr, seek_index = self.video_file_path, self.frames_nbr, self.seek_index
+
+        def progress_callback(frames_done, frames_nbr):
+            self.proposals_progress = (frames_done, frames_nbr)
+
+        def worker():
+            try:
+                proposals = HorizonDetector.propose_video(video_file_path, frames_nbr, seek_index=seek_index,
+                                                          progress_callback=progress_callback)
+                if video_file_path == self.video_file_path:
+                    self.proposals = proposals
+            except Exception as error:  # e.g., a decoding error: shown by self.update_proposals_status
+                self.proposals_error = error
+            finally:
+                self.proposals_progress = None
+
+        threading.Thread(target=worker, name="HorizonProposals", daemon=True).start()
+        self.update_proposals_status()
+
+    def update_proposals_status(self):
+        """
+        Shows the status of proposals. Reschedules itself while proposals are being computed.
+        """
+        if self.proposals_progress is not None:
+            self.proposals_status_label.config(text="Proposals: {}/{} frames".format(*self.proposals_progress))
+            self.after(500, self.update_proposals_status)
+        elif self.proposals_error is not None:
+            self.proposals_status_label.config(text="Proposals failed: {}".format(self.proposals_error))
+        elif self.proposals is not None:
+            self.proposals_status_label.config(text="Proposals: ready")
+        else:
+            self.proposals_status_label.config(text="Proposals: none")
+
+    @profiled()
+    def compute_segments(self, event):
+        """
+        Computes the signatures of all frames of the loaded video in a background thread (which uses a pool of
+        processes, see SceneSegmentation.compute_signatures), then splits the video into static segments.
+        """
+        if self.video_reader is None or self.segments_progress is not None:
+            return
+        self.segments_progress = (0, self.frames_nbr)
+        self.segments_error = None
+        video_file_path, frames_nbr, seek_index = self.video_file_path, self.frames_nbr, self.seek_index
+
+        def progress_callback(frames_done, frames_nbr):
+            self.segments_progress = (frames_done, frames_nbr)
+
+        def worker():
+            try:
+                signatures = SceneSegmentation.compute_signatures(video_file_path, frames_nbr, seek_index=seek_index,
+                                                                  progress_callback=progress_callback)
+                if video_file_path == self.video_file_path:
+                    self.segments = SceneSegmentation.segment_static(*signatures)
+                    self.signature_profiles = signatures[0]
+            except Exception as error:  # e.g., a decoding error: shown by self.update_segments_status
+                self.segments_error = error
+            finally:
+                self.segments_progress = None
+
+        threading.Thread(target=worker, name="SceneSegmentation", daemon=True).start()
+        self.update_segments_status()
+
+    def update_segments_status(self):
+        """
+        Shows the status of static segments. Reschedules itself while frame signatures are being computed.
+        """
+        state = 'disabled' if self.segments is None else 'enable'
+        self.previous_segment_button.config(state=state)
+        self.next_segment_button.config(state=state)
+        if self.segments_progress is not None:
+            self.segments_status_label.config(text="Segments: {}/{} frames".format(*self.segments_progress))
+            self.after(500, self.update_segments_status)
+        elif self.segments_error is not None:
+            self.segments_status_label.config(text="Segments failed: {}".format(self.segments_error))
+        elif self.segments is not None:
+            self.segments_status_label.config(text="Segments: {} (longest: {} frames)".format(
+                len(self.segments), int(self.segments.lengths().max())))
+            if self.gt_flags is not None:  # the proposed frames depend on the signatures (motion time)
+                self.reset_active_scheduler()
+        else:
+            self.segments_status_label.config(text="Segments: none")
+
+    def reset_active_scheduler(self):
+        """
+        Rebuilds self.active_scheduler from the keyframes (validated or propagated frames), in motion time if frame
+        signatures are available.
+        """
+        motion = None
+        if self.signature_profiles is not None and len(self.signature_profiles) == self.frames_nbr:
+            motion = cumulative_motion(self.signature_profiles)
+        self.active_scheduler = ActiveScheduler(self.frames_nbr, motion=motion)
+        keyframes = np.flatnonzero(Interpolation.is_keyframe(self.gt_flags) & ~np.isnan(self.gt_Y_alpha[:, 0]))
+        self.active_scheduler.set_keyframes(keyframes, self.gt_xy_ends)
+        self.update_active_status()
+
+    def update_active_status(self):
+        proposal = self.active_scheduler.next_frame()
+        if proposal is None:
+            text = "All frames validated"
+        elif proposal[1] < self.target_error:
+            text = "Target error reached ({:.2f} px)".format(proposal[1])
+        else:
+            text = "Expected error: {} at frame {}".format(
+                "?" if np.isinf(proposal[1]) else "{:.2f} px".format(proposal[1]), proposal[0] + 1)
+        self.active_status_label.config(text=text)
+
+    @profiled()
+    def go_to_most_useful_frame(self, event):
+        """
+        Browses to the frame where the interpolation error is expected to be the highest (see ActiveScheduler), unless
+        the target error is reached.
+        """
+        if self.active_scheduler is None:
+            return
+        proposal = self.active_scheduler.next_frame(exclude=(self.frame_index,))
+        if proposal is not None and proposal[1] >= self.target_error:
+            self.go_to_frame(proposal[0])
+        self.update_active_status()
+
+    @profiled()
+    def set_target_error(self, event):
+        try:
+            self.target_error = max(float(self.target_error_entry.get()), 0.0)
+        except ValueError:
+            pass
+        self.target_error_entry.delete(0, "end")
+        self.target_error_entry.insert(index=0, string=str(self.target_error))
+        if self.active_scheduler is not None:
+            self.update_active_status()
+
+    @profiled()
+    def go_to_next_segment(self, event):
+        if self.segments is None:
+            return
+        index = self.segments.next_boundary(self.frame_index)
+        if index is not None:
+            self.go_to_frame(index)
+
+    @profiled()
+    def go_to_previous_segment(self, event):
+        if self.segments is None:
+            return
+        index = self.segments.previous_boundary(self.frame_index)
+        if index is not None:
+            self.go_to_frame(index)
+
+    @profiled()
+    def load_disputed_file(self, event):
+        """
+        Loads the list of disputed frames of the loaded video written by Consensus (<video name>_Disputed.json).
+        """
+        if self.gt_Y_alpha is None:
+            return
+        title = "Choose the list of disputed frames of this video"
+        filetypes = (("Disputed frames", "*" + DISPUTED_SUFFIX), ("json file", "*.json"))
+        disputed_file_path = tk.filedialog.askopenfilename(initialdir=self.initial_dir(self.gt_file_path), title=title,
+                                                           filetypes=filetypes)
+        if os.path.exists(disputed_file_path):
+            try:
+                disputed = DisputedFrames.load(disputed_file_path)
+            except (OSError, ValueError, KeyError) as error:
+                tk.messagebox.showerror(title="Disputed frames", message="Can't read {}:\n{}".format(
+                    disputed_file_path, error))
+                return
+            if disputed.frames_nbr != self.frames_nbr:
+                tk.messagebox.showerror(title="Disputed frames", message="The list has {} frames, the video {}".format(
+                    disputed.frames_nbr, self.frames_nbr))
+                return
+            self.disputed = disputed
+            self.update_disputed_status()
+
+    def update_disputed_status(self):
+        """
+        Shows the number of disputed frames, and the values of the annotators if the current frame is disputed.
+        """
+        state = 'disabled' if self.disputed is None or len(self.disputed) == 0 else 'enable'
+        self.previous_disputed_button.config(state=state)
+        self.next_disputed_button.config(state=state)
+        if self.disputed is None:
+            self.disputed_status_label.config(text="Disputed frames: none")
+            return
+        text = self.disputed.describe(self.frame_index)
+        if text is None:
+            text = "Disputed frames: {} (by {} annotators)".format(len(self.disputed), self.disputed.annotators)
+        self.disputed_status_label.config(text=text)
+
+    @profiled()
+    def go_to_next_disputed(self, event):
+        if self.disputed is None:
+            return
+        index = self.disputed.next_frame(self.frame_index)
+        if index is not None:
+            self.go_to_frame(index)
+            self.update_disputed_status()
+
+    @profiled()
+    def go_to_previous_disputed(self, event):
+        if self.disputed is None:
+            return
+        index = self.disputed.previous_frame(self.frame_index)
+        if index is not None:
+            self.go_to_frame(index)
+            self.update_disputed_status()
+
+    @profiled()
     def set_offset(self, event):
         try:
             offset_str = self.browsing_offset_entry.get()
             self.browsing_offset = max(int(offset_str), 1)  # this enables getting an offset = 0 or smaller.
+            if self.video_reader is not None:
+                self.video_reader.set_browsing_offset(self.browsing_offset)
             self.master.focus()
         except:
             tk.messagebox.showwarning("Warning", message="Invalid browsing offset. It must be positive integer")
 
+    @profiled()
+    def set_cache_size(self, event):
+        try:
+            self.cache_size_mb = max(int(self.cache_size_entry.get()), 0)
+            if self.video_reader is not None:
+                self.video_reader.set_cache_size(self.cache_size_mb)
+            self.update_cache_stats()
+            self.master.focus()
+        except ValueError:
+            tk.messagebox.showwarning("Warning", message="Invalid cache size. It must be a non-negative integer (MB)")
+
+    def update_cache_stats(self):
+        """
+        Updates the label showing the number of cached frames, the memory they use and the cache hits/misses.
+        """
+        if self.video_reader is None:
+            stats = {"frames": 0, "hits": 0, "misses": 0, "cur_bytes": 0, "max_bytes": self.cache_size_mb * 1024 * 1024}
+        else:
+            stats = self.video_reader.stats()
+        text = "Cached frames: {}\nMemory: {:.0f}/{:.0f} MB\nHits: {}  Misses: {}".format(
+            stats["frames"], stats["cur_bytes"] / 2 ** 20, stats["max_bytes"] / 2 ** 20, stats["hits"], stats["misses"])
+        self.cache_stats_label.config(text=text)
+
+    @profiled()
     def set_hl_thickness(self, event):
         temp_text = self.shown_hl_thickness_entry.get()
         try:
@@ -413,6 +1291,87 @@ class MainInterface(tk.Frame):
         self.shown_hl_thickness_entry.insert(index=0, string=temp_text)
         self.img_display.focus()
 
+    def log_changes(self, indexes):
+        """
+        Autosaves the annotations of the frames 'indexes' (an index or an array of indexes) to the journal.
+        """
+        if self.journal is not None:
+            try:
+                self.journal.append(indexes, self.gt_Y_alpha, self.gt_xy_ends, self.gt_flags)
+            except OSError as error:  # e.g., disk full
+                self.disable_autosave(error)
+            self.update_autosave_status()
+
+    def compact_journal(self):
+        """
+        Periodically merges the journal into the autosaved gt file next to the video (see AnnotationJournal.compact).
+        """
+        if self.journal is not None and self.journal.records_nbr > 0:
+            self.compact_journal_now()
+        self.after(self.journal_compaction_period, self.compact_journal)
+
+    def compact_journal_now(self):
+        try:
+            self.journal.compact(self.gt_Y_alpha, self.gt_xy_ends, self.gt_flags)
+        except OSError as error:
+            self.disable_autosave(error)
+        self.update_autosave_status()
+
+    def disable_autosave(self, error):
+        """
+        Stops autosaving the loaded video after the journal or the autosaved gt file couldn't be written: annotating
+        goes on, and the annotations can still be saved with "Save annotated file".
+        """
+        if self.journal is not None:
+            try:
+                self.journal.close()
+            except OSError:
+                pass
+            self.journal = None
+        self.autosave_error = error
+
+    def update_autosave_status(self):
+        if self.autosave_error is not None:
+            self.autosave_label.config(text="Autosave disabled: {}".format(
+                getattr(self.autosave_error, "strerror", None) or self.autosave_error))
+        elif self.journal is None:
+            self.autosave_label.config(text="Autosave: no video")
+        else:
+            self.autosave_label.config(text="Autosave: {} unmerged changes".format(self.journal.records_nbr))
+
+    def toggle_profiling_hud(self, event=None):
+        """
+        Shows or hides the timing statistics of the GUI's hot paths over the image (see Profiling). Profiling is enabled
+        while the HUD is shown.
+        """
+        self.profiling_hud_shown = not self.profiling_hud_shown
+        if self.profiling_hud_shown:
+            self.profiling_was_enabled = PROFILER.enabled
+            PROFILER.enabled = True
+            self.update_profiling_hud()
+        else:
+            PROFILER.enabled = self.profiling_was_enabled
+            self.img_display.hide_hud()
+
+    def update_profiling_hud(self):
+        """
+        Refreshes the profiling HUD. Reschedules itself while the HUD is shown.
+        """
+        if self.profiling_hud_shown:
+            self.img_display.show_hud(PROFILER.format_summary() + "\n(F2: hide, F3: export)")
+            self.after(500, self.update_profiling_hud)
+
+    def export_profile(self, event=None):
+        """
+        Exports the collected timing spans as a JSON summary (<name>.json) and a Chrome trace (<name>_trace.json).
+        """
+        path = tk.filedialog.asksaveasfilename(title="Export profile", defaultextension=".json",
+                                               initialfile="horizon_annotator_profile.json",
+                                               filetypes=(("JSON files", "*.json"),))
+        if path:
+            PROFILER.export_json(path)
+            PROFILER.export_chrome_trace(os.path.splitext(path)[0] + "_trace.json")
+
     def log_gt_sample(self, event):
         """
         logging parameters Y, alpha of drawn line as a gt horizon
@@ -428,12 +1387,8 @@ class MainInterface(tk.Frame):
         the flag self.shown_version_flag.
         """
         if self.img_display.all_lines_scaled != []:
-            self.img_display.show_img(src=self.img_display.im_as_pil_org.copy(), src_type='pil', set_as_org=False)
-            drawer = ImageDraw.Draw(self.img_display.cur_shown)
-            for line in self.img_display.all_lines_scaled:
-                drawer.line(xy=line, fill=128, width=1)
-            self.img_display.show_img(src=self.img_display.cur_shown, src_type='pil', set_as_org=False)
-            self.img_display.cur_with_valid_drawings = self.img_display.cur_shown.copy()
+            self.img_display.restore_org()
+            self.img_display.draw_overlay(self.img_display.all_lines_scaled, fill="#800000", width=1)
             self.shapes_shown_flag = True
 
   # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
@@ -0,0 +1,108 @@
+import threading
+
+
+class NavigationScheduler:
+    """
+    Decodes frames requested by navigation (browsing) off the Tkinter thread, keeping only the latest request.
+
+    When a browsing key is held down, Tkinter queues many browsing events. Each one only records its target frame
+    index here (which is cheap), so the event queue drains immediately. A worker thread decodes the latest target
+    only; targets requested while it was decoding are dropped, except the newest one. Results are handed back to the
+    Tkinter thread by polling with widget.after(), because Tkinter widgets must only be used from the Tkinter thread,
+    and a result is delivered only if it is still the latest requested frame.
+    """
+    def __init__(self, widget, fetch_frame, on_frame_ready, poll_ms=5, failed_result=None):
+        """
+        :param widget: a Tkinter widget, used to schedule polling on the Tkinter thread
+        :param fetch_frame: a thread-safe function taking a frame index and returning the decoded frame (any object)
+        :param on_frame_ready: a function called on the Tkinter thread as on_frame_ready(index, result), where result is
+        what fetch_frame returned for the latest requested index
+        :param poll_ms: polling period (in milliseconds) while a request is pending
+        :param failed_result: the result delivered when fetch_frame raises an exception (e.g., a damaged frame), so
+        that navigation goes on
+        """
+        self.widget = widget
+        self.fetch_frame = fetch_frame
+        self.on_frame_ready = on_frame_ready
+        self.poll_ms = poll_ms
+        self.failed_result = failed_result
+        self.last_error = None  # the last exception raised by fetch_frame
+        self.latest_index = None  # index of the latest requested frame
+        self.dropped_requests = 0  # number of requests superseded by a newer one before being decoded
+        self._pending_index = None  # index waiting to be decoded by the worker thread
+        self._result = None  # a tuple (index, result) of the last decoded frame, not yet delivered
+        self._polling = False
+        self._stopped = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="NavigationScheduler", daemon=True)
+        self._thread.start()
+
+    @property
+    def pending(self):
+        """
+        True if the latest requested frame hasn't been delivered yet.
+        """
+        return self.latest_index is not None
+
+    def request(self, index):
+        """
+        Requests the frame with index 'index', superseding any request that hasn't been decoded yet.
+        """
+        with self._cond:
+            if self._pending_index is not None:
+                self.dropped_requests += 1
+            self._pending_index = index
+            self.latest_index = index
+            self._cond.notify_all()
+        if not self._polling:
+            self._polling = True
+            self.widget.after(self.poll_ms, self._poll)
+
+    def cancel(self):
+        """
+        Drops the pending request, if any (e.g., when another video is loaded).
+        """
+        with self._cond:
+            self._pending_index = None
+            self.latest_index = None
+            self._result = None
+
+    def close(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pending_index is None and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                index = self._pending_index
+                self._pending_index = None
+            try:
+                result = self.fetch_frame(index)
+            except Exception as error:  # the worker must survive, or no later request would be served
+                self.last_error = error
+                result = self.failed_result
+            with self._cond:
+                if index == self.latest_index:
+                    self._result = (index, result)
+
+    def _poll(self):
+        # runs on the Tkinter thread
+        with self._cond:
+            ready = self._result
+            self._result = None
+            if ready is not None and ready[0] != self.latest_index:
+                ready = None
+            if ready is not None:
+                self.latest_index = None
+        if ready is not None:
+            self.on_frame_ready(*ready)
+        if self.latest_index is not None:
+            self.widget.after(self.poll_ms, self._poll)
+        else:
+            self._polling = False
@@ -0,0 +1,248 @@
+"""
+Offline rendering of QA videos: the annotated horizon of each frame, its index and its Y/alpha values are burned into
+a copy of the video, to review a finished annotation without stepping through it in the GUI.
+
+Decoding, drawing and encoding run as stages of a pipeline, on separate threads connected by bounded queues (OpenCV
+releases the GIL while decoding, drawing and encoding, so the stages run in parallel):
+    decode (1 thread) -> draw (draw_workers threads) -> encode (1 thread, frames put back in order)
+A full queue blocks the stage feeding it, so that memory use stays bounded whatever the length of the video.
+
+    python -m AnnotationGUI.OverlayRenderer video.mp4 --out video_Overlay.mp4 --scale 0.5
+"""
+import os
+import sys
+import time
+import queue
+import argparse
+import threading
+import numpy as np
+import cv2 as cv
+from AnnotationGUI import Interpolation
+from AnnotationGUI.FrameSources import read_frames, source_kind, VideoFrameSource
+from AnnotationGUI.BatchCLI import load_gt_and_flags, GT_SUFFIX
+
+# BGR colours of the line, by flag (see Interpolation)
+LINE_COLOURS = {Interpolation.VALIDATED: (0, 0, 255), Interpolation.INTERPOLATED: (0, 165, 255),
+                Interpolation.TRACKED: (255, 255, 0), Interpolation.PROPAGATED: (0, 255, 0)}
+FLAG_NAMES = {Interpolation.VALIDATED: "validated", Interpolation.INTERPOLATED: "interpolated",
+              Interpolation.TRACKED: "tracked", Interpolation.PROPAGATED: "propagated"}
+NAN_COLOUR = (255, 0, 255)  # frame border and text of frames without annotation
+_END = None  # end-of-stream marker passed down the queues
+
+
+def draw_overlay(frame, index, gt_row, flag, thickness=2, scale=1.0):
+    """
+    Draws the annotation of a frame over it (in place if scale is 1): the horizon line, the frame index and the values
+    of Y and alpha. Frames without annotation get a border and a NOT ANNOTATED text instead.
+    :param frame: a BGR frame
+    :param index: index of the frame
+    :param gt_row: the gt row (Y, alpha, xs, ys, xe, ye) of the frame, in pixels of the original frame
+    :param flag: the flag of the frame (see Interpolation)
+    :param thickness: line thickness, in pixels of the output frame
+    :param scale: scale of the output frame with respect to the original frame
+    :return: the output frame
+    """
+    if scale != 1.0:
+        frame = cv.resize(frame, None, fx=scale, fy=scale, interpolation=cv.INTER_AREA)
+    h, w = frame.shape[:2]
+    font_scale = max(h / 720, 0.4)
+    font_thickness = max(int(round(2 * font_scale)), 1)
+    Y, alpha, xs, ys, xe, ye = (float(v) for v in gt_row)
+    if np.isnan(Y):
+        cv.rectangle(frame, (0, 0), (w - 1, h - 1), NAN_COLOUR, max(thickness * 2, 4))
+        text, colour = "#{}  NOT ANNOTATED".format(index), NAN_COLOUR
+    else:
+        # cv.line takes integer coordinates: the shift parameter keeps 4 fractional bits
+        ends = np.round(np.array([xs, ys, xe, ye]) * scale * 16).astype(np.int64)
+        colour = LINE_COLOURS.get(int(flag), (0, 0, 255))
+        cv.line(frame, (int(ends[0]), int(ends[1])), (int(ends[2]), int(ends[3])), colour, thickness,
+                lineType=cv.LINE_AA, shift=4)
+        text = "#{}  Y = {:.2f}  alpha = {:.2f}  {}".format(index, Y, alpha, FLAG_NAMES.get(int(flag), ""))
+    # a dark box behind the text keeps it readable over bright skies (an outline drawn with a thicker font would be
+    # wider than the text: the advance of Hershey glyphs depends on the thickness)
+    (text_w, text_h), baseline = cv.getTextSize(text, cv.FONT_HERSHEY_SIMPLEX, font_scale, font_thickness)
+    margin = int(8 * font_scale) + 1
+    origin = (2 * margin, 2 * margin + text_h)
+    cv.rectangle(frame, (margin, margin), (3 * margin + text_w, 3 * margin + text_h + baseline), (0, 0, 0), cv.FILLED)
+    cv.putText(frame, text, origin, cv.FONT_HERSHEY_SIMPLEX, font_scale, colour, font_thickness, cv.LINE_AA)
+    return frame
+
+
+class _Stage(threading.Thread):
+    """
+    A pipeline stage: a thread running 'target', whose exception (if any) is kept to be raised by the caller of
+    render_overlay, and whose busy time is measured by the target itself.
+    """
+    def __init__(self, name, target, *args):
+        super().__init__(name=name, daemon=True)
+        self._target_function, self._target_args = target, args
+        self.error = None
+        self.busy_seconds = 0.0
+
+    def run(self):
+        try:
+            self._target_function(self, *self._target_args)
+        except BaseException as error:
+            self.error = error
+
+
+def _put(q, item, stop):
+    # blocks while the queue is full, unless the pipeline is being stopped
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _get(q, stop):
+    while not stop.is_set():
+        try:
+            return True, q.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return False, None
+
+
+def render_overlay(video_file_path, gt, flags, out_path, fps=None, start=0, stop=None, thickness=2, scale=1.0,
+                   draw_workers=2, queue_size=16, codec="mp4v", progress_callback=None):
+    """
+    Renders the QA video of an annotation (see draw_overlay) through the decode -> draw -> encode pipeline.
+    :param video_file_path: path of the video file (or of another frame source, see FrameSources)
+    :param gt: array of shape (N, 6) of gt rows
+    :param flags: array of shape (N,) of per-frame flags
+    :param out_path: path of the output video
+    :param fps: frame rate of the output video (default: that of the video, 25 for other frame sources)
+    :param start: index of the first rendered frame
+    :param stop: index after the last rendered frame (default: len(gt))
+    :param thickness: line thickness in pixels of the output video
+    :param scale: scale of the output video with respect to the input one
+    :param draw_workers: number of drawing threads
+    :param queue_size: capacity of each queue between stages, in frames
+    :param codec: fourcc code of the output video
+    :param progress_callback: a function called as progress_callback(frames_done, frames_nbr) every 100 frames
+    :return: a dictionary of statistics: frames written, elapsed seconds, fps and the busy seconds of each stage
+    """
+    stop = len(gt) if stop is None else min(stop, len(gt))
+    if fps is None:
+        fps = 25.0
+        if source_kind(video_file_path) == VideoFrameSource.kind:
+            reader = cv.VideoCapture(video_file_path)
+            fps = reader.get(cv.CAP_PROP_FPS) or fps
+            reader.release()
+    decoded, drawn = queue.Queue(queue_size), queue.Queue(queue_size)
+    halt = threading.Event()  # set on error: all stages stop
+    writer_box = {}
+
+    def decode(stage):
+        index = start
+        frames = read_frames(video_file_path, start, stop)
+        try:
+            while True:
+                begin = time.perf_counter()
+                frame = next(frames, None)
+                stage.busy_seconds += time.perf_counter() - begin
+                if frame is None or not _put(decoded, (index, frame), halt):
+                    break
+                index += 1
+        finally:
+            frames.close()  # releases the video file
+        for _ in range(draw_workers):  # one end marker per drawing thread
+            _put(decoded, _END, halt)
+
+    def draw(stage):
+        while True:
+            ok, item = _get(decoded, halt)
+            if not ok or item is _END:
+                _put(drawn, _END, halt)
+                return
+            index, frame = item
+            begin = time.perf_counter()
+            frame = draw_overlay(frame, index, gt[index], flags[index], thickness, scale)
+            stage.busy_seconds += time.perf_counter() - begin
+            if not _put(drawn, (index, frame), halt):
+                return
+
+    def encode(stage):
+        pending, next_index, ends = {}, start, 0  # drawing threads may finish frames out of order
+        while ends < draw_workers:
+            ok, item = _get(drawn, halt)
+            if not ok:
+                return
+            if item is _END:
+                ends += 1
+                continue
+            pending[item[0]] = item[1]
+            while next_index in pending:
+                frame = pending.pop(next_index)
+                begin = time.perf_counter()
+                if "writer" not in writer_box:
+                    h, w = frame.shape[:2]
+                    writer = cv.VideoWriter(out_path, cv.VideoWriter_fourcc(*codec), fps, (w, h))
+                    if not writer.isOpened():
+                        raise RuntimeError("OpenCV can't write {} videos to {}".format(codec, out_path))
+                    writer_box["writer"] = writer
+                writer_box["writer"].write(frame)
+                stage.busy_seconds += time.perf_counter() - begin
+                next_index += 1
+                if progress_callback is not None and (next_index - start) % 100 == 0:
+                    progress_callback(next_index - start, stop - start)
+        writer_box["frames"] = next_index - start
+
+    begin = time.perf_counter()
+    stages = [_Stage("decode", decode)] + [_Stage("draw{}".format(i), draw) for i in range(draw_workers)] + \
+        [_Stage("encode", encode)]
+    for stage in stages:
+        stage.start()
+    try:
+        while any(stage.is_alive() for stage in stages):
+            if any(stage.error is not None for stage in stages):
+                halt.set()
+            stages[-1].join(timeout=0.1)
+    finally:
+        halt.set()  # also stops the stages if the caller is interrupted
+        for stage in stages:
+            stage.join()
+        if "writer" in writer_box:
+            writer_box["writer"].release()
+    for stage in stages:
+        if stage.error is not None:
+            raise stage.error
+    elapsed = time.perf_counter() - begin
+    frames_nbr = writer_box.get("frames", 0)
+    return {"frames": frames_nbr, "seconds": elapsed, "fps": frames_nbr / elapsed if elapsed else 0.0,
+            "busy_seconds": {"decode": stages[0].busy_seconds,
+                             "draw": sum(stage.busy_seconds for stage in stages[1:-1]),
+                             "encode": stages[-1].busy_seconds}}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render QA videos with the annotated horizon burned in.")
+    parser.add_argument("video", help="video file (or other frame source, see FrameSources)")
+    parser.add_argument("--gt", default=None, help="gt file (default: <video name>" + GT_SUFFIX + ")")
+    parser.add_argument("--out", default=None, help="output video (default: <video name>_Overlay.mp4)")
+    parser.add_argument("--start", type=int, default=0, help="first frame")
+    parser.add_argument("--stop", type=int, default=None, help="frame after the last one (default: all)")
+    parser.add_argument("--scale", type=float, default=1.0, help="scale of the output video")
+    parser.add_argument("--thickness", type=int, default=2, help="line thickness, in output pixels")
+    parser.add_argument("--fps", type=float, default=None, help="frame rate of the output video")
+    parser.add_argument("--draw-workers", type=int, default=2, help="number of drawing threads")
+    parser.add_argument("--queue-size", type=int, default=16, help="capacity of the queues between stages")
+    args = parser.parse_args(argv)
+    base = os.path.splitext(args.video.rstrip("/\\"))[0]
+    gt, flags = load_gt_and_flags(args.gt or base + GT_SUFFIX)
+    out_path = args.out or base + "_Overlay.mp4"
+    stats = render_overlay(args.video, gt, flags, out_path, fps=args.fps, start=args.start, stop=args.stop,
+                           thickness=args.thickness, scale=args.scale, draw_workers=args.draw_workers,
+                           queue_size=args.queue_size,
+                           progress_callback=lambda done, total: print("{}/{}".format(done, total), flush=True))
+    busy = stats["busy_seconds"]
+    print("{}: {} frames in {:.1f} s ({:.1f} fps); busy time: decode {:.1f} s, draw {:.1f} s, encode {:.1f} s".format(
+        out_path, stats["frames"], stats["seconds"], stats["fps"], busy["decode"], busy["draw"], busy["encode"]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,186 @@
+"""
+Timing spans of the hot paths of the annotation GUI (decoding, seeking, colour conversion, resizing, rendering and
+event callbacks), kept in memory as latency histograms and exportable as JSON or Chrome trace files (open the latter
+in chrome://tracing or https://ui.perfetto.dev).
+
+Profiling is disabled by default, and then costs a single attribute check per span. It's enabled by setting the
+environment variable HORIZON_PROFILE=1 before starting the GUI, or by showing the profiling HUD (F2 in the GUI).
+
+Usage example:
+    from AnnotationGUI.Profiling import PROFILER, profiled
+    with PROFILER.span("decode"):
+        frame = reader.read()
+
+    @profiled("MainInterface.browse_next")
+    def browse_next(self, event):
+        ...
+"""
+import os
+import json
+import time
+import bisect
+import threading
+import functools
+from collections import deque
+
+# upper edges (in milliseconds) of the latency histogram bins; the last bin has no upper edge
+HISTOGRAM_EDGES_MS = (0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+class _NullSpan:
+    # the span returned while profiling is disabled: entering and exiting it does nothing
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.record(self.name, self.start, time.perf_counter())
+        return False
+
+
+class _Stats:
+    # statistics of one span name
+    def __init__(self, recent_nbr):
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.histogram = [0] * (len(HISTOGRAM_EDGES_MS) + 1)
+        self.recent_ms = deque(maxlen=recent_nbr)  # durations of the last spans, used for percentiles
+
+
+class Profiler:
+    """
+    Collects timing spans. All methods are thread-safe: spans are recorded by the Tkinter thread as well as by the
+    decoding threads.
+    """
+    def __init__(self, enabled=False, recent_nbr=2000, trace_events_nbr=100000):
+        """
+        :param enabled: if False, spans are not recorded
+        :param recent_nbr: number of most recent durations kept per span name to compute percentiles
+        :param trace_events_nbr: number of most recent spans kept for Chrome trace export
+        """
+        self.enabled = enabled
+        self.recent_nbr = recent_nbr
+        self._stats = {}  # {span name: _Stats}
+        self._events = deque(maxlen=trace_events_nbr)  # tuples (name, thread id, start (s), duration (s))
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def span(self, name):
+        """
+        :return: a context manager timing the code it encloses under the name 'name'
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name)
+
+    def record(self, name, start, end):
+        """
+        Records a span of name 'name' from start to end (time.perf_counter() values).
+        """
+        duration_ms = (end - start) * 1000
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = _Stats(self.recent_nbr)
+            stats.count += 1
+            stats.total_ms += duration_ms
+            stats.max_ms = max(stats.max_ms, duration_ms)
+            stats.histogram[bisect.bisect_left(HISTOGRAM_EDGES_MS, duration_ms)] += 1
+            stats.recent_ms.append(duration_ms)
+            self._events.append((name, threading.get_ident(), start, end - start))
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self._events.clear()
+
+    def summary(self):
+        """
+        :return: a dictionary {span name: {"count", "mean_ms", "p50_ms", "p90_ms", "p99_ms", "max_ms", "histogram"}},
+        where percentiles are computed on the most recent spans and histogram is a list of counts per bin of
+        HISTOGRAM_EDGES_MS
+        """
+        with self._lock:
+            items = [(name, stats.count, stats.total_ms, stats.max_ms, list(stats.histogram), sorted(stats.recent_ms))
+                     for name, stats in self._stats.items()]
+        summary = {}
+        for name, count, total_ms, max_ms, histogram, recent in sorted(items):
+            def percentile(p):
+                return recent[min(int(p / 100 * len(recent)), len(recent) - 1)]
+            summary[name] = {"count": count, "mean_ms": total_ms / count, "p50_ms": percentile(50),
+                             "p90_ms": percentile(90), "p99_ms": percentile(99), "max_ms": max_ms,
+                             "histogram": histogram}
+        return summary
+
+    def format_summary(self, names_nbr=12):
+        """
+        :return: a few lines of text summarizing the spans with the largest total time (shown on the HUD)
+        """
+        summary = self.summary()
+        names = sorted(summary, key=lambda name: -summary[name]["mean_ms"] * summary[name]["count"])[:names_nbr]
+        lines = ["{:<34} {:>6} {:>7} {:>7} {:>7}".format("span", "count", "p50 ms", "p90 ms", "max ms")]
+        for name in names:
+            stats = summary[name]
+            lines.append("{:<34} {:>6} {:>7.2f} {:>7.2f} {:>7.1f}".format(
+                name[-34:], stats["count"], stats["p50_ms"], stats["p90_ms"], stats["max_ms"]))
+        return "\n".join(lines)
+
+    def export_json(self, path):
+        """
+        Writes the summary (see self.summary) and the histogram bin edges to a JSON file.
+        """
+        with open(path, "w") as json_file:
+            json.dump({"histogram_edges_ms": HISTOGRAM_EDGES_MS, "spans": self.summary()}, json_file, indent=2)
+
+    def export_chrome_trace(self, path):
+        """
+        Writes the most recent spans as complete events of the Chrome trace event format.
+        """
+        with self._lock:
+            events = list(self._events)
+        pid = os.getpid()
+        trace = [{"name": name, "ph": "X", "pid": pid, "tid": tid, "ts": (start - self._origin) * 1e6,
+                  "dur": duration * 1e6} for name, tid, start, duration in events]
+        with open(path, "w") as trace_file:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, trace_file)
+
+
+PROFILER = Profiler(enabled=os.environ.get("HORIZON_PROFILE") == "1")
+
+
+def profiled(name=None):
+    """
+    A decorator timing each call of the decorated function as a span of PROFILER.
+    :param name: name of the span (default: qualified name of the function)
+    """
+    def decorator(function):
+        span_name = name or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not PROFILER.enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                PROFILER.record(span_name, start, time.perf_counter())
+        return wrapper
+    return decorator
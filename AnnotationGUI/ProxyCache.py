@@ -0,0 +1,234 @@
+import os
+import re
+import shutil
+import threading
+import numpy as np
+import cv2 as cv
+from AnnotationGUI.FrameSources import read_frames
+from AnnotationGUI.Profiling import PROFILER
+
+
+def proxy_size(org_w, org_h, wmax, hmax):
+    """
+    Returns the size (width, height) of the proxy frames of a video with frames of size (org_w, org_h). The proxy
+    frames have the size that CustomWidgetsHelpers.check_img_size gives to frames displayed on the image display.
+    """
+    if org_w >= wmax or org_h >= hmax:
+        scaling_factor = min(wmax / org_w, hmax / org_h)
+        return int(org_w * scaling_factor), int(org_h * scaling_factor)
+    return org_w, org_h
+
+
+# names of the files of a proxy directory (see VideoProxy, MemmapProxyStore and JpegChunkProxyStore)
+PROXY_FILE_PATTERN = re.compile(r"info\.npz(\.tmp)?|frames\.npy|chunk_\d{6}\.npz")
+
+
+def is_proxy_dir(path):
+    """
+    :return: True if 'path' is a directory holding nothing but proxy files (complete or not), i.e., a directory that
+    can be deleted to rebuild the proxy without losing files of the user
+    """
+    if os.path.islink(path) or not os.path.isdir(path):
+        return False
+    return all(PROXY_FILE_PATTERN.fullmatch(name) for name in os.listdir(path))
+
+
+class MemmapProxyStore:
+    """
+    Stores proxy frames in a memory-mapped uint8 array of shape (frames_nbr, h, w, 3), saved as an npy file.
+    """
+    kind = "memmap"
+
+    def __init__(self, proxy_dir, frames_nbr, w, h, create):
+        path = os.path.join(proxy_dir, "frames.npy")
+        if create:
+            self.frames = np.lib.format.open_memmap(path, mode="w+", dtype=np.uint8, shape=(frames_nbr, h, w, 3))
+        else:
+            self.frames = np.load(path, mmap_mode="r")
+
+    def write(self, index, frame):
+        self.frames[index] = frame
+
+    def read(self, index):
+        return self.frames[index]
+
+    def flush(self):
+        self.frames.flush()
+
+
+class JpegChunkProxyStore:
+    """
+    Stores proxy frames as JPEG images, grouped in chunks of chunk_len frames. Each chunk is an npz file holding the
+    concatenated JPEG bytes and their offsets. Used instead of MemmapProxyStore when the disk has no room for raw frames.
+    """
+    kind = "jpeg"
+
+    def __init__(self, proxy_dir, chunk_len=256, quality=90):
+        self.proxy_dir = proxy_dir
+        self.chunk_len = chunk_len
+        self.quality = quality
+        self._pending = []  # JPEG buffers of the chunk being written (not yet saved to disk)
+        self._pending_chunk = 0  # index of the chunk being written
+        self._loaded_chunk = None  # a tuple (chunk index, data, offsets) of the last chunk read from disk
+        self._lock = threading.Lock()
+
+    def _chunk_path(self, chunk):
+        return os.path.join(self.proxy_dir, "chunk_{:06d}.npz".format(chunk))
+
+    def write(self, index, frame):
+        # frames are written sequentially, so a chunk is complete when its last frame is written
+        ok, buf = cv.imencode(".jpg", frame, [cv.IMWRITE_JPEG_QUALITY, self.quality])
+        with self._lock:
+            self._pending.append(buf.ravel())
+            if len(self._pending) == self.chunk_len:
+                self._save_pending()
+
+    def flush(self):
+        with self._lock:
+            if self._pending:
+                self._save_pending()
+
+    def _save_pending(self):
+        # must be called while holding self._lock
+        offsets = np.cumsum([0] + [buf.size for buf in self._pending])
+        with open(self._chunk_path(self._pending_chunk), "wb") as chunk_file:
+            np.savez(chunk_file, data=np.concatenate(self._pending), offsets=offsets)
+        self._pending = []
+        self._pending_chunk += 1
+
+    def read(self, index):
+        chunk, pos = divmod(index, self.chunk_len)
+        with self._lock:
+            if chunk == self._pending_chunk and pos < len(self._pending):
+                buf = self._pending[pos]
+            else:
+                if self._loaded_chunk is None or self._loaded_chunk[0] != chunk:
+                    with np.load(self._chunk_path(chunk)) as data:
+                        self._loaded_chunk = (chunk, data["data"], data["offsets"])
+                _, data, offsets = self._loaded_chunk
+                buf = data[offsets[pos]:offsets[pos + 1]]
+        return cv.imdecode(buf, cv.IMREAD_COLOR)
+
+
+class VideoProxy:
+    """
+    A display-resolution copy of a video, stored in a directory next to the video (<video name>_Proxy). A background
+    thread decodes the video once, sequentially, resizes each frame to the size it would be displayed at, and writes
+    it to a MemmapProxyStore (or to a JpegChunkProxyStore if the disk lacks space for raw frames). Frames already
+    written can be read while the proxy is being built. A complete proxy is reused when the same video is reopened.
+    An outdated or incomplete proxy is deleted before being rebuilt, but a directory with the name of the proxy holding
+    other files is never deleted: the build fails instead (see self.error).
+
+    Proxy frames are smaller than original frames: callers map coordinates to original pixels with org_w and org_h.
+    """
+    def __init__(self, video_file_path, frames_nbr, wmax, hmax):
+        """
+        :param video_file_path: path of the video file (or of another frame source, see FrameSources)
+        :param frames_nbr: number of frames in the video file
+        :param wmax: maximum width of displayed frames
+        :param hmax: maximum height of displayed frames
+        """
+        self.video_file_path = video_file_path
+        self.frames_nbr = frames_nbr
+        self.wmax = wmax
+        self.hmax = hmax
+        self.proxy_dir = os.path.splitext(video_file_path)[0] + "_Proxy"
+        self.info_path = os.path.join(self.proxy_dir, "info.npz")
+        self.org_w = self.org_h = None  # size of original frames
+        self.w = self.h = None  # size of proxy frames
+        self.store = None
+        self.frames_done = 0  # number of frames available in the proxy (frames 0 to self.frames_done - 1)
+        self.complete = False
+        self.finished = False  # True once the build thread has ended (complete, stopped or failed)
+        self.error = None  # the exception that stopped the build (e.g., disk full, unreadable frame), if any
+        self._stopped = False
+        self._thread = None
+        if not self._open_existing():
+            self._thread = threading.Thread(target=self._build, name="VideoProxy", daemon=True)
+            self._thread.start()
+
+    def get_frame(self, index):
+        """
+        :return: a tuple (no_error_flag, frame), where no_error_flag is False if the proxy doesn't hold the frame yet.
+        """
+        if index < self.frames_done:
+            with PROFILER.span("proxy.read"):
+                return True, self.store.read(index)
+        return False, None
+
+    def close(self):
+        """
+        Stops building the proxy (an incomplete proxy is rebuilt from scratch the next time).
+        """
+        self._stopped = True
+        if self._thread is not None:
+            self._thread.join()
+
+    def _video_stat(self):
+        stat = os.stat(self.video_file_path)
+        return stat.st_size, stat.st_mtime
+
+    def _open_existing(self):
+        if not os.path.exists(self.info_path):
+            return False
+        with np.load(self.info_path) as info:
+            if (int(info["file_size"]), float(info["file_mtime"])) != self._video_stat() \
+                    or (int(info["wmax"]), int(info["hmax"])) != (self.wmax, self.hmax):
+                return False
+            self.frames_nbr = int(info["frames_nbr"])
+            self.w, self.h = int(info["w"]), int(info["h"])
+            self.org_w, self.org_h = int(info["org_w"]), int(info["org_h"])
+            kind = str(info["kind"])
+        if kind == MemmapProxyStore.kind:
+            self.store = MemmapProxyStore(self.proxy_dir, self.frames_nbr, self.w, self.h, create=False)
+        else:
+            self.store = JpegChunkProxyStore(self.proxy_dir)
+        self.frames_done = self.frames_nbr
+        self.complete = self.finished = True
+        return True
+
+    def _build(self):
+        frames = read_frames(self.video_file_path, 0, self.frames_nbr)
+        try:
+            self._write_frames(frames)
+        except Exception as error:  # reported by the poller of the GUI (see MainInterface.update_proxy_status)
+            self.error = error
+        finally:
+            frames.close()
+            self.finished = True
+
+    def _write_frames(self, frames):
+        frame = next(frames, None)
+        if frame is None:
+            raise ValueError("can't read the first frame of " + self.video_file_path)
+        self.org_h, self.org_w = frame.shape[0:2]
+        self.w, self.h = proxy_size(self.org_w, self.org_h, self.wmax, self.hmax)
+        if os.path.lexists(self.proxy_dir):
+            if not is_proxy_dir(self.proxy_dir):  # e.g., a directory of the user that happens to have this name
+                raise FileExistsError("{} exists and isn't a proxy directory".format(self.proxy_dir))
+            shutil.rmtree(self.proxy_dir)
+        os.makedirs(self.proxy_dir)
+        raw_bytes = self.frames_nbr * self.w * self.h * 3
+        if shutil.disk_usage(self.proxy_dir).free > 1.1 * raw_bytes:
+            self.store = MemmapProxyStore(self.proxy_dir, self.frames_nbr, self.w, self.h, create=True)
+        else:
+            self.store = JpegChunkProxyStore(self.proxy_dir)
+        index = 0
+        while frame is not None and index < self.frames_nbr and not self._stopped:
+            if (self.w, self.h) != (self.org_w, self.org_h):
+                frame = cv.resize(frame, (self.w, self.h), interpolation=cv.INTER_AREA)
+            self.store.write(index, frame)
+            index += 1
+            self.frames_done = index
+            frame = next(frames, None)
+        self.store.flush()
+        if not self._stopped:
+            self.frames_nbr = self.frames_done
+            self.complete = True
+            file_size, file_mtime = self._video_stat()
+            # the info file marks the proxy as complete: write it atomically, a torn one can't be reopened
+            with open(self.info_path + ".tmp", "wb") as info_file:
+                np.savez(info_file, frames_nbr=self.frames_nbr, w=self.w, h=self.h, org_w=self.org_w,
+                         org_h=self.org_h, kind=self.store.kind, wmax=self.wmax, hmax=self.hmax,
+                         file_size=file_size, file_mtime=file_mtime)
+            os.replace(self.info_path + ".tmp", self.info_path)
@@ -0,0 +1,222 @@
+import os
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import cv2 as cv
+from AnnotationGUI.FrameSources import read_frames, open_frame_source, source_kind, VideoFrameSource
+from AnnotationGUI.SeekIndex import get_seek_index
+
+PROFILE_ROWS = 256  # number of rows of the row profile of a frame
+PROFILE_COLUMNS = 32  # width of the downscaled frame averaged into the row profile
+
+
+def frame_signature(frame, profile_rows=PROFILE_ROWS):
+    """
+    Computes a cheap signature of a frame, on a downscaled grayscale version of it:
+        * the row profile: mean intensity of each of profile_rows bands of rows. A horizon moving up or down (or tilting)
+          shifts the sea/sky transition of the profile,
+        * a difference hash (dHash) of a 9x8 thumbnail: 64 bits telling whether each pixel is brighter than its left
+          neighbour. Hashes of different scenes are far apart (in Hamming distance), whatever the horizon.
+    :param frame: a BGR or grayscale frame
+    :return: a tuple (profile, dhash): a float32 array of shape (profile_rows,) and a 64-bit integer
+    """
+    gray = frame if frame.ndim == 2 else cv.cvtColor(frame, cv.COLOR_BGR2GRAY)
+    small = cv.resize(gray, (PROFILE_COLUMNS, profile_rows), interpolation=cv.INTER_AREA)
+    profile = small.mean(axis=1, dtype=np.float32)
+    thumbnail = cv.resize(small, (9, 8), interpolation=cv.INTER_AREA)
+    bits = np.packbits(thumbnail[:, 1:] > thumbnail[:, :-1])
+    return profile, int.from_bytes(bits.tobytes(), "big")
+
+
+def signatures_path(video_file_path):
+    """
+    :return: path of the file caching the frame signatures of the video file video_file_path (next to the video)
+    """
+    return os.path.splitext(video_file_path)[0] + "_Signatures.npz"
+
+
+def load_signatures(video_file_path):
+    """
+    :return: the cached signatures (a tuple (profiles, hashes), see compute_signatures) of the video file, or None if
+    there are none or if they're older than the video file.
+    """
+    path = signatures_path(video_file_path)
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(video_file_path):
+        with np.load(path) as signatures:
+            return signatures["profiles"], signatures["hashes"]
+    return None
+
+
+def _signature_chunk(video_file_path, start, stop, keyframe, profile_rows):
+    """
+    Computes the signatures of the frames start to stop - 1, decoded sequentially. Runs in a worker process.
+    :return: a tuple (start, profiles, hashes); rows of frames that couldn't be decoded are np.nan (hash 0)
+    """
+    profiles = np.full((stop - start, profile_rows), np.nan, dtype=np.float32)
+    hashes = np.zeros(stop - start, dtype=np.uint64)
+    for i, frame in enumerate(read_frames(video_file_path, start, stop, keyframe=keyframe)):
+        profiles[i], hashes[i] = frame_signature(frame, profile_rows)
+    return start, profiles, hashes
+
+
+def compute_signatures(video_file_path, frames_nbr, seek_index=None, workers=None, chunk_len=500,
+                       profile_rows=PROFILE_ROWS, progress_callback=None):
+    """
+    Computes the signatures of all frames of a video, streaming through chunks of consecutive frames in a pool of
+    processes, and caches them next to the video (see signatures_path). Worker processes are spawned, not forked, since
+    this runs in a thread of the GUI (see HorizonDetector.propose_video).
+    :param video_file_path: path of the video file (or of another frame source, see FrameSources)
+    :param frames_nbr: number of frames in the video
+    :param seek_index: a SeekIndex of the video, used to start each chunk on an exact frame
+    :param workers: number of worker processes (default: number of CPUs)
+    :param chunk_len: number of frames per chunk
+    :param profile_rows: number of rows of the row profiles
+    :param progress_callback: a function called as progress_callback(frames_done, frames_nbr) after each chunk
+    :return: a tuple (profiles, hashes): a float32 array of shape (frames_nbr, profile_rows) and a uint64 array of shape
+    (frames_nbr,)
+    """
+    profiles = np.full((frames_nbr, profile_rows), np.nan, dtype=np.float32)
+    hashes = np.zeros(frames_nbr, dtype=np.uint64)
+    frames_done = 0
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = []
+        for start in range(0, frames_nbr, chunk_len):
+            keyframe = None if seek_index is None else seek_index.keyframe_before(start)
+            futures.append(pool.submit(_signature_chunk, video_file_path, start, min(start + chunk_len, frames_nbr),
+                                       keyframe, profile_rows))
+        for future in as_completed(futures):
+            start, chunk_profiles, chunk_hashes = future.result()
+            profiles[start:start + len(chunk_profiles)] = chunk_profiles
+            hashes[start:start + len(chunk_hashes)] = chunk_hashes
+            frames_done += len(chunk_profiles)
+            if progress_callback is not None:
+                progress_callback(frames_done, frames_nbr)
+    try:
+        save_signatures(video_file_path, profiles, hashes)
+    except OSError:  # a cache file that can't be written (e.g., read-only directory) is not an error
+        pass
+    return profiles, hashes
+
+
+def save_signatures(video_file_path, profiles, hashes):
+    """
+    Writes the signatures cache of a video, replacing it atomically: a torn npz file can't be left by a crash.
+    """
+    path = signatures_path(video_file_path)
+    # np.savez appends '.npz' to paths not ending with it; open the file ourselves to keep the exact name
+    with open(path + ".tmp", "wb") as signatures_file:
+        np.savez(signatures_file, profiles=profiles, hashes=hashes)
+    os.replace(path + ".tmp", path)
+
+
+def hamming_distances(hashes, reference):
+    """
+    :return: the number of differing bits between each 64-bit hash of the array 'hashes' and the hash 'reference'
+    """
+    xor = np.bitwise_xor(hashes.astype(np.uint64), np.uint64(reference))
+    return np.unpackbits(xor.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+def segment_static(profiles, hashes, max_profile_change=4.0, max_hash_distance=10):
+    """
+    Splits a video into static segments: runs of consecutive frames similar to the first frame of their run (the
+    anchor). Comparing to the anchor rather than to the previous frame catches slow drifts of the horizon. A frame
+    differs from the anchor if its row profile differs by more than max_profile_change gray levels on some row, or if
+    its hash differs by more than max_hash_distance bits. Frames that couldn't be decoded are segments of their own.
+    Frames are compared to the anchor in blocks (of doubling length), so that long static segments cost a few
+    vectorized comparisons.
+    :param profiles: an array of shape (frames_nbr, profile_rows) of row profiles (see compute_signatures)
+    :param hashes: an array of shape (frames_nbr,) of hashes
+    :param max_profile_change: maximum difference (in gray levels) between rows of the profiles of the same segment
+    :param max_hash_distance: maximum Hamming distance between hashes of the same segment
+    :return: a StaticSegments object
+    """
+    frames_nbr = len(profiles)
+    starts = []
+    anchor = 0
+    while anchor < frames_nbr:
+        starts.append(anchor)
+        stop, block = anchor + 1, 16
+        while stop < frames_nbr:
+            end = min(stop + block, frames_nbr)
+            change = np.abs(profiles[stop:end] - profiles[anchor]).max(axis=1)
+            similar = (change <= max_profile_change) & \
+                (hamming_distances(hashes[stop:end], hashes[anchor]) <= max_hash_distance)  # False for np.nan
+            different = np.flatnonzero(~similar)
+            if different.size:
+                stop += int(different[0])
+                break
+            stop, block = end, block * 2
+        anchor = stop
+    return StaticSegments(starts, frames_nbr)
+
+
+class StaticSegments:
+    """
+    A partition of the frames of a video into static segments (see segment_static), given by the index of the first
+    frame of each segment.
+    """
+    def __init__(self, starts, frames_nbr):
+        self.starts = np.asarray(starts, dtype=np.int64)  # sorted, starts[0] == 0
+        self.frames_nbr = int(frames_nbr)
+
+    def __len__(self):
+        return self.starts.size
+
+    def segment_of(self, index):
+        """
+        :return: a tuple (start, stop) of the segment holding the frame 'index' (frames start to stop - 1)
+        """
+        k = int(np.searchsorted(self.starts, index, side='right')) - 1
+        stop = int(self.starts[k + 1]) if k + 1 < self.starts.size else self.frames_nbr
+        return int(self.starts[k]), stop
+
+    def next_boundary(self, index):
+        """
+        :return: the first frame of the segment following the frame 'index', or None if it's in the last segment
+        """
+        k = int(np.searchsorted(self.starts, index, side='right'))
+        return int(self.starts[k]) if k < self.starts.size else None
+
+    def previous_boundary(self, index):
+        """
+        :return: the first frame of the segment holding the frame 'index', or of the previous segment if 'index' is
+        already the first frame of its segment (None before the first segment)
+        """
+        k = int(np.searchsorted(self.starts, index, side='left')) - 1
+        return int(self.starts[k]) if k >= 0 else None
+
+    def lengths(self):
+        """
+        :return: an array of the number of frames of each segment
+        """
+        return np.diff(np.append(self.starts, self.frames_nbr))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Static-segment detection of videos.")
+    parser.add_argument("videos", nargs="+", help="video files (or other frame sources) to segment")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--max-profile-change", type=float, default=4.0, help="in gray levels")
+    parser.add_argument("--max-hash-distance", type=int, default=10, help="in bits (out of 64)")
+    args = parser.parse_args()
+    for video in args.videos:
+        seek_index, fps = None, 0
+        if source_kind(video) == VideoFrameSource.kind:
+            seek_index = get_seek_index(video)
+            reader = cv.VideoCapture(video)
+            fps = reader.get(cv.CAP_PROP_FPS)
+            reader.release()
+        source = open_frame_source(video, seek_index=seek_index)
+        frames_nbr = source.frames_nbr
+        source.close()
+        start = time.perf_counter()
+        profiles, hashes = compute_signatures(video, frames_nbr, seek_index=seek_index, workers=args.workers)
+        elapsed = time.perf_counter() - start
+        segments = segment_static(profiles, hashes, args.max_profile_change, args.max_hash_distance)
+        print("{}: {} frames in {:.1f} s ({:.0f} fps{}), {} segments, longest {} frames".format(
+            video, frames_nbr, elapsed, frames_nbr / elapsed,
+            ", {:.1f}x real time".format(frames_nbr / elapsed / fps) if fps else "",
+            len(segments), int(segments.lengths().max())))
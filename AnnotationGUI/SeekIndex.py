@@ -0,0 +1,129 @@
+import os
+import numpy as np
+import cv2 as cv
+
+
+class SeekIndex:
+    """
+    Keyframe positions and exact number of frames of a video file, obtained with a single indexing pass over the
+    video's packets. The index is stored in a sidecar file next to the video (<video name>_SeekIndex.npz), so that
+    reopening the same video doesn't scan it again.
+
+    cv.CAP_PROP_FRAME_COUNT is estimated from the container's metadata and may be wrong, and cv.CAP_PROP_POS_FRAMES
+    silently decodes from the previous keyframe (landing on the wrong frame for some codecs). Knowing the keyframes
+    allows seeking exactly to a keyframe, then decoding forward only the frames separating it from the target frame.
+    """
+    def __init__(self, video_file_path, frames_nbr, keyframes, file_size, file_mtime):
+        """
+        :param video_file_path: path of the indexed video file
+        :param frames_nbr: true number of frames in the video file
+        :param keyframes: sorted numpy array of the indexes of keyframes, or None if keyframes couldn't be identified
+        :param file_size: size in bytes of the video file when it was indexed
+        :param file_mtime: modification time of the video file when it was indexed
+        """
+        self.video_file_path = video_file_path
+        self.frames_nbr = int(frames_nbr)
+        self.keyframes = None if keyframes is None else np.asarray(keyframes, dtype=np.int64)
+        self.file_size = int(file_size)
+        self.file_mtime = float(file_mtime)
+
+    @staticmethod
+    def sidecar_path(video_file_path):
+        """
+        :return: path of the sidecar file holding the index of the video file video_file_path
+        """
+        return os.path.splitext(video_file_path)[0] + "_SeekIndex.npz"
+
+    @classmethod
+    def build(cls, video_file_path, progress_callback=None, should_stop=None):
+        """
+        Scans the video file once to count its frames and locate its keyframes. When the backend supports it, packets
+        are grabbed without being decoded (cv.CAP_PROP_FORMAT = -1), which makes the scan much faster than decoding.
+        :param video_file_path: path of the video file to index
+        :param progress_callback: a function called as progress_callback(frames_scanned) every 500 frames
+        :param should_stop: a function returning True if the scan must be canceled (checked every 500 frames)
+        :return: a SeekIndex object, or None if the scan was canceled
+        """
+        stat = os.stat(video_file_path)
+        reader = cv.VideoCapture(video_file_path)
+        raw_mode = hasattr(cv, "CAP_PROP_LRF_HAS_KEY_FRAME") and reader.set(cv.CAP_PROP_FORMAT, -1)
+        frames_nbr = 0
+        keyframes = []
+        while reader.grab():
+            if raw_mode and reader.get(cv.CAP_PROP_LRF_HAS_KEY_FRAME):
+                keyframes.append(frames_nbr)
+            frames_nbr += 1
+            if frames_nbr % 500 == 0:
+                if progress_callback is not None:
+                    progress_callback(frames_nbr)
+                if should_stop is not None and should_stop():
+                    reader.release()
+                    return None
+        reader.release()
+        if not keyframes:  # keyframes couldn't be identified (no raw mode or no keyframe flag from the backend)
+            keyframes = None
+        return cls(video_file_path, frames_nbr, keyframes, stat.st_size, stat.st_mtime)
+
+    @classmethod
+    def load(cls, video_file_path):
+        """
+        Loads the sidecar index of the video file video_file_path.
+        :return: a SeekIndex object, or None if there is no sidecar file or if the video changed since it was indexed.
+        """
+        path = cls.sidecar_path(video_file_path)
+        if not os.path.exists(path):
+            return None
+        stat = os.stat(video_file_path)
+        with np.load(path) as data:
+            if int(data["file_size"]) != stat.st_size or float(data["file_mtime"]) != stat.st_mtime:
+                return None
+            keyframes = data["keyframes"] if bool(data["has_keyframes"]) else None
+            return cls(video_file_path, int(data["frames_nbr"]), keyframes, stat.st_size, stat.st_mtime)
+
+    def save(self):
+        """
+        Writes the index to its sidecar file next to the video file. The file is replaced atomically, so that a crash
+        while saving never leaves a truncated sidecar file.
+        """
+        has_keyframes = self.keyframes is not None
+        keyframes = self.keyframes if has_keyframes else np.zeros(0, dtype=np.int64)
+        path = self.sidecar_path(self.video_file_path)
+        # np.savez appends '.npz' to paths not ending with it; open the file ourselves to keep the exact name
+        with open(path + ".tmp", "wb") as sidecar:
+            np.savez(sidecar, frames_nbr=self.frames_nbr, keyframes=keyframes, has_keyframes=has_keyframes,
+                     file_size=self.file_size, file_mtime=self.file_mtime)
+        os.replace(path + ".tmp", path)
+
+    def keyframe_before(self, index):
+        """
+        :return: index of the last keyframe at or before the frame with index 'index', or None if keyframes are unknown
+        """
+        if self.keyframes is None:
+            return None
+        pos = np.searchsorted(self.keyframes, index, side="right") - 1
+        return int(self.keyframes[max(pos, 0)])
+
+
+def get_seek_index(video_file_path, progress_callback=None, should_stop=None):
+    """
+    Returns the seek index of the video file video_file_path, loading it from its sidecar file if it's up to date, or
+    building it (and writing the sidecar file) otherwise. A sidecar file that can't be written (e.g., read-only
+    directory) is not an error: the index is then rebuilt the next time the video is opened, as is an index whose
+    sidecar file can't be read.
+    :param progress_callback: see SeekIndex.build
+    :param should_stop: see SeekIndex.build
+    :return: a SeekIndex object, or None if building it was canceled
+    """
+    try:
+        seek_index = SeekIndex.load(video_file_path)
+    except Exception:  # a corrupt sidecar file (e.g., zipfile.BadZipFile) is rebuilt
+        seek_index = None
+    if seek_index is None:
+        seek_index = SeekIndex.build(video_file_path, progress_callback, should_stop)
+        if seek_index is None:
+            return None
+        try:
+            seek_index.save()
+        except OSError:
+            pass
+    return seek_index
@@ -0,0 +1,120 @@
+"""
+Start-up of the annotation GUI: the window appears before the heavy modules are loaded.
+
+Importing numpy, OpenCV and Pillow (and the modules of the GUI importing them) takes most of the start-up time. This
+module only imports the standard library and tkinter: the window is shown with a loading message right away, the
+heavy modules are imported on a background thread (the thread never touches Tk), and the interface is built in the
+window once they're loaded, before a video can be opened.
+Importing this module must stay cheap: StartupBenchmark checks that it loads none of HEAVY_MODULES.
+
+    python -m AnnotationGUI.Startup [video] [--report]
+"""
+import sys
+import time
+import json
+import argparse
+import importlib
+import threading
+import tkinter as tk
+
+HEAVY_MODULES = ("numpy", "cv2", "PIL.Image", "PIL.ImageTk")
+INTERFACE_MODULE = "AnnotationGUI.MainInterface"
+
+
+class BackgroundImporter(threading.Thread):
+    """
+    Imports modules on a background thread, in order. The Tkinter thread polls self.done (see start_gui): modules are
+    then available in sys.modules, or self.error is the exception raised by the import.
+    """
+    def __init__(self, module_names):
+        super().__init__(name="BackgroundImporter", daemon=True)
+        self.module_names = module_names
+        self.seconds = {}  # import time of each module (modules imported by a previous one take ~0 s)
+        self.error = None
+        self.done = False
+
+    def run(self):
+        try:
+            for name in self.module_names:
+                begin = time.perf_counter()
+                importlib.import_module(name)
+                self.seconds[name] = time.perf_counter() - begin
+        except BaseException as error:  # raised again by the Tkinter thread
+            self.error = error
+        finally:
+            self.done = True
+
+
+def start_gui(root, on_ready=None):
+    """
+    Shows a loading message in 'root', imports the heavy modules and the interface on a background thread, then builds
+    the interface (MainInterface) in root.
+    :param root: the Tk root window
+    :param on_ready: a function called as on_ready(app) once the interface is built
+    :return: the BackgroundImporter
+    """
+    loading_label = tk.Label(root, text="Loading Horizon Annotator...", font=("Helvetica", 14), padx=40, pady=40)
+    loading_label.grid(row=0, column=0)
+    importer = BackgroundImporter(HEAVY_MODULES + (INTERFACE_MODULE,))
+    importer.start()
+
+    def build_when_imported():
+        if not importer.done:
+            root.after(20, build_when_imported)
+            return
+        loading_label.destroy()
+        if importer.error is not None:
+            raise importer.error
+        app = sys.modules[INTERFACE_MODULE].MainInterface(master=root)
+        app.grid(row=0, column=0)
+        if on_ready is not None:
+            on_ready(app)
+
+    root.after(20, build_when_imported)
+    return importer
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Start the annotation GUI (and optionally time its start-up).")
+    parser.add_argument("video", nargs="?", default=None, help="a video to open once the interface is built")
+    parser.add_argument("--report", action="store_true",
+                        help="print the start-up timings as JSON (wall-clock times, see StartupBenchmark) and exit "
+                             "once the interface is ready, or once the first frame of the video is shown")
+    args = parser.parse_args(argv)
+    events = {}  # wall-clock time (time.time()) of each start-up event, to be compared with the process start time
+    root = tk.Tk()
+    root.title("Horizon Annotator")
+
+    def record(event_name):
+        if event_name not in events:
+            events[event_name] = time.time()
+
+    def report_and_quit():
+        print(json.dumps({"events": events, "imports_ms": {name: 1000 * seconds for name, seconds in
+                                                           importer.seconds.items()}}), flush=True)
+        root.destroy()
+
+    def wait_first_frame(app):
+        if app.opening_first_frame_shown or app.opener is None:
+            record("first_frame")
+            report_and_quit()
+        else:
+            root.after(5, wait_first_frame, app)
+
+    def ready(app):
+        record("ready")
+        if args.video is not None:
+            app.open_video(args.video)
+            if args.report:
+                wait_first_frame(app)
+        elif args.report:
+            report_and_quit()
+
+    root.bind("<Map>", lambda event: record("window") if event.widget is root else None)
+    importer = start_gui(root, on_ready=ready)
+    root.mainloop()
+    return 0 if importer.error is None else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,154 @@
+"""
+Cold start-up benchmark of the annotation GUI, with budgets to catch regressions of the import-time cost.
+
+Each measurement runs in a fresh Python process (modules already imported by this process don't count):
+    * the import time of AnnotationGUI.Startup, which must stay cheap (the window is shown right after it), and the
+      list of heavy modules (see Startup.HEAVY_MODULES) it loads, which must be empty,
+    * the import time of the heavy modules and of MainInterface,
+    * the time to window, to ready (interface built) and to first frame of a video, from the process start, through
+      "python -m AnnotationGUI.Startup video --report" (needs a display, see GuiBenchmark; skipped otherwise).
+Each measurement is the median of --runs processes. Measurements above their budget (DEFAULT_BUDGETS, overridden
+by --budgets) are reported and make the benchmark exit with status 1, so that it can run as a check. The pre-window
+import is also checked by tests/test_startup.py (python -m pytest tests): it must load no heavy module, and its budget
+is checked if the environment variable HORIZON_CHECK_STARTUP_BUDGET is set.
+
+    python -m AnnotationGUI.StartupBenchmark --runs 5 --out startup.json --budgets startup_budgets.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import statistics
+import subprocess
+from AnnotationGUI.Startup import HEAVY_MODULES, INTERFACE_MODULE
+
+# budgets in ms; they're generous for a lab machine, the pre-window import being the one that matters
+DEFAULT_BUDGETS = {"import_startup_ms": 150, "import_interface_ms": 2500, "window_ms": 1000, "ready_ms": 4000,
+                   "first_frame_ms": 5000}
+_IMPORT_SCRIPT = """
+import sys, time, json
+begin = time.perf_counter()
+import {module}
+print(json.dumps({{"ms": 1000 * (time.perf_counter() - begin), "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def _run_json(command, timeout=120):
+    """
+    Runs a command in a fresh process (from the directory containing the AnnotationGUI package).
+    :return: a tuple (the JSON object printed on the last line of its output or None, start time (time.time()) of the
+    process, last line of its error output)
+    """
+    root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    spawn_time = time.time()
+    completed = subprocess.run(command, cwd=root_dir, capture_output=True, text=True, timeout=timeout)
+    lines = completed.stdout.strip().splitlines()
+    error_lines = completed.stderr.strip().splitlines()
+    try:
+        result = json.loads(lines[-1]) if completed.returncode == 0 and lines else None
+    except ValueError:
+        result = None
+    return result, spawn_time, error_lines[-1] if error_lines else ""
+
+
+def measure_import(module, runs):
+    """
+    :return: a tuple (median import time of 'module' in ms, heavy modules loaded by it)
+    """
+    times, heavy = [], []
+    for _ in range(runs):
+        result, _, error = _run_json([sys.executable, "-c", _IMPORT_SCRIPT.format(module=module,
+                                                                                  heavy=HEAVY_MODULES)])
+        if result is None:
+            raise RuntimeError("can't import {}: {}".format(module, error))
+        times.append(result["ms"])
+        heavy = result["heavy"]
+    return statistics.median(times), heavy
+
+
+def measure_gui(video_path, runs):
+    """
+    :return: a dictionary of the median window_ms, ready_ms and first_frame_ms (from the process start), or a tuple
+    (None, reason) if the GUI can't start (no display)
+    """
+    events = {"window": [], "ready": [], "first_frame": []}
+    for _ in range(runs):
+        command = [sys.executable, "-m", "AnnotationGUI.Startup", "--report"] + ([video_path] if video_path else [])
+        result, spawn_time, error = _run_json(command)
+        if result is None:
+            return None, error
+        for name in events:
+            if name in result["events"]:
+                events[name].append(1000 * (result["events"][name] - spawn_time))
+    return {name + "_ms": statistics.median(times) for name, times in events.items() if times}, None
+
+
+def check_budgets(results, budgets):
+    """
+    :return: a list of lines describing the measurements of 'results' above their budget
+    """
+    lines = ["AnnotationGUI.Startup loads heavy modules before the window is shown: " +
+             ", ".join(results["heavy_before_window"])] if results["heavy_before_window"] else []
+    for name, budget in budgets.items():
+        value = results["measurements"].get(name)
+        if value is not None and value > budget:
+            lines.append("{}: {:.1f} ms > {:.1f} ms".format(name, value, budget))
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the cold start-up of the GUI and check its budgets.")
+    parser.add_argument("--runs", type=int, default=5, help="number of processes per measurement (median)")
+    parser.add_argument("--video", default=None, help="video to open (default: a synthetic 720p video)")
+    parser.add_argument("--no-gui", action="store_true", help="only measure import times")
+    parser.add_argument("--out", default=None, help="JSON file the results are written to")
+    parser.add_argument("--budgets", default=None, help="JSON file of budgets in ms, overriding DEFAULT_BUDGETS")
+    args = parser.parse_args(argv)
+    budgets = dict(DEFAULT_BUDGETS)
+    if args.budgets:
+        with open(args.budgets) as budgets_file:
+            budgets.update(json.load(budgets_file))
+
+    measurements = {}
+    measurements["import_startup_ms"], heavy_before_window = measure_import("AnnotationGUI.Startup", args.runs)
+    for module in HEAVY_MODULES + (INTERFACE_MODULE,):
+        key = "import_interface_ms" if module == INTERFACE_MODULE else "import_{}_ms".format(module)
+        measurements[key] = measure_import(module, args.runs)[0]
+    gui_note = "skipped (--no-gui)"
+    if not args.no_gui:
+        work_dir = tempfile.mkdtemp(prefix="horizon_startup_")
+        try:
+            video_path = args.video
+            if video_path is None:
+                from AnnotationGUI.GuiBenchmark import make_synthetic_video, RESOLUTIONS
+                video_path = os.path.join(work_dir, "startup.mp4")
+                make_synthetic_video(video_path, RESOLUTIONS["720p"], 60, "mp4v")
+            gui_measurements, error = measure_gui(video_path, args.runs)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        if gui_measurements is None:
+            gui_note = "skipped (the GUI can't start: {})".format(error)
+        else:
+            gui_note = "measured"
+            measurements.update(gui_measurements)
+    results = {"runs": args.runs, "heavy_before_window": heavy_before_window, "gui": gui_note,
+               "measurements": measurements, "budgets": budgets}
+
+    for name, value in measurements.items():
+        print("{:>24}: {:8.1f} ms{}".format(name, value, "  (budget {} ms)".format(budgets[name])
+                                            if name in budgets else ""))
+    print("GUI start-up: " + gui_note)
+    if args.out:
+        with open(args.out, "w") as out_file:
+            json.dump(results, out_file, indent=2)
+    violations = check_budgets(results, budgets)
+    for line in violations:
+        print("over budget: " + line)
+    return 1 if violations else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,124 @@
+import math
+import time
+import argparse
+import numpy as np
+import cv2 as cv
+
+TILE_SIZE = 256  # width and height of a tile, in displayed pixels
+
+
+class TilePyramid:
+    """
+    A tile pyramid of one image, to show a zoomed view of it: level k is the image downscaled k times by two (levels
+    are built lazily, the first time a zoom needs them, and kept). The zoomed image (the "virtual" image, of size
+    virtual_size) is cut into tiles of TILE_SIZE x TILE_SIZE displayed pixels; a tile is resampled from the finest level
+    that isn't smaller than it, so that the cost of a tile doesn't depend on the resolution of the image, and only the
+    tiles of the visible part of the virtual image have to be resampled.
+
+    Tiles are exact: the centre of displayed pixel (u, v) of the virtual image is the point ((u + 0.5) / sx,
+    (v + 0.5) / sy) of the image (in pixel-edge coordinates), where (sx, sy) is the scale of the virtual image, as in
+    CustomWidgetsHelpers.rescale_to_org_xy. Tiles are seamless, since they're resampled independently with the same
+    mapping.
+    """
+    def __init__(self, image, tile_size=TILE_SIZE, bgr2rgb=True):
+        """
+        :param image: a BGR (or RGB, see bgr2rgb) or grayscale image, as a numpy array
+        :param tile_size: width and height of a tile, in displayed pixels
+        :param bgr2rgb: if True and image has colours, tiles are converted from BGR to RGB
+        """
+        self.h, self.w = image.shape[0:2]
+        self.tile_size = tile_size
+        self.bgr2rgb = bgr2rgb and image.ndim == 3
+        self._levels = [image]
+
+    def level(self, k):
+        """
+        :return: the level k of the pyramid (the image downscaled k times by two), built from the previous level if it
+        doesn't exist yet. Levels stop at one pixel: a larger k returns the last level.
+        """
+        while len(self._levels) <= k:
+            previous = self._levels[-1]
+            h, w = previous.shape[0:2]
+            if w == 1 and h == 1:
+                break
+            self._levels.append(cv.resize(previous, ((w + 1) // 2, (h + 1) // 2), interpolation=cv.INTER_AREA))
+        return self._levels[min(k, len(self._levels) - 1)]
+
+    def levels_built(self):
+        return len(self._levels)
+
+    @staticmethod
+    def level_for(scale):
+        """
+        :return: index of the finest level whose resolution is at least 'scale' times that of the image (the level to
+        resample from to display the image at that scale)
+        """
+        return max(0, int(math.floor(math.log2(1 / scale)))) if scale < 1 else 0
+
+    def tile(self, virtual_size, tx, ty):
+        """
+        Resamples a tile of the virtual image.
+        :param virtual_size: a tuple (width, height) of the virtual image (the image at the displayed scale)
+        :param tx: column of the tile
+        :param ty: row of the tile
+        :return: the tile, a uint8 array of at most tile_size x tile_size pixels (tiles on the right and bottom edges of
+        the virtual image are cropped to it)
+        """
+        virtual_w, virtual_h = virtual_size
+        x0, y0 = tx * self.tile_size, ty * self.tile_size
+        tile_w, tile_h = min(self.tile_size, virtual_w - x0), min(self.tile_size, virtual_h - y0)
+        sx, sy = virtual_w / self.w, virtual_h / self.h
+        level = self.level(self.level_for(min(sx, sy)))
+        lx, ly = level.shape[1] / self.w, level.shape[0] / self.h  # scale of the level (not exactly a power of 1/2)
+        # maps the displayed pixel (u, v) of the tile to the level: pixel centres of the virtual image to the image (in
+        # pixel-edge coordinates), then to the level (in pixel-centre coordinates)
+        mapping = np.array([[lx / sx, 0, (x0 + 0.5) * lx / sx - 0.5],
+                            [0, ly / sy, (y0 + 0.5) * ly / sy - 0.5]])
+        # beyond 2 displayed pixels per image pixel, pixels are shown as blocks: edges are where they are in the image
+        interpolation = cv.INTER_NEAREST if min(sx, sy) >= 2 else cv.INTER_LINEAR
+        tile = cv.warpAffine(level, mapping, (tile_w, tile_h), flags=interpolation | cv.WARP_INVERSE_MAP,
+                             borderMode=cv.BORDER_REPLICATE)
+        if self.bgr2rgb:
+            tile = cv.cvtColor(tile, cv.COLOR_BGR2RGB)
+        return tile
+
+    def visible_tiles(self, virtual_size, view):
+        """
+        :param virtual_size: a tuple (width, height) of the virtual image
+        :param view: a tuple (x, y, width, height) of the visible part of the virtual image, in displayed pixels
+        :return: the list of (tx, ty) of the tiles intersecting the view
+        """
+        x, y, w, h = view
+        last_tx = min(x + w - 1, virtual_size[0] - 1) // self.tile_size
+        last_ty = min(y + h - 1, virtual_size[1] - 1) // self.tile_size
+        return [(tx, ty) for ty in range(max(y, 0) // self.tile_size, last_ty + 1)
+                for tx in range(max(x, 0) // self.tile_size, last_tx + 1)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Times zooming and panning a tile pyramid (no display needed).")
+    parser.add_argument("--size", default="3840x2160", help="image size WxH")
+    parser.add_argument("--view", default="1280x720", help="size WxH of the displayed image at zoom 1")
+    args = parser.parse_args()
+    w, h = (int(v) for v in args.size.lower().split("x"))
+    view_w, view_h = (int(v) for v in args.view.lower().split("x"))
+    fit = min(view_w / w, view_h / h)
+    image = np.random.default_rng(0).integers(0, 256, size=(h, w, 3), dtype=np.uint8)
+    for zoom in (1.25, 2, 4, 8, 16):
+        pyramid = TilePyramid(image)
+        virtual_size = (round(w * fit * zoom), round(h * fit * zoom))
+        view = ((virtual_size[0] - view_w) // 2, (virtual_size[1] - view_h) // 2, view_w, view_h)
+        start = time.perf_counter()
+        tiles = pyramid.visible_tiles(virtual_size, view)
+        for tx, ty in tiles:
+            pyramid.tile(virtual_size, tx, ty)
+        first = time.perf_counter() - start
+        # a pan by a quarter of the view: only newly visible tiles are resampled
+        panned = set(pyramid.visible_tiles(virtual_size, (view[0] + view_w // 4, view[1], view_w, view_h))) - set(tiles)
+        start = time.perf_counter()
+        for tx, ty in panned:
+            pyramid.tile(virtual_size, tx, ty)
+        pan = time.perf_counter() - start
+        print("zoom {:>5}: level {}, {} tiles in {:.1f} ms (with {} levels built); pan: {} tiles in {:.1f} ms".format(
+            zoom, pyramid.level_for(fit * zoom), len(tiles), first * 1000, pyramid.levels_built(),
+            len(panned), pan * 1000))
@@ -0,0 +1,164 @@
+import os
+import threading
+import numpy as np
+import cv2 as cv
+from AnnotationGUI.FrameSources import open_frame_source, source_kind, VideoFrameSource
+from AnnotationGUI.SeekIndex import get_seek_index
+from AnnotationGUI.AutosaveJournal import AnnotationJournal
+from AnnotationGUI import HorizonDetector
+from AnnotationGUI import SceneSegmentation
+from AnnotationGUI.Consensus import DisputedFrames, disputed_path, DISPUTED_SUFFIX
+
+
+class VideoOpener:
+    """
+    Opens a frame source (see FrameSources) in background threads, so that the Tkinter thread never waits for the file
+    (large videos on network shares). Two threads run in parallel:
+        * the source thread reads the metadata and the first frame of the video, then indexes it (see SeekIndex: the
+          true frame count needs a scan of the whole file the first time a video is opened), then opens the frame
+          source,
+        * the annotations thread reads the files stored next to the video: autosave (see AnnotationJournal), a saved
+          gt file, horizon proposals, frame signatures (and splits the video into static segments) and the disputed
+          frames of a consensus annotation.
+    Results are published as attributes as soon as they're known, for the Tkinter thread to poll (see
+    MainInterface.update_opening_status); attributes are only assigned once, so no lock is needed.
+    """
+    def __init__(self, path, cache_size_mb=512, gt_path=None):
+        """
+        :param path: path of the frame source
+        :param cache_size_mb: memory budget of the decoded-frame cache of the frame source
+        :param gt_path: path of a gt file saved for this video ("Save annotated file"), loaded if there is no autosave
+        """
+        self.path = path
+        self.kind = source_kind(path)
+        self.cache_size_mb = cache_size_mb
+        self.gt_path = gt_path
+        self.first_frame = None  # the first frame (BGR), as soon as it's decoded
+        self.size = None  # (width, height) of the frames
+        self.fps = None  # frame rate (videos only)
+        self.estimated_frames_nbr = None  # frame count given by the container's metadata (may be wrong)
+        self.frames_nbr = None  # true frame count
+        self.frames_scanned = 0  # number of frames scanned so far by the indexing of the video
+        self.seek_index = None
+        self.frame_source = None  # the opened frame source, once everything else of the source thread is done
+        self.annotations = None  # a dictionary of what the annotations thread read (see self._load_annotations)
+        self.error = None  # the exception that stopped the source thread, if any
+        self.canceled = False
+        self.source_done = False
+        self.annotations_done = False
+        self._threads = [threading.Thread(target=self._open_source, name="VideoOpener.source", daemon=True),
+                         threading.Thread(target=self._load_annotations, name="VideoOpener.annotations", daemon=True)]
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def cancel(self):
+        """
+        Asks the threads to stop: the indexing scan stops within 500 frames, and the frame source opened meanwhile (if
+        any) is closed (see self.close).
+        """
+        self.canceled = True
+
+    @property
+    def done(self):
+        return self.source_done and self.annotations_done
+
+    def close(self):
+        """
+        Closes the frame source if it has been opened but not taken by the caller (e.g., canceled opening).
+        """
+        if self.frame_source is not None:
+            self.frame_source.close()
+            self.frame_source = None
+
+    def _open_source(self):
+        try:
+            if self.kind == VideoFrameSource.kind:
+                reader = cv.VideoCapture(self.path)
+                if not reader.isOpened():
+                    raise IOError("can't open the video file " + self.path)
+                self.size = int(reader.get(cv.CAP_PROP_FRAME_WIDTH)), int(reader.get(cv.CAP_PROP_FRAME_HEIGHT))
+                self.fps = reader.get(cv.CAP_PROP_FPS) or None
+                self.estimated_frames_nbr = int(reader.get(cv.CAP_PROP_FRAME_COUNT)) or None
+                no_error_flag, frame = reader.read()
+                reader.release()
+                if no_error_flag:
+                    self.first_frame = frame
+                if self.canceled:
+                    return
+                self.seek_index = get_seek_index(self.path, progress_callback=self._set_frames_scanned,
+                                                 should_stop=lambda: self.canceled)
+                if self.seek_index is None:  # canceled
+                    return
+            frame_source = open_frame_source(self.path, cache_size_mb=self.cache_size_mb, seek_index=self.seek_index)
+            if self.first_frame is None:  # image sequences and npy stacks: the first frame comes from the source
+                no_error_flag, frame = frame_source.get_frame(0)
+                if no_error_flag:
+                    self.size = frame.shape[1], frame.shape[0]
+                    self.first_frame = frame
+            self.frames_nbr = frame_source.frames_nbr
+            self.frame_source = frame_source
+            if self.canceled:
+                self.close()
+        except Exception as error:  # reported by the Tkinter thread
+            self.error = error
+        finally:
+            self.source_done = True
+
+    def _set_frames_scanned(self, frames_scanned):
+        self.frames_scanned = frames_scanned
+
+    def _load_annotations(self):
+        """
+        Reads the files stored next to the video into self.annotations, a dictionary with the keys:
+            * 'autosave': the autosave files (see AnnotationJournal.read_files),
+            * 'saved_gt': a tuple (gt, flags) of the saved gt file self.gt_path (flags is None if it has no flags file),
+              or None,
+            * 'proposals': cached horizon proposals (see HorizonDetector.load_proposals) or None,
+            * 'signatures': cached frame signatures (see SceneSegmentation.load_signatures) or None,
+            * 'segments': the static segments of the signatures, or None,
+            * 'disputed': the disputed frames of the video (see Consensus.DisputedFrames) or None.
+        Files whose length doesn't match the true frame count are discarded by the caller. A file that can't be read is
+        ignored: opening the video must not fail because of it.
+        """
+        annotations = {"autosave": (None, None, None), "saved_gt": None, "proposals": None, "signatures": None,
+                       "segments": None, "disputed": None}
+        loaders = (("autosave", lambda: AnnotationJournal.read_files(self.path)),
+                   ("saved_gt", self._load_saved_gt),
+                   ("proposals", lambda: HorizonDetector.load_proposals(self.path)),
+                   ("signatures", lambda: SceneSegmentation.load_signatures(self.path)),
+                   ("disputed", self._load_disputed))
+        try:
+            for key, loader in loaders:
+                if self.canceled:
+                    break
+                try:
+                    annotations[key] = loader()
+                except Exception:  # a corrupt file (e.g., a torn npz raises zipfile.BadZipFile) is ignored
+                    pass
+            if annotations["signatures"] is not None and not self.canceled:
+                try:
+                    annotations["segments"] = SceneSegmentation.segment_static(*annotations["signatures"])
+                except Exception:  # signatures of the wrong shape
+                    annotations["signatures"] = None
+        finally:  # the Tkinter thread waits for annotations_done, whatever happens
+            self.annotations = annotations
+            self.annotations_done = True
+
+    def _load_saved_gt(self):
+        if self.gt_path is None or not os.path.exists(self.gt_path) or \
+                os.path.normpath(self.gt_path) == os.path.normpath(AnnotationJournal.paths(self.path)[1]):
+            return None  # no saved gt file, or it's the autosaved one
+        flags_path = os.path.splitext(self.gt_path)[0] + "_flags.npy"
+        return np.load(self.gt_path), np.load(flags_path) if os.path.exists(flags_path) else None
+
+    def _load_disputed(self):
+        # the list written by Consensus next to the merged gt file (in the gt directory), or next to the video
+        paths = ([disputed_path(self.gt_path)] if self.gt_path is not None else []) + \
+            [os.path.splitext(self.path.rstrip("/\\"))[0] + DISPUTED_SUFFIX]
+        for path in paths:
+            if os.path.exists(path):
+                return DisputedFrames.load(path)
+        return None
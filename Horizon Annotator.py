@@ -1,12 +1,15 @@
-import AnnotationGUI.MainInterface as AppGUI
+from AnnotationGUI.Startup import start_gui  # the heavy modules are imported once the window is shown
 import tkinter as tk
 import os
 if __name__ == '__main__':
     root = tk.Tk()
 
     # root.attributes('-fullscreen', True)  # make window full screen (no bar title)
-    root.state('zoomed')  # maximize the window
-    venvp= os.path.join(os.getcwd(), "venv")
+    try:
+        root.state('zoomed')  # maximize the window (Windows)
+    except tk.TclError:
+        root.attributes('-zoomed', True)  # maximize the window (X11)
+    venvp = os.path.join(os.path.dirname(os.path.abspath(__file__)), "venv")
     imgp = os.path.join(venvp, "icone.png")
     print(imgp)
     icone = tk.PhotoImage(file=imgp)
@@ -16,8 +19,7 @@ if __name__ == '__main__':
     # screen_height_resolution = root.winfo_screenheight()
     # screen_width_resolution = root.winfo_screenwidth()
     # root.geometry(str(screen_width_resolution)+"x"+str(screen_height_resolution)+"+0+0")
-    mainApp = AppGUI.MainInterface(master=root)
-    mainApp.grid(row=0, column=0)
+    start_gui(root)  # builds AnnotationGUI.MainInterface.MainInterface in root
     # root.bind("<ButtonPress>", callback)
     # for thread in threading.enumerate(): print(thread.name)
     # mainApp.temporary_load()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the AnnotationGUI package isn't installed: tests import it from the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,182 @@
+"""
+Tests of AnnotationGUI.AutosaveJournal: replaying the journal after a crash, and compacting it into the autosaved gt
+file.
+"""
+import os
+import numpy as np
+import pytest
+from AnnotationGUI import Interpolation
+from AnnotationGUI.AutosaveJournal import AnnotationJournal, HEADER_DTYPE, RECORD_DTYPE
+
+FRAMES_NBR = 10
+
+
+def _arrays(frames_nbr=FRAMES_NBR):
+    gt_Y_alpha = np.full((frames_nbr, 2), np.nan)
+    gt_xy_ends = np.full((frames_nbr, 4), np.nan)
+    gt_flags = np.zeros(frames_nbr, dtype=np.uint8)
+    return gt_Y_alpha, gt_xy_ends, gt_flags
+
+
+def _annotate(arrays, index, Y, flag=Interpolation.VALIDATED):
+    gt_Y_alpha, gt_xy_ends, gt_flags = arrays
+    gt_Y_alpha[index] = (Y, 1.5)
+    gt_xy_ends[index] = (0, Y + 10, 99, Y - 10)
+    gt_flags[index] = flag
+
+
+def _clear(arrays, index):
+    gt_Y_alpha, gt_xy_ends, gt_flags = arrays
+    gt_Y_alpha[index] = np.nan
+    gt_xy_ends[index] = np.nan
+    gt_flags[index] = Interpolation.NOT_ANNOTATED
+
+
+@pytest.fixture
+def video_path(tmp_path):
+    return str(tmp_path / "video.mp4")
+
+
+def _journal(video_path, frames_nbr=FRAMES_NBR):
+    journal = AnnotationJournal(video_path, frames_nbr)
+    journal.restore(*_arrays(frames_nbr))
+    return journal
+
+
+def _restored(video_path, frames_nbr=FRAMES_NBR):
+    journal = AnnotationJournal(video_path, frames_nbr)
+    arrays = _arrays(frames_nbr)
+    restored = journal.restore(*arrays)
+    journal.close()
+    return restored, arrays
+
+
+def test_replay_restores_appended_records(video_path):
+    journal = _journal(video_path)
+    arrays = _arrays()
+    _annotate(arrays, 2, 100.)
+    _annotate(arrays, 5, 200., Interpolation.INTERPOLATED)
+    journal.append([2, 5], *arrays)
+    journal.close()
+
+    restored, (gt_Y_alpha, gt_xy_ends, gt_flags) = _restored(video_path)
+    assert restored
+    np.testing.assert_array_equal(gt_Y_alpha, arrays[0])
+    np.testing.assert_array_equal(gt_xy_ends, arrays[1])
+    np.testing.assert_array_equal(gt_flags, arrays[2])
+
+
+def test_last_record_wins(video_path):
+    journal = _journal(video_path)
+    arrays = _arrays()
+    for Y in (100., 150., 120.):
+        _annotate(arrays, 3, Y)
+        journal.append(3, *arrays)
+    _clear(arrays, 3)
+    _annotate(arrays, 4, 50.)
+    journal.append([3, 4], *arrays)
+    _annotate(arrays, 4, 60., Interpolation.TRACKED)
+    journal.append(4, *arrays)
+    journal.close()
+
+    _, (gt_Y_alpha, _, gt_flags) = _restored(video_path)
+    assert np.isnan(gt_Y_alpha[3]).all() and gt_flags[3] == Interpolation.NOT_ANNOTATED
+    assert gt_Y_alpha[4, 0] == 60. and gt_flags[4] == Interpolation.TRACKED
+
+
+def test_replay_ignores_a_torn_trailing_record(video_path):
+    journal = _journal(video_path)
+    arrays = _arrays()
+    _annotate(arrays, 1, 100.)
+    journal.append(1, *arrays)
+    _annotate(arrays, 7, 300.)
+    journal.append(7, *arrays)
+    journal.close()
+    # a crash in the middle of the second record
+    complete_size = HEADER_DTYPE.itemsize + RECORD_DTYPE.itemsize
+    os.truncate(journal.journal_path, complete_size + RECORD_DTYPE.itemsize // 2)
+
+    journal = AnnotationJournal(video_path, FRAMES_NBR)
+    gt_Y_alpha, gt_xy_ends, gt_flags = _arrays()
+    assert journal.restore(gt_Y_alpha, gt_xy_ends, gt_flags)
+    assert gt_Y_alpha[1, 0] == 100. and gt_flags[1] == Interpolation.VALIDATED
+    assert np.isnan(gt_Y_alpha[7]).all() and gt_flags[7] == Interpolation.NOT_ANNOTATED
+    # the torn record is dropped, so that new records follow the last complete one
+    assert os.path.getsize(journal.journal_path) == complete_size
+    _annotate(arrays, 8, 400.)
+    journal.append(8, *arrays)
+    journal.close()
+
+    _, (gt_Y_alpha, _, gt_flags) = _restored(video_path)
+    assert gt_Y_alpha[1, 0] == 100. and gt_Y_alpha[8, 0] == 400.
+    assert np.flatnonzero(gt_flags).tolist() == [1, 8]
+
+
+def test_journal_of_a_different_frame_count_is_ignored(video_path):
+    journal = _journal(video_path, FRAMES_NBR + 5)
+    arrays = _arrays(FRAMES_NBR + 5)
+    _annotate(arrays, 2, 100.)
+    journal.append(2, *arrays)
+    journal.close()
+
+    journal = AnnotationJournal(video_path, FRAMES_NBR)
+    gt_Y_alpha, _, gt_flags = arrays = _arrays()
+    assert not journal.restore(*arrays)
+    assert not gt_flags.any() and np.isnan(gt_Y_alpha).all()
+    # the journal is started again with the new number of frames
+    journal.close()
+    with open(journal.journal_path, "rb") as journal_file:
+        header = np.frombuffer(journal_file.read(), dtype=HEADER_DTYPE, count=1)[0]
+    assert header["frames_nbr"] == FRAMES_NBR
+    assert os.path.getsize(journal.journal_path) == HEADER_DTYPE.itemsize
+
+
+def test_compaction_writes_the_gt_file_and_empties_the_journal(video_path):
+    journal = _journal(video_path)
+    arrays = _arrays()
+    _annotate(arrays, 0, 100.)
+    _annotate(arrays, 9, 110., Interpolation.PROPAGATED)
+    journal.append([0, 9], *arrays)
+    journal.compact(*arrays)
+    journal.close()
+
+    directory = os.path.dirname(video_path)
+    assert not [name for name in os.listdir(directory) if name.endswith(".tmp")]
+    assert os.path.getsize(journal.journal_path) == HEADER_DTYPE.itemsize
+    gt = np.load(journal.gt_path)
+    assert gt.shape == (FRAMES_NBR, 6) and gt.dtype == np.float32
+    np.testing.assert_array_equal(np.load(journal.flags_path), arrays[2])
+
+    restored, (gt_Y_alpha, gt_xy_ends, gt_flags) = _restored(video_path)
+    assert restored
+    np.testing.assert_array_equal(gt_Y_alpha, arrays[0])
+    np.testing.assert_array_equal(gt_xy_ends, arrays[1])
+    np.testing.assert_array_equal(gt_flags, arrays[2])
+
+
+def test_interrupted_compaction_keeps_the_old_gt_file_and_the_journal(video_path, monkeypatch):
+    journal = _journal(video_path)
+    arrays = _arrays()
+    _annotate(arrays, 0, 100.)
+    journal.compact(*arrays)
+    _annotate(arrays, 4, 200.)
+    journal.append(4, *arrays)
+    old_gt = np.load(journal.gt_path)
+
+    real_replace = os.replace
+
+    def crash_on_gt_file(src, dst):
+        if dst == journal.gt_path:
+            raise OSError("crash")
+        real_replace(src, dst)
+
+    monkeypatch.setattr(os, "replace", crash_on_gt_file)
+    with pytest.raises(OSError):
+        journal.compact(*arrays)
+    monkeypatch.undo()
+    journal.close()
+
+    np.testing.assert_array_equal(np.load(journal.gt_path), old_gt)
+    _, (gt_Y_alpha, _, gt_flags) = _restored(video_path)
+    assert gt_Y_alpha[0, 0] == 100. and gt_Y_alpha[4, 0] == 200.
+    assert np.flatnonzero(gt_flags).tolist() == [0, 4]
@@ -0,0 +1,125 @@
+"""
+Tests of AnnotationGUI.Consensus: the vectorized median, spread and disputed frames against nan-aware numpy
+reductions, and the list of disputed frames.
+"""
+import warnings
+import numpy as np
+import pytest
+from AnnotationGUI import Consensus, Interpolation
+from AnnotationGUI.Geometry import gt_from_slope_intercept, xy_ends_from_y_alpha
+
+ORG_W = 1920
+
+
+def _versions(versions=4, frames_nbr=300, nan_ratio=0.3, seed=0):
+    rng = np.random.default_rng(seed)
+    slope = np.tan(np.radians(rng.uniform(-5, 5, frames_nbr)))
+    intercept = rng.uniform(300, 700, frames_nbr)
+    gts = []
+    for _ in range(versions):
+        gt = gt_from_slope_intercept(slope + rng.normal(0, 0.01, frames_nbr),
+                                     intercept + rng.normal(0, 4, frames_nbr), ORG_W)
+        gt[rng.random(frames_nbr) < nan_ratio] = np.nan
+        gts.append(gt)
+    return Consensus.stack_versions(gts)
+
+
+def _nan_reductions(values):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # all-nan frames
+        return np.nanmedian(values, axis=0), np.nanmax(values, axis=0) - np.nanmin(values, axis=0)
+
+
+@pytest.mark.parametrize("versions", [1, 2, 3, 4, 5])
+def test_median_and_spread_match_nan_reductions(versions):
+    stack = _versions(versions, seed=versions)
+    for column in (0, 1):
+        median, spread, count = Consensus._sorted_median_and_range(stack[..., column])
+        expected_median, expected_spread = _nan_reductions(stack[..., column])
+        np.testing.assert_allclose(median, expected_median, rtol=1e-6)
+        np.testing.assert_allclose(spread, expected_spread, rtol=1e-5, atol=1e-4)
+        assert count.tolist() == np.count_nonzero(~np.isnan(stack[..., column]), axis=0).tolist()
+
+
+def test_consensus_gt_is_the_median_line():
+    stack = _versions(3, nan_ratio=0.2)
+    result = Consensus.consensus(stack, org_w=ORG_W)
+    Y_median, alpha_median = _nan_reductions(stack[..., 0])[0], _nan_reductions(stack[..., 1])[0]
+    merged = result["annotators"] >= 2
+    assert (~np.isnan(result["gt"][:, 0]) == merged).all()
+    np.testing.assert_allclose(result["gt"][merged, 0], Y_median[merged], rtol=1e-6)
+    np.testing.assert_allclose(result["gt"][merged, 1], alpha_median[merged], rtol=1e-6)
+    np.testing.assert_allclose(result["gt"][merged, 2:],
+                               xy_ends_from_y_alpha(Y_median[merged], alpha_median[merged], ORG_W), rtol=1e-5)
+
+
+def test_infer_org_w():
+    stack = _versions(2)
+    assert Consensus.infer_org_w(stack) == ORG_W
+    assert Consensus.infer_org_w(np.full((2, 3, 6), np.nan)) is None
+
+
+def test_disputed_frames_and_reasons():
+    # frames: agreed, Y spread, alpha spread, both, too few, not annotated, agreed with a degenerate row
+    gt = gt_from_slope_intercept(np.zeros(7), np.full(7, 500.), ORG_W)
+    stack = np.stack([gt, gt, gt])
+    stack[1, 1, 0] += 6
+    stack[2, 2, 1] += 1.5
+    stack[0, 3, 0] -= 10
+    stack[0, 3, 1] -= 2
+    stack[1:, 4] = np.nan
+    stack[:, 5] = np.nan
+    stack[2, 6, 3] = np.nan  # a degenerate row doesn't count
+    result = Consensus.consensus(stack, y_threshold=5.0, alpha_threshold=1.0)
+    Y_SPREAD, ALPHA_SPREAD, TOO_FEW = Consensus.Y_SPREAD, Consensus.ALPHA_SPREAD, Consensus.TOO_FEW
+    assert result["reasons"].tolist() == [0, Y_SPREAD, ALPHA_SPREAD, Y_SPREAD | ALPHA_SPREAD, TOO_FEW, 0, 0]
+    assert result["disputed"].tolist() == [False, True, True, True, True, False, False]
+    assert result["annotators"].tolist() == [3, 3, 3, 3, 1, 0, 2]
+    np.testing.assert_allclose(result["Y_spread"][:5], [0, 6, 0, 10, 0])
+    assert np.isnan(result["Y_spread"][5]) and np.isnan(result["gt"][4:6]).all()
+    np.testing.assert_allclose(result["gt"][6, 0], 500.)
+    # with a single required annotator, the frame annotated once isn't disputed
+    assert not Consensus.consensus(stack, min_annotators=1)["disputed"][4]
+
+
+def test_stack_versions_rejects_different_lengths():
+    with pytest.raises(ValueError):
+        Consensus.stack_versions([np.zeros((3, 6)), np.zeros((4, 6))])
+
+
+def test_disputed_frames_navigation_and_round_trip(tmp_path):
+    stack = _versions(3, frames_nbr=100, nan_ratio=0.2, seed=5)
+    result = Consensus.consensus(stack, y_threshold=8.0)
+    disputed = Consensus.DisputedFrames.from_consensus(stack, result, versions=["a", "b", "c"])
+    frames = np.flatnonzero(result["disputed"])
+    assert len(disputed) == frames.size > 2
+    assert disputed.next_frame(-1) == frames[0] and disputed.next_frame(frames[0]) == frames[1]
+    assert disputed.previous_frame(frames[1]) == frames[0] and disputed.previous_frame(frames[0]) is None
+    assert disputed.next_frame(frames[-1]) is None
+    assert disputed.describe(int(frames[0])).startswith("Disputed 1/{}".format(frames.size))
+    assert disputed.describe(int(np.flatnonzero(~result["disputed"])[0])) is None
+
+    path = str(tmp_path / "video_Disputed.json")
+    disputed.save(path)
+    loaded = Consensus.DisputedFrames.load(path)
+    assert loaded.frames.tolist() == frames.tolist() and loaded.versions == ["a", "b", "c"]
+    assert loaded.reasons.tolist() == result["reasons"][frames].tolist()
+    np.testing.assert_allclose(loaded.Y, stack[:, frames, 0].T, atol=1e-3)
+    assert loaded.frames_nbr == 100
+
+
+def test_merge_files(tmp_path):
+    stack = _versions(3, frames_nbr=50, seed=6)
+    paths = []
+    for k, gt in enumerate(stack):
+        paths.append(str(tmp_path / "v{}_LineGT.npy".format(k)))
+        np.save(paths[-1], gt)
+    out = str(tmp_path / "merged_LineGT.npy")
+    _, report = Consensus.merge_files(paths, out, y_threshold=8.0)
+    result = Consensus.consensus(stack, y_threshold=8.0)
+    gt, flags = np.load(out), np.load(str(tmp_path / "merged_LineGT_flags.npy"))
+    assert np.isnan(gt[result["disputed"]]).all()
+    assert (flags == Interpolation.VALIDATED).tolist() == (~np.isnan(gt[:, 0])).tolist()
+    assert report["disputed"] == np.count_nonzero(result["disputed"])
+    assert report["agreed"] == np.count_nonzero(~np.isnan(gt[:, 0]))
+    assert len(Consensus.DisputedFrames.load(str(tmp_path / "merged_Disputed.json"))) == report["disputed"]
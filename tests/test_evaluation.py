@@ -0,0 +1,99 @@
+"""
+Tests of AnnotationGUI.Evaluation: the vectorized per-frame metrics against a frame-by-frame computation, and the
+reports built from them.
+"""
+import math
+import numpy as np
+import pytest
+from AnnotationGUI import Evaluation
+
+
+def _reference_errors(gt, pred):
+    """
+    Frame-by-frame computation of the metrics of Evaluation.frame_errors.
+    """
+    errors = {metric: [] for metric in Evaluation.METRICS}
+    for gt_row, pred_row in zip(gt, pred):
+        if np.isnan(gt_row).any() or np.isnan(pred_row).any():
+            continue
+        errors["Y_error"].append(abs(float(pred_row[0]) - float(gt_row[0])))
+        angle = abs(float(pred_row[1]) - float(gt_row[1])) % 180
+        errors["alpha_error"].append(min(angle, 180 - angle))
+        errors["endpoint_distance"].append(0.5 * (math.dist(pred_row[2:4], gt_row[2:4]) +
+                                                  math.dist(pred_row[4:6], gt_row[4:6])))
+    return errors
+
+
+def test_frame_errors_match_a_frame_by_frame_computation():
+    gt, pred = Evaluation.synthetic_dataset(500, nan_ratio=0.1, seed=1)
+    errors = Evaluation.frame_errors(gt, pred)
+    assert errors["evaluated"].tolist() == (~(np.isnan(gt).any(axis=1) | np.isnan(pred).any(axis=1))).tolist()
+    for metric, values in _reference_errors(gt, pred).items():
+        assert errors[metric].dtype == np.float32
+        np.testing.assert_allclose(errors[metric], values, rtol=1e-5, atol=1e-4)
+
+
+def test_alpha_error_wraps_around():
+    gt = np.zeros((3, 6), dtype=np.float32)
+    pred = gt.copy()
+    gt[:, 1] = (89., -45., 10.)
+    pred[:, 1] = (-89., 135., 10.5)
+    np.testing.assert_allclose(Evaluation.frame_errors(gt, pred)["alpha_error"], (2., 0., 0.5), atol=1e-5)
+
+
+def test_frame_errors_reject_different_shapes():
+    with pytest.raises(ValueError):
+        Evaluation.frame_errors(np.zeros((3, 6)), np.zeros((4, 6)))
+
+
+def test_evaluate_counts_and_summaries():
+    gt, pred = Evaluation.synthetic_dataset(200, nan_ratio=0.2, seed=2)
+    report = Evaluation.evaluate(gt, pred)
+    gt_annotated = ~np.isnan(gt[:, 0])
+    evaluated = gt_annotated & ~np.isnan(pred[:, 0])
+    assert report["frames"] == 200
+    assert report["annotated"] == np.count_nonzero(gt_annotated)
+    assert report["evaluated"] == np.count_nonzero(evaluated)
+    assert report["missed"] == report["annotated"] - report["evaluated"]
+    reference = _reference_errors(gt, pred)
+    for metric in Evaluation.METRICS:
+        summary = report[metric]
+        assert sum(summary["histogram"]["counts"]) == report["evaluated"]
+        assert summary["histogram"]["edges"][-1] is None
+        np.testing.assert_allclose(summary["mean"], np.mean(reference[metric]), rtol=1e-4)
+        np.testing.assert_allclose(summary["max"], np.max(reference[metric]), rtol=1e-4)
+        np.testing.assert_allclose(summary["percentiles"]["50"], np.median(reference[metric]), rtol=1e-4, atol=1e-5)
+    # precomputed errors give the same report
+    assert Evaluation.evaluate(gt, pred, Evaluation.frame_errors(gt, pred)) == report
+
+
+def test_summary_of_no_errors():
+    summary = Evaluation.summarize(np.zeros(0, dtype=np.float32), "Y_error")
+    assert summary["mean"] is None and summary["max"] is None
+    assert set(summary["percentiles"].values()) == {None}
+    assert sum(summary["histogram"]["counts"]) == 0
+
+
+def test_evaluate_directories(tmp_path):
+    gt_root, pred_root = tmp_path / "gt", tmp_path / "pred"
+    (gt_root / "Onshore").mkdir(parents=True)
+    (pred_root / "Onshore").mkdir(parents=True)
+    gt_a, pred_a = Evaluation.synthetic_dataset(50, seed=3)
+    gt_b, pred_b = Evaluation.synthetic_dataset(30, seed=4)
+    np.save(str(gt_root / "Onshore" / "a_LineGT.npy"), gt_a)
+    np.save(str(pred_root / "Onshore" / "a_pred.npy"), pred_a)
+    np.save(str(gt_root / "b_LineGT.npy"), gt_b)
+    np.save(str(gt_root / "c_LineGT.npy"), gt_b)  # no prediction file
+    np.save(str(pred_root / "b_pred.npy"), pred_b)
+
+    results = Evaluation.evaluate_directories(str(gt_root), str(pred_root), "_pred.npy", workers=1)
+    assert sorted(results["videos"]) == ["Onshore/a", "b", "c"]
+    assert "error" in results["videos"]["c"]
+    assert results["videos"]["b"] == Evaluation.evaluate(gt_b, pred_b)
+    overall = results["overall"]
+    expected = Evaluation.evaluate(np.concatenate((gt_a, gt_b)), np.concatenate((pred_a, pred_b)))
+    for key in ("frames", "annotated", "evaluated", "missed"):
+        assert overall[key] == expected[key]
+    for metric in Evaluation.METRICS:
+        assert overall[metric]["histogram"] == expected[metric]["histogram"]
+        np.testing.assert_allclose(overall[metric]["mean"], expected[metric]["mean"], rtol=1e-6)
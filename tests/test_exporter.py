@@ -0,0 +1,105 @@
+"""
+Tests of AnnotationGUI.Exporter: the rasterized masks against a pixel-by-pixel computation, and the round trip of the
+mask stores.
+"""
+import csv
+import json
+import numpy as np
+import pytest
+from AnnotationGUI import Exporter
+from AnnotationGUI.Geometry import gt_from_slope_intercept, slope_intercept_from_gt
+
+SIZE = (64, 48)
+
+
+def _gt(frames_nbr=40, seed=0):
+    rng = np.random.default_rng(seed)
+    slope = np.tan(np.radians(rng.uniform(-30, 30, frames_nbr)))
+    intercept = rng.uniform(-20, SIZE[1] + 20, frames_nbr)  # some lines leave the frame
+    gt = gt_from_slope_intercept(slope, intercept, SIZE[0])
+    gt[rng.random(frames_nbr) < 0.2] = np.nan
+    return gt
+
+
+def _brute_force_masks(gt, size):
+    w, h = size
+    slope, intercept = slope_intercept_from_gt(gt, w)
+    masks = np.empty((len(gt), h, w), dtype=np.uint8)
+    for i in range(len(gt)):
+        if np.isnan(slope[i]):
+            masks[i] = Exporter.NOT_ANNOTATED
+            continue
+        for y in range(h):
+            for x in range(w):
+                masks[i, y, x] = Exporter.SKY if y < slope[i] * x + intercept[i] else Exporter.SEA
+    return masks
+
+
+def test_rasterize_matches_brute_force():
+    gt = _gt()
+    np.testing.assert_array_equal(Exporter.rasterize_masks(gt, SIZE), _brute_force_masks(gt, SIZE))
+
+
+def test_rasterize_of_lines_through_pixel_centres():
+    gt = gt_from_slope_intercept([0., 1.], [10., 0.], SIZE[0])
+    np.testing.assert_array_equal(Exporter.rasterize_masks(gt, SIZE), _brute_force_masks(gt, SIZE))
+    assert Exporter.rasterize_masks(gt, SIZE)[0, :, 0].tolist() == [Exporter.SKY] * 10 + [Exporter.SEA] * 38
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_memmap_store(tmp_path, workers):
+    gt = _gt(seed=1)
+    path = str(tmp_path / "masks.npy")
+    Exporter.export_masks(path, gt, SIZE, store="memmap", memory_mb=0.05, workers=workers)
+    np.testing.assert_array_equal(np.load(path), _brute_force_masks(gt, SIZE))
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_npz_store_round_trip(tmp_path, workers):
+    gt = _gt(seed=2)
+    masks_dir = str(tmp_path / "masks")
+    progress = []
+    Exporter.export_masks(masks_dir, gt, SIZE, store="npz", memory_mb=0.05, workers=workers,
+                          progress_callback=lambda done, total: progress.append((done, total)))
+    assert Exporter.chunk_frames_for_budget(SIZE, 0.05, workers) < len(gt)  # several chunks
+    assert progress[-1] == (len(gt), len(gt))
+    expected = _brute_force_masks(gt, SIZE)
+    annotated = ~np.isnan(gt[:, 0])
+    expected[~annotated] = Exporter.SEA
+    for start, stop in ((0, len(gt)), (3, 17), (len(gt) - 1, len(gt))):
+        masks, chunk_annotated = Exporter.load_masks(masks_dir, start, stop)
+        np.testing.assert_array_equal(masks, expected[start:stop])
+        assert chunk_annotated.tolist() == annotated[start:stop].tolist()
+
+
+def test_masks_are_rescaled(tmp_path):
+    gt = _gt(seed=3)
+    mask_size = (32, 24)
+    path = str(tmp_path / "masks.npy")
+    Exporter.export_masks(path, gt, SIZE, mask_size, store="memmap", workers=1)
+    np.testing.assert_array_equal(np.load(path), Exporter.rasterize_masks(
+        np.asarray(Exporter.rescale_gt(gt, SIZE, mask_size)), mask_size))
+
+
+def test_unknown_store_raises(tmp_path):
+    with pytest.raises(ValueError):
+        Exporter.export_masks(str(tmp_path / "masks"), _gt(), SIZE, store="png")
+
+
+def test_tables(tmp_path):
+    gt = _gt(10, seed=4)
+    flags = np.where(np.isnan(gt[:, 0]), 0, 1).astype(np.uint8)
+    written = Exporter.export_gt(gt, flags, str(tmp_path), "video", table_formats=("csv", "json"))
+    with open(written["csv"]) as table_file:
+        rows = list(csv.DictReader(table_file))
+    with open(written["json"]) as table_file:
+        records = json.load(table_file)
+    assert len(rows) == len(records) == 10
+    for frame, (row, record) in enumerate(zip(rows, records)):
+        assert int(row["frame"]) == record["frame"] == frame
+        assert int(row["flag"]) == record["flag"] == flags[frame]
+        if np.isnan(gt[frame, 0]):
+            assert row["Y"] == "" and record["Y"] is None
+        else:
+            np.testing.assert_allclose([float(row[c]) for c in Exporter.COLUMNS[1:-1]], gt[frame], rtol=1e-5)
+            np.testing.assert_allclose([record[c] for c in Exporter.COLUMNS[1:-1]], gt[frame], rtol=1e-6)
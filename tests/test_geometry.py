@@ -0,0 +1,118 @@
+"""
+Tests of AnnotationGUI.Geometry: degenerate lines are mapped to rows of np.nan, and rescaling, cropping and flipping
+can be undone.
+"""
+import numpy as np
+import pytest
+from AnnotationGUI import Geometry
+
+ORG_SIZE = (1920, 1080)
+
+
+def _gt(lines, org_w=ORG_SIZE[0]):
+    slopes, intercepts = zip(*lines)
+    return Geometry.gt_from_slope_intercept(slopes, intercepts, org_w)
+
+
+def test_gt_from_slope_intercept_follows_the_row_convention():
+    gt = _gt([(0.1, 500.)])
+    x_hl = int((ORG_SIZE[0] - 1) / 2)
+    np.testing.assert_allclose(gt[0], [0.1 * x_hl + 500, -np.degrees(np.arctan(0.1)), 0, 500,
+                                       ORG_SIZE[0] - 1, 0.1 * (ORG_SIZE[0] - 1) + 500], rtol=1e-6)
+
+
+def test_vertical_line_is_nan():
+    gt = Geometry.gt_from_xy_ends([100., 0.], [10., 500.], [100., 1919.], [900., 520.], ORG_SIZE[0])
+    assert np.isnan(gt[0]).all()
+    assert np.isfinite(gt[1]).all()
+
+
+def test_single_point_line_is_nan():
+    slope, intercept = Geometry.slope_intercept_from_xy_ends(50., 60., 50., 60.)
+    assert np.isnan(slope).all() and np.isnan(intercept).all()
+    assert np.isnan(Geometry.gt_from_xy_ends(50., 60., 50., 60., ORG_SIZE[0])).all()
+
+
+@pytest.mark.parametrize("slope, intercept", [(np.inf, 0.), (0., np.nan), (np.nan, 3.)])
+def test_non_finite_inputs_are_nan(slope, intercept):
+    assert np.isnan(_gt([(slope, intercept)])).all()
+
+
+def test_alpha_of_90_degrees_is_nan():
+    slope, intercept = Geometry.slope_intercept_from_gt([[500., 90.], [500., -95.]], ORG_SIZE[0])
+    assert np.isnan(slope).all() and np.isnan(intercept).all()
+    assert np.isnan(Geometry.xy_ends_from_y_alpha([500., 500.], [90., -95.], ORG_SIZE[0])).all()
+
+
+def test_clip_keeps_segments_inside_the_image():
+    clipped = Geometry.clip_xy_ends([[10., 20., 30., 40.]], ORG_SIZE)
+    np.testing.assert_allclose(clipped, [[10., 20., 30., 40.]])
+
+
+def test_clip_cuts_segments_at_the_image_bounds():
+    clipped = Geometry.clip_xy_ends([[-100., -100., 2000., 2000.]], ORG_SIZE)
+    np.testing.assert_allclose(clipped, [[0., 0., 1079., 1079.]])
+
+
+@pytest.mark.parametrize("xy_ends", [[0., -10., 1919., -20.],  # above the image
+                                     [0., 1200., 1919., 1100.],  # below the image
+                                     [-50., 0., -10., 500.],  # left of the image
+                                     [0., -1., 1919., -1.],  # horizontal, parallel to the top edge
+                                     [np.nan, 0., 10., 10.]])
+def test_clip_of_segments_outside_the_image_is_nan(xy_ends):
+    assert np.isnan(Geometry.clip_xy_ends(xy_ends, ORG_SIZE)).all()
+
+
+def test_flip_and_crop_of_degenerate_rows_are_nan():
+    gt = np.full((2, 6), np.nan, dtype=np.float32)
+    gt[1] = _gt([(0.05, 400.)])[0]
+    gt[1, 1] = 90  # vertical
+    for transformed in (Geometry.flip_gt(gt, ORG_SIZE), Geometry.flip_gt(gt, ORG_SIZE, False, True),
+                        Geometry.crop_gt(gt, ORG_SIZE, (100, 50, 640, 480)),
+                        Geometry.rescale_gt(gt, ORG_SIZE, (960, 540))):
+        assert transformed.shape == (2, 6)
+        assert np.isnan(transformed).all()
+
+
+LINES = [(0., 540.), (0.1, 300.), (-0.25, 900.), (1.5, -200.)]
+
+
+def test_rescale_round_trip():
+    gt = _gt(LINES)
+    small = Geometry.rescale_gt(gt, ORG_SIZE, (640, 360))
+    np.testing.assert_allclose(Geometry.rescale_gt(small, (640, 360), ORG_SIZE), gt, rtol=1e-4, atol=1e-2)
+
+
+def test_rescale_maps_points_of_the_line():
+    gt = _gt(LINES)
+    new_size = (960, 720)
+    rescaled = Geometry.rescale_gt(gt, ORG_SIZE, new_size)
+    sx, sy = new_size[0] / ORG_SIZE[0], new_size[1] / ORG_SIZE[1]
+    slope, intercept = Geometry.slope_intercept_from_gt(rescaled, new_size[0])
+    x = 1000.
+    y = np.array([s * x + i for s, i in LINES])
+    np.testing.assert_allclose(slope * x * sx + intercept, y * sy, rtol=1e-4)
+
+
+def test_crop_round_trip():
+    gt = _gt(LINES)
+    crop = (320, 180, 1280, 720)
+    cropped = Geometry.crop_gt(gt, ORG_SIZE, crop)
+    # un-cropping is cropping with the opposite offset
+    uncropped = Geometry.crop_gt(cropped, crop[2:], (-crop[0], -crop[1], ORG_SIZE[0], ORG_SIZE[1]))
+    np.testing.assert_allclose(uncropped, gt, rtol=1e-4, atol=1e-2)
+
+
+@pytest.mark.parametrize("horizontal, vertical", [(True, False), (False, True), (True, True)])
+def test_flip_round_trip(horizontal, vertical):
+    gt = _gt(LINES)
+    flipped = Geometry.flip_gt(gt, ORG_SIZE, horizontal, vertical)
+    assert not np.allclose(flipped, gt)
+    np.testing.assert_allclose(Geometry.flip_gt(flipped, ORG_SIZE, horizontal, vertical), gt, rtol=1e-4, atol=1e-2)
+
+
+def test_horizontal_flip_swaps_the_end_points():
+    gt = _gt(LINES)
+    flipped = Geometry.flip_gt(gt, ORG_SIZE)
+    np.testing.assert_allclose(flipped[:, 3], gt[:, 5], rtol=1e-5)
+    np.testing.assert_allclose(flipped[:, 5], gt[:, 3], rtol=1e-5)
@@ -0,0 +1,139 @@
+"""
+Tests of AnnotationGUI.GTStore: storing, growing, compacting and querying the dataset-wide gt store.
+"""
+import os
+import numpy as np
+import pytest
+from AnnotationGUI.GTStore import GTStore
+
+
+def _gt(length, Y0=0., alpha=0.):
+    gt = np.zeros((length, 6), dtype=np.float32)
+    gt[:, 0] = Y0 + np.arange(length)
+    gt[:, 1] = alpha
+    gt[:, 2:] = np.arange(length)[:, None]
+    return gt
+
+
+@pytest.fixture
+def store(tmp_path):
+    return GTStore.create(str(tmp_path / "store"), capacity=4)
+
+
+def test_put_and_read(store):
+    a, b = _gt(3), _gt(5, Y0=100.)
+    store.put("a", a)
+    store.put("b", b)
+    assert store.videos == ["a", "b"] and len(store) == 8
+    np.testing.assert_array_equal(store.gt("a"), a)
+    np.testing.assert_array_equal(store.gt("b"), b)
+    assert store.video("b").shape == (6, 5)
+    # reopening the store reads the same content
+    reopened = GTStore(store.store_dir)
+    np.testing.assert_array_equal(reopened.gt("b"), b)
+    assert reopened.size == store.size
+
+
+def test_put_grows_the_columns(store):
+    gts = {"v{}".format(i): _gt(3, Y0=10. * i) for i in range(5)}
+    for name, gt in gts.items():
+        store.put(name, gt)
+    assert store.columns.shape[1] >= 15
+    for name, gt in gts.items():
+        np.testing.assert_array_equal(store.gt(name), gt)
+
+
+def test_put_rewrites_in_place_or_appends(store):
+    store.put("a", _gt(4))
+    store.put("b", _gt(2, Y0=50.))
+    store.put("a", _gt(3, Y0=20.))  # fits in its slot
+    assert store.slots["a"]["offset"] == 0 and store.size == 6
+    np.testing.assert_array_equal(store.gt("a"), _gt(3, Y0=20.))
+    assert np.isnan(store.columns[:, 3]).all()
+    store.put("a", _gt(6, Y0=30.))  # doesn't fit: a new slot is appended
+    assert store.slots["a"]["offset"] == 6 and store.size == 12
+    np.testing.assert_array_equal(store.gt("a"), _gt(6, Y0=30.))
+    np.testing.assert_array_equal(store.gt("b"), _gt(2, Y0=50.))
+
+
+def test_compact_reclaims_holes(store):
+    store.put("a", _gt(4))
+    store.put("b", _gt(2, Y0=50.))
+    store.put("c", _gt(3, Y0=80.))
+    store.put("a", _gt(5, Y0=30.))
+    store.remove("c")
+    store.compact()
+    assert store.size == 7 and store.columns.shape[1] == 7
+    assert sorted((slot["offset"], slot["length"]) for slot in store.slots.values()) == [(0, 2), (2, 5)]
+    np.testing.assert_array_equal(store.gt("a"), _gt(5, Y0=30.))
+    np.testing.assert_array_equal(store.gt("b"), _gt(2, Y0=50.))
+    assert not [name for name in os.listdir(store.store_dir) if ".tmp" in name]
+    reopened = GTStore(store.store_dir)
+    np.testing.assert_array_equal(reopened.gt("a"), _gt(5, Y0=30.))
+
+
+def test_compact_of_an_empty_store(store):
+    store.put("a", _gt(2))
+    store.remove("a")
+    store.compact()
+    assert store.size == 0 and len(store) == 0 and store.select().size == 0
+
+
+def test_select_filters(store):
+    a = _gt(4, alpha=1.)
+    a[1, 0] = np.nan
+    b = _gt(3, Y0=100., alpha=3.)
+    store.put("a", a)
+    store.put("old", _gt(6, alpha=5.))
+    store.put("b", b)
+    store.remove("old")  # a hole, never selected
+    assert store.select().tolist() == [0, 2, 3, 10, 11, 12]
+    assert store.select(annotated=False).tolist() == [0, 1, 2, 3, 10, 11, 12]
+    assert store.select(alpha_min=2.).tolist() == [10, 11, 12]
+    assert store.select(alpha_max=2., Y_min=2.).tolist() == [2, 3]
+    assert store.select(Y_max=100.5).tolist() == [0, 2, 3, 10]
+    assert store.select(videos=["a"]).tolist() == [0, 2, 3]
+
+
+def test_rows_and_locate(store):
+    a, b = _gt(4), _gt(3, Y0=100.)
+    store.put("a", a)
+    store.put("b", b)
+    positions = np.array([5, 0, 6, 3])
+    np.testing.assert_array_equal(store.rows(positions), np.concatenate((a, b))[positions])
+    names, frames = store.locate(positions)
+    assert names.tolist() == ["b", "a", "b", "a"] and frames.tolist() == [1, 0, 2, 3]
+    assert store.global_rows("b", [0, 2]).tolist() == [4, 6]
+
+
+def test_sample_is_consistent_with_locate(store):
+    store.put("a", _gt(4))
+    store.put("b", _gt(3, Y0=100.))
+    gt, names, frames = store.sample(50, rng=np.random.default_rng(0), alpha_max=0.)
+    for row, name, frame in zip(gt, names, frames):
+        np.testing.assert_array_equal(row, store.gt(name)[frame])
+
+
+def test_put_rejects_an_empty_gt(store):
+    store.put("a", _gt(2))
+    with pytest.raises(ValueError):
+        store.put("empty", np.zeros((0, 6)))
+    store.put("b", _gt(3, Y0=100.))
+    assert "empty" not in store.slots
+    names, frames = store.locate(store.select())
+    assert names.tolist() == ["a", "a", "b", "b", "b"] and frames.tolist() == [0, 1, 0, 1, 2]
+
+
+def test_add_directory_skips_empty_and_unchanged_gt_files(store, tmp_path):
+    root = tmp_path / "dataset"
+    (root / "Onshore").mkdir(parents=True)
+    np.save(str(root / "Onshore" / "MVI_1_LineGT.npy"), _gt(3))
+    np.save(str(root / "MVI_2_LineGT.npy"), _gt(2, Y0=100.))
+    np.save(str(root / "MVI_3_LineGT.npy"), np.zeros((0, 6), dtype=np.float32))
+    assert store.add_directory(str(root)) == ["MVI_2", "Onshore/MVI_1"]
+    assert store.add_directory(str(root)) == []
+    # a gt file that became empty removes its video
+    np.save(str(root / "MVI_2_LineGT.npy"), np.zeros((0, 6), dtype=np.float32))
+    os.utime(str(root / "MVI_2_LineGT.npy"), (0, 0))
+    assert store.add_directory(str(root)) == []
+    assert store.videos == ["Onshore/MVI_1"]
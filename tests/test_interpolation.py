@@ -0,0 +1,117 @@
+"""
+Tests of AnnotationGUI.Interpolation.interpolate_gaps and of the annotation flags.
+"""
+import numpy as np
+import pytest
+from AnnotationGUI import Interpolation
+from AnnotationGUI.Interpolation import NOT_ANNOTATED, VALIDATED, INTERPOLATED, TRACKED, PROPAGATED
+from AnnotationGUI.Geometry import xy_ends_from_y_alpha
+
+ORG_W = 1920
+
+
+def _frames(keyframes, frames_nbr=20, flag=VALIDATED):
+    """
+    :param keyframes: a dict {index: (Y, alpha)}
+    """
+    gt_Y_alpha = np.full((frames_nbr, 2), np.nan)
+    gt_flags = np.zeros(frames_nbr, dtype=np.uint8)
+    for index, Y_alpha in keyframes.items():
+        gt_Y_alpha[index] = Y_alpha
+        gt_flags[index] = flag
+    return gt_Y_alpha, gt_flags
+
+
+def test_linear_interpolation_between_keyframes():
+    gt_Y_alpha, gt_flags = _frames({2: (100., 0.), 6: (140., 4.)})
+    indexes, Y_alpha, xy_ends = Interpolation.interpolate_gaps(gt_Y_alpha, gt_flags, ORG_W)
+    assert indexes.tolist() == [3, 4, 5]
+    np.testing.assert_allclose(Y_alpha, [[110., 1.], [120., 2.], [130., 3.]])
+    np.testing.assert_allclose(xy_ends, xy_ends_from_y_alpha(Y_alpha[:, 0], Y_alpha[:, 1], ORG_W))
+
+
+def test_leading_and_trailing_runs_are_left_untouched():
+    gt_Y_alpha, gt_flags = _frames({5: (100., 0.), 8: (130., 0.), 12: (90., 0.)})
+    for method in ('linear', 'spline'):
+        indexes, _, _ = Interpolation.interpolate_gaps(gt_Y_alpha, gt_flags, ORG_W, method)
+        assert indexes.tolist() == [6, 7, 9, 10, 11]
+
+
+@pytest.mark.parametrize("keyframes", [{}, {4: (100., 0.)}])
+def test_less_than_two_keyframes_fill_nothing(keyframes):
+    gt_Y_alpha, gt_flags = _frames(keyframes)
+    indexes, Y_alpha, xy_ends = Interpolation.interpolate_gaps(gt_Y_alpha, gt_flags, ORG_W)
+    assert indexes.size == 0 and Y_alpha.shape == (0, 2) and xy_ends.shape == (0, 4)
+
+
+def test_spline_goes_through_keyframes_and_doesnt_overshoot():
+    keyframes = {0: (100., 0.), 5: (150., 1.), 10: (160., 1.), 15: (160., 1.), 19: (120., -2.)}
+    gt_Y_alpha, gt_flags = _frames(keyframes)
+    indexes, Y_alpha, _ = Interpolation.interpolate_gaps(gt_Y_alpha, gt_flags, ORG_W, 'spline')
+    assert indexes.tolist() == [i for i in range(20) if i not in keyframes]
+    filled = gt_Y_alpha.copy()
+    filled[indexes] = Y_alpha
+    # monotone between monotone keyframes, and flat between equal keyframes
+    assert (np.diff(filled[0:11, 0]) >= 0).all()
+    np.testing.assert_allclose(filled[10:16], np.tile((160., 1.), (6, 1)))
+    # differs from the linear interpolation
+    _, linear, _ = Interpolation.interpolate_gaps(gt_Y_alpha, gt_flags, ORG_W, 'linear')
+    assert not np.allclose(linear, Y_alpha)
+
+
+def test_spline_with_two_keyframes_is_linear():
+    gt_Y_alpha, gt_flags = _frames({0: (100., 0.), 4: (140., 8.)})
+    _, linear, _ = Interpolation.interpolate_gaps(gt_Y_alpha, gt_flags, ORG_W, 'linear')
+    _, spline, _ = Interpolation.interpolate_gaps(gt_Y_alpha, gt_flags, ORG_W, 'spline')
+    np.testing.assert_allclose(spline, linear)
+
+
+def test_unknown_method_raises():
+    gt_Y_alpha, gt_flags = _frames({0: (100., 0.), 5: (150., 0.), 10: (160., 0.)})
+    with pytest.raises(ValueError):
+        Interpolation.interpolate_gaps(gt_Y_alpha, gt_flags, ORG_W, 'cubic')
+
+
+def test_tracked_frames_are_kept_and_interpolated_frames_are_refilled():
+    gt_Y_alpha, gt_flags = _frames({0: (100., 0.), 10: (200., 0.)})
+    gt_Y_alpha[3], gt_flags[3] = (500., 0.), TRACKED
+    gt_Y_alpha[6], gt_flags[6] = (500., 0.), INTERPOLATED
+    indexes, Y_alpha, _ = Interpolation.interpolate_gaps(gt_Y_alpha, gt_flags, ORG_W)
+    assert 3 not in indexes and 6 in indexes
+    np.testing.assert_allclose(Y_alpha[indexes.tolist().index(6)], (160., 0.))
+    # the tracked frame isn't used as a keyframe
+    np.testing.assert_allclose(Y_alpha[indexes.tolist().index(2)], (120., 0.))
+
+
+def test_propagated_frames_are_keyframes():
+    gt_Y_alpha, gt_flags = _frames({0: (100., 0.), 10: (200., 0.)})
+    gt_Y_alpha[5], gt_flags[5] = (100., 0.), PROPAGATED
+    indexes, Y_alpha, _ = Interpolation.interpolate_gaps(gt_Y_alpha, gt_flags, ORG_W)
+    assert 5 not in indexes
+    np.testing.assert_allclose(Y_alpha[indexes.tolist().index(2)], (100., 0.))
+    np.testing.assert_allclose(Y_alpha[indexes.tolist().index(8)], (160., 0.))
+
+
+def test_keyframes_without_a_line_are_ignored():
+    gt_Y_alpha, gt_flags = _frames({0: (100., 0.), 10: (200., 0.)})
+    gt_flags[5] = VALIDATED  # validated as "no horizon"
+    indexes, Y_alpha, _ = Interpolation.interpolate_gaps(gt_Y_alpha, gt_flags, ORG_W)
+    assert 5 not in indexes
+    np.testing.assert_allclose(Y_alpha[indexes.tolist().index(6)], (160., 0.))
+
+
+def test_is_keyframe():
+    flags = np.array([NOT_ANNOTATED, VALIDATED, INTERPOLATED, TRACKED, PROPAGATED])
+    assert Interpolation.is_keyframe(flags).tolist() == [False, True, False, False, True]
+
+
+def test_flags_for_gt():
+    gt = np.full((4, 6), np.nan, dtype=np.float32)
+    gt[1] = gt[3] = 1.
+    derived = [NOT_ANNOTATED, VALIDATED, NOT_ANNOTATED, VALIDATED]
+    assert Interpolation.flags_for_gt(gt).tolist() == derived
+    saved = np.array([0, TRACKED, 0, PROPAGATED])
+    assert Interpolation.flags_for_gt(gt, saved).tolist() == saved.tolist()
+    assert Interpolation.flags_for_gt(gt, saved).dtype == np.uint8
+    # stale flags of a gt file of another length
+    assert Interpolation.flags_for_gt(gt, np.ones(5)).tolist() == derived
@@ -0,0 +1,23 @@
+"""
+Import-time checks of the GUI start-up (see AnnotationGUI.StartupBenchmark): the window is shown right after
+AnnotationGUI.Startup is imported, so it must stay cheap and load none of the heavy modules.
+
+The import-time budget is a wall-clock measurement, which is unreliable on loaded machines: it's only checked if the
+environment variable HORIZON_CHECK_STARTUP_BUDGET is set (e.g., HORIZON_CHECK_STARTUP_BUDGET=1 python -m pytest tests).
+"""
+import os
+import pytest
+from AnnotationGUI.StartupBenchmark import measure_import, DEFAULT_BUDGETS
+
+
+def test_startup_loads_no_heavy_module():
+    _, heavy = measure_import("AnnotationGUI.Startup", runs=1)
+    assert heavy == [], "AnnotationGUI.Startup loads {} before the window is shown".format(heavy)
+
+
+@pytest.mark.skipif(not os.environ.get("HORIZON_CHECK_STARTUP_BUDGET"),
+                    reason="wall-clock budget, set HORIZON_CHECK_STARTUP_BUDGET to check it")
+def test_startup_import_is_within_budget():
+    import_ms, _ = measure_import("AnnotationGUI.Startup", runs=5)
+    assert import_ms <= DEFAULT_BUDGETS["import_startup_ms"], \
+        "importing AnnotationGUI.Startup takes {:.1f} ms".format(import_ms)